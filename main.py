@@ -12,18 +12,59 @@ First version of the code.
 """
 
 # Library imports
+import os
+from concurrent.futures import ThreadPoolExecutor
 from numpy import deg2rad, linspace
 import streamlit as st
-import plotly.express as px
 import potentialflowvisualizer as pfv
+import src.cache as cache
+import src.instrumentation as instr
 from src.flowfield import Flowfield
+from src.progressive import ProgressiveDraw, coarse_pass
 from src.commondicts import PRESET_DEFAULT_DICT, ELEMENT_DEFAULT_DICT
 from src.commonfuncs import flow_element_type
 
 #### =================== ####
 #### Session Information ####
 #### =================== ####
-COLOR_SCHEMES = sorted(px.colors.named_colorscales())
+"""
+Bounds of the field and streamline caches shared by all sessions, see
+shared_caches(). The memory bound applies to each of the two caches and can
+be set in MiB with the environment variable POTENTIAL_FLOW_CACHE_MB.
+"""
+SHARED_CACHE_ENTRIES = 64
+SHARED_CACHE_BYTES   = int(float(os.environ.get("POTENTIAL_FLOW_CACHE_MB", 128)) * 2**20)
+
+"""
+Worker processes of a session with "Parallel streamlines" ticked, at most 4
+by default as every session of the server may start its own. Can be set
+with the environment variable POTENTIAL_FLOW_STREAMLINE_WORKERS; below 2,
+the option is disabled.
+"""
+STREAMLINE_WORKERS = int(os.environ.get("POTENTIAL_FLOW_STREAMLINE_WORKERS", min(4, os.cpu_count() or 1)))
+
+"""
+Seconds between checks of a draw in the background, see poll_progressive().
+"""
+POLL_INTERVAL = 0.5
+
+## Static assets, loaded once per server process instead of on every rerun
+@st.cache_resource
+def color_schemes():
+    from plotly.colors import named_colorscales     ## Lighter than plotly.express
+    return sorted(named_colorscales())
+
+@st.cache_data
+def welcome_text(path="README.md"):
+    ## README without its installation section, which is delimited by "---"
+    with open(path, "r") as ifstream:
+        text = ifstream.read().split("---")
+    return text[0] + "---" + text[2]
+
+@st.cache_data
+def logo_bytes(path="images/TU_Delft_Logo.png"):
+    with open(path, "rb") as ifstream:
+        return ifstream.read()
 
 def initialize_session_state():
     default_dict = {"xmin": -2.0,
@@ -31,12 +72,23 @@ def initialize_session_state():
                     "ymin": -2.0,
                     "ymax": 2.0,
                     "xsteps": 100,
+                    "refine": 1,
                     "field": Flowfield(),
                     "figs": {},
                     "colorscheme": "rainbow",
                     "n_contour_lines": 15,
                     "n_streamline_density": 0.5,
-                    "potential_streamline_bool": False
+                    "potential_streamline_bool": False,
+                    "analytic_streamline_bool": False,
+                    "streamline_method": "auto",
+                    "streamline_rtol": 1e-4,
+                    "streamline_decimate": 1e-3,
+                    "compact_figures": True,
+                    "lod_bool": True,
+                    "progressive_bool": True,
+                    "progressive": None,
+                    "show_performance": False,
+                    "performance": None
                    }
 
     for key, val in default_dict.items():
@@ -50,8 +102,22 @@ initialize_session_state()
 #### =========== ####
 #### Draw Graphs ####
 #### =========== ####
-def draw():
-
+@st.cache_resource
+def shared_caches():
+    ## Field and streamline caches of all sessions: identical scenes are computed once per server
+    return (cache.LRUCache(SHARED_CACHE_ENTRIES, SHARED_CACHE_BYTES),
+            cache.LRUCache(SHARED_CACHE_ENTRIES, SHARED_CACHE_BYTES))
+
+@st.cache_resource
+def draw_executor():
+    ## Shared by all sessions and bounded, computes the draws in the background
+    return ThreadPoolExecutor(max_workers=2)
+
+def draw_settings():
+    """
+    Keyword arguments of Flowfield.compute() and render_figure() following
+    the current settings.
+    """
     ## Recalculate gridpoint positions
     y_steps = int(st.session_state["xsteps"]
                   * (st.session_state["ymax"] - st.session_state["ymin"])
@@ -60,16 +126,58 @@ def draw():
     x_points = linspace(st.session_state["xmin"], st.session_state["xmax"], st.session_state["xsteps"])
     y_points = linspace(st.session_state["ymin"], st.session_state["ymax"], y_steps)
 
-    ## Clear dictionary of figures to display and redraw them
-    st.session_state["figs"].clear()
+    compute_kwargs = dict(x_points                  = x_points,
+                          y_points                  = y_points,
+                          n_streamline_density      = st.session_state["n_streamline_density"],
+                          potential_streamline_bool = st.session_state["potential_streamline_bool"],
+                          analytic_streamlines      = st.session_state["analytic_streamline_bool"],
+                          refine                    = st.session_state["refine"],
+                          streamline_method         = st.session_state["streamline_method"],
+                          streamline_rtol           = st.session_state["streamline_rtol"],
+                          streamline_decimate       = st.session_state["streamline_decimate"]
+                         )
+    render_kwargs  = dict(colorscheme               = st.session_state["colorscheme"],
+                          n_contour_lines           = st.session_state["n_contour_lines"],
+                          compact                   = st.session_state["compact_figures"],
+                          lod                       = st.session_state["lod_bool"]
+                         )
+
+    return compute_kwargs, render_kwargs
+
+def draw_signature(compute_kwargs, render_kwargs):
+    """
+    Content hash of the flow elements, the settings of a draw and the
+    evaluation settings of the field.
+    """
+    field    = st.session_state["field"]
+    settings = sorted((k, cache.hash_arrays(v) if k in ("x_points", "y_points") else v)
+                      for k, v in {**compute_kwargs, **render_kwargs}.items())
+    return cache.make_key(cache.hash_elements(field.objects), settings,
+                          field.backend, float(field.tree_tolerance), field.streamline_workers)
 
-    st.session_state["figs"][f"Graphs"] = st.session_state["field"].draw(x_points                  = x_points,
-                                                                         y_points                  = y_points,
-                                                                         colorscheme               = st.session_state["colorscheme"],
-                                                                         n_contour_lines           = st.session_state["n_contour_lines"],
-                                                                         n_streamline_density      = st.session_state["n_streamline_density"],
-                                                                         potential_streamline_bool = st.session_state["potential_streamline_bool"]
-                                                                        )
+def draw():
+    compute_kwargs, render_kwargs = draw_settings()
+    field = st.session_state["field"]
+    field.field_cache, field.streamline_cache = shared_caches()
+
+    ## Clear dictionary of figures to display, and supersede the previous draw of this session
+    st.session_state["figs"].clear()
+    if st.session_state["progressive"] is not None:
+        st.session_state["progressive"].cancel()
+        st.session_state["progressive"] = None
+
+    ## The draw runs as a cancellable job on the executor; a progressive draw shows a coarse preview first
+    passes = [compute_kwargs]
+    if st.session_state["progressive_bool"]:
+        passes.insert(0, coarse_pass(compute_kwargs))
+    job = ProgressiveDraw(field, passes, render_kwargs, draw_signature(compute_kwargs, render_kwargs))
+    if st.session_state["progressive_bool"]:
+        st.session_state["figs"][f"Graphs"] = job.preview()
+    job.start(draw_executor())
+
+    ## Timings and counters of the draw, shown in the performance panel and logged once it is done
+    st.session_state["progressive"] = job
+    st.session_state["performance"] = job.recorder
 
 #### ================ ####
 #### Main application ####
@@ -112,20 +220,35 @@ welcome, add_element, presets, settings = st.sidebar.tabs(
 ## Welcome sidebar tab
 with welcome:
     ## Include the README file into the application
-    with open("README.md", "r") as ifstream:
-        text = ifstream.read()
-        text = text.split("---")
-    st.markdown(text[0] +"---"+ text[2])
+    st.markdown(welcome_text())
     ## TUD logo at bottom of sidebar
-    st.image("images/TU_Delft_Logo.png", width=200)
+    st.image(logo_bytes(), width=200)
 
 ## Graphing Sidebar tab
 with settings:
     st.header("Layout")
-    st.session_state["colorscheme"]               = st.selectbox("Color scheme", options=COLOR_SCHEMES, index=COLOR_SCHEMES.index("rainbow"))
+    st.session_state["colorscheme"]               = st.selectbox("Color scheme", options=color_schemes(), index=color_schemes().index("rainbow"))
     st.session_state["n_contour_lines"]           = st.number_input("Number of filled contours", value=15, min_value=5)
     st.session_state["n_streamline_density"]      = st.number_input("Streamline density", value=0.5, min_value=0.01)
     st.session_state["potential_streamline_bool"] = st.checkbox("Potential 'streamlines'", value=False)
+    st.session_state["analytic_streamline_bool"]  = st.checkbox("Exact streamlines", value=False,
+                                                                help="Trace the streamlines with the exact velocity instead of the grid, allowing fewer $x$-steps.")
+    st.session_state["streamline_method"]         = st.selectbox("Streamline integration", options=["auto", "rk45"],
+                                                                 format_func={"auto": "Fixed steps (RK4)", "rk45": "Adaptive steps (RK45)"}.get,
+                                                                 help="Adaptive steps follow the curvature of the flow and need fewer points on straight stretches.")
+    if st.session_state["streamline_method"] == "rk45":
+        st.session_state["streamline_rtol"]       = st.select_slider("Streamline step tolerance", options=[1e-6, 1e-5, 1e-4, 1e-3, 1e-2], value=1e-4,
+                                                                     format_func=lambda tolerance: f"{tolerance:.0e}",
+                                                                     help="Relative error of an adaptive step. Larger is faster, with fewer points.")
+    st.session_state["streamline_decimate"]       = st.select_slider("Streamline simplification", options=[0, 1e-4, 1e-3, 5e-3], value=1e-3,
+                                                                     format_func=lambda tolerance: "Off" if tolerance == 0 else f"{tolerance:.0e}",
+                                                                     help="Drops streamline points deviating less than this fraction of the domain size from a straight line, which shrinks the figure data.")
+    st.session_state["compact_figures"]           = st.checkbox("Compact figure data", value=True,
+                                                                help="Send the plotted fields as binary single-precision arrays, which loads large grids much faster.")
+    st.session_state["lod_bool"]                  = st.checkbox("Level of detail", value=True,
+                                                                help="Plot the contours at screen resolution. Streamlines and contour levels still use the full grid.")
+    st.session_state["progressive_bool"]          = st.checkbox("Progressive drawing", value=True,
+                                                                help="Show a coarse preview right away, and replace it once the full resolution is computed.")
 
     st.markdown("""----""")
     st.header("Grid")
@@ -134,6 +257,21 @@ with settings:
     st.session_state["ymin"]   = st.number_input("$y$ minimum", max_value=st.session_state["ymax"]-0.01, value=-2.0)
     st.session_state["ymax"]   = st.number_input("$y$ maximum", min_value=st.session_state["ymin"]+0.01, value=2.0)
     st.session_state["xsteps"] = st.number_input("$x$-steps on the grid", value=100, min_value=50)
+    st.session_state["field"].backend = "auto" if st.checkbox("Compiled kernels", value=True,
+                                                              help="Evaluate the flow elements with Numba, if installed.") else "numpy"
+    st.session_state["field"].streamline_workers = STREAMLINE_WORKERS if st.checkbox("Parallel streamlines", value=False,
+                                                                                     disabled=STREAMLINE_WORKERS < 2,
+                                                                                     help=f"Integrate the streamlines in tiles on {STREAMLINE_WORKERS} CPU cores, which pays off for dense streamlines. The lines differ slightly from the sequential ones.") else 0
+    st.session_state["field"].tree_tolerance = st.select_slider("Tree code tolerance", options=[0, 1e-9, 1e-6, 1e-3], value=0,
+                                                                format_func=lambda tolerance: "Off" if tolerance == 0 else f"{tolerance:.0e}",
+                                                                help="Approximates distant sources, vortices and doublets by clusters when there are hundreds of them. Smaller is more accurate.")
+    st.session_state["refine"] = st.number_input("Refinement near singularities", value=1, min_value=1, max_value=8,
+                                                 help="Subdivides the grid this many times, but only evaluates the subdivisions near flow elements and steep gradients exactly.")
+
+    st.markdown("""----""")
+    st.header("Performance")
+    st.session_state["show_performance"] = st.checkbox("Show timings of the last draw", value=False)
+    performance_panel = st.empty()  ## Filled once the figures are displayed
 
 ## Add element sidebar tab
 with add_element:
@@ -163,23 +301,17 @@ with add_element:
 
         ## Ensure Source / Sink overlap does not happen, as it causes an issue with ff.create_streamline()
         if flow_element_type(proto_elem) == 'Source' or flow_element_type(proto_elem) == 'Sink':
-            keys = list(st.session_state["field"].objects.keys())
-            for key in keys:
-                elem = st.session_state["field"].objects[key]
-                # Compare arguments with all other sources/sink
-                if flow_element_type(elem) == 'Source' or flow_element_type(elem) == 'Sink':
-                    x0 = args[0]; y0 = args[1]                # Wish it could be more elegant, but this works.
-                    x1 = elem.x;  y1 = elem.y
-
-                    if abs(x0-x1) < 0.01 or abs(y0-y1) < 0.01:
-                        add_authority = False
+            # Compare arguments with all other sources/sinks at once
+            sources = st.session_state["field"].objects.params(pfv.Source)
+            x0 = args[0]; y0 = args[1]
+            if ((abs(x0 - sources["x"]) < 0.01) | (abs(y0 - sources["y"]) < 0.01)).any():
+                add_authority = False
 
         ## Add item to flowfield dictionary
         if add_authority:
             elem = proto_elem.__class__
-            num  = len(st.session_state["field"].objects) + 1
-            name = f"{num}. [{flow_element_type(proto_elem)}]"
-            st.session_state["field"].objects[name] = elem(*args)
+            st.session_state["field"].objects.add(elem(*args))
+            name = f"{len(st.session_state['field'].objects)}. [{flow_element_type(proto_elem)}]"
 
             st.markdown(f'Added {name}')
 
@@ -206,9 +338,8 @@ with presets:
     if st.button("Add ", key="add_preset"):
         for i, proto_elem in enumerate(proto_preset):
             elem = proto_elem.__class__
-            num  = len(st.session_state["field"].objects) + 1
-            name = f"{num}. [{flow_element_type(proto_elem)}]"
-            st.session_state["field"].objects[name] = elem(*args[i])
+            st.session_state["field"].objects.add(elem(*args[i]))
+            name = f"{len(st.session_state['field'].objects)}. [{flow_element_type(proto_elem)}]"
 
             st.markdown(f'Added {name}')
 
@@ -218,47 +349,78 @@ with presets:
 ## Plot the figures
 st.subheader("Contour Plots")
 st.markdown('Hover over the graph to see information on the shown field itself, if there are no elements, add them in yourself.')
+
+## Draw in the background: show its latest figure, and cancel it if the inputs changed since
+job = st.session_state["progressive"]
+if job is not None:
+    shown_level = job.level     ## Read before the figure, a finer figure in between only reruns once more
+    if not job.is_current(draw_signature(*draw_settings())):
+        job.cancel()
+    elif job.figure is not None:
+        st.session_state["figs"][f"Graphs"] = job.figure
+    if job.done or job.cancelled:
+        job.recorder.log()
+        st.session_state["progressive"] = None
+
+display = instr.Recorder()
 for title, fig in st.session_state["figs"].items():
-    st.plotly_chart(fig)
+    with display.timer("plotly_chart"):
+        st.plotly_chart(fig)
+    if st.session_state["show_performance"]:
+        display.count("figure.json_bytes", len(fig.to_json()))
+
+## Performance panel in the settings tab
+if st.session_state["show_performance"] and st.session_state["performance"] is not None:
+    with performance_panel.container():
+        for recorder in (st.session_state["performance"], display):
+            measurements = recorder.to_dict()
+            st.table([{"stage": name, "seconds": f"{t['seconds']:.4f}", "calls": t["calls"]}
+                      for name, t in measurements["timings"].items()])
+            if measurements["counters"]:
+                st.table([{"counter": name, "value": value} for name, value in measurements["counters"].items()])
 
 ## Adjust the flow elements
 if not len(st.session_state["field"].objects) == 0:
     st.markdown("""----""")
     st.subheader("Adjust your flow elements")
 
-    key     = st.selectbox("Select Flow Element", options=st.session_state["field"].objects.keys(), key='adjust_selectbox')
-    elem    = st.session_state["field"].objects[key]
+    store   = st.session_state["field"].objects
+    labels  = store.labels()
+    id      = st.selectbox("Select Flow Element", options=list(store), format_func=labels.get, key='adjust_selectbox')
+    kind    = store.type_name(id)
 
-    # Adjustment field
-    for k, v in elem.__dict__.items():
+    # Adjustment field, widgets keyed on the stable element ID
+    values  = {}
+    for k, v in store.parameters(id).items():
         # usually strength has some condition, i.e. Sources / Sinks are defined by their sign, so we add case studies
         if k == 'strength':
-            if   flow_element_type(elem) == 'Source':
-                elem.__dict__[k] = st.number_input(f"{k}", value=float(v), min_value= 0.01, key=f"adjust_{elem}_{k}")
-            elif flow_element_type(elem) == 'Sink':
-                elem.__dict__[k] = st.number_input(f"{k}", value=float(v), max_value=-0.01, key=f"adjust_{elem}_{k}")
+            if   kind == 'Source':
+                values[k] = st.number_input(f"{k}", value=float(v), min_value= 0.01, key=f"adjust_{id}_{k}")
+            elif kind == 'Sink':
+                values[k] = st.number_input(f"{k}", value=float(v), max_value=-0.01, key=f"adjust_{id}_{k}")
             else:
-                elem.__dict__[k] = st.number_input(f"{k}", value=float(v), key=f"adjust_{elem}_{k}")
+                values[k] = st.number_input(f"{k}", value=float(v), key=f"adjust_{id}_{k}")
         # otherwise it is inputs
         else:
-            elem.__dict__[k] = st.number_input(f"{k}", value=float(v), key=f"adjust_{elem}_{k}")
+            values[k] = st.number_input(f"{k}", value=float(v), key=f"adjust_{id}_{k}")
+    store.update(id, **values)
 
 
 
-    # Removal field
+    # Removal field, the numbering of the other elements follows from their order
     if st.button("Remove Flow", key="remove"):
+        store.remove(id)
+        st.markdown(f'Removed {labels[id]}')
 
-        del st.session_state["field"].objects[key]
-        st.markdown(f'Removed {key}')
-
-        ## Rename all keys such that numbering is correct
-        old_keys = list(st.session_state["field"].objects.keys()) # Ensure that the keys aren't changed at the same time as entries (hence the list)
-        for i, k_old in enumerate( old_keys ):
-            elem = st.session_state["field"].objects[k_old]
-            k_new = f'{i+1}. [{flow_element_type(elem)}]'
+    st.markdown("""----""")
 
-            # Remove first, then add: if not, then del (...) will remove all entries with the same name!
-            del st.session_state["field"].objects[k_old]
-            st.session_state["field"].objects[k_new] = elem
+## Rerun once a draw in the background has a finer figure or has finished, the figure is not sent again meanwhile
+@st.fragment(run_every=POLL_INTERVAL)
+def poll_progressive(level):
+    job = st.session_state["progressive"]
+    if job is None or job.done or job.level != level:
+        st.rerun()
+    st.caption("Refining the figure...")
 
-    st.markdown("""----""")
+if st.session_state["progressive"] is not None:
+    poll_progressive(shown_level)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import numpy as np
+
+"""
+Default threshold of the refinement indicator: a coarse cell is refined if a
+field varies over it by more than this fraction of the field's 5-95
+percentile range.
+"""
+REFINE_TOLERANCE = 0.05
+
+## Functions
+def refine_axis(points, refine):
+    """
+    Evenly spaced axis with refine - 1 extra samples between every two
+    samples of the given axis.
+
+    Parameters:
+        points : np.ndarray
+            Evenly spaced coarse axis.
+        refine : int
+            Refinement factor.
+    Returns:
+        fine   : np.ndarray
+            (len(points) - 1) * refine + 1 samples over the same extent.
+    """
+    return np.linspace(points[0], points[-1], (len(points) - 1) * refine + 1)
+
+def coarse_indices(n, refine):
+    """
+    Every refine-th index of an axis of n samples, always including the
+    last one.
+    """
+    return np.unique(np.append(np.arange(0, n, refine), n - 1))
+
+def cell_coordinates(n, coarse):
+    """
+    Coarse cell containing every fine sample, and the relative position of
+    the sample within it.
+
+    Parameters:
+        n      : int
+            Number of fine samples.
+        coarse : np.ndarray
+            Indices of the coarse samples, see coarse_indices().
+    Returns:
+        cells   : np.ndarray
+            (n,) index of the cell, between coarse[cells] and
+            coarse[cells + 1].
+        weights : np.ndarray
+            (n,) position within the cell, 0 at its start and 1 at its end.
+    """
+    fine    = np.arange(n)
+    cells   = np.clip(np.searchsorted(coarse, fine, side="right") - 1, 0, len(coarse) - 2)
+    weights = (fine - coarse[cells]) / (coarse[cells + 1] - coarse[cells])
+
+    return cells, weights
+
+def interpolate(values, cells_x, weights_x, cells_y, weights_y):
+    """
+    Bilinear resampling of coarse grid values onto the fine grid.
+
+    Parameters:
+        values             : np.ndarray
+            (ny, nx) values on the coarse grid.
+        cells_x, weights_x : np.ndarray
+            Cell coordinates of the fine x-samples, see cell_coordinates().
+        cells_y, weights_y : np.ndarray
+            Cell coordinates of the fine y-samples.
+    Returns:
+        fine               : np.ndarray
+            Values on the fine grid.
+    """
+    wx  = weights_x[None, :]
+    wy  = weights_y[:, None]
+    iy  = cells_y[:, None]
+    ix  = cells_x[None, :]
+    with np.errstate(invalid="ignore"):
+        top    = values[iy, ix] * (1 - wx) + values[iy, ix + 1] * wx
+        bottom = values[iy + 1, ix] * (1 - wx) + values[iy + 1, ix + 1] * wx
+        return top * (1 - wy) + bottom * wy
+
+def singular_points(objects):
+    """
+    Positions where the flow objects are singular: the location of point
+    elements and the end points of line elements.
+
+    Parameters:
+        objects : iterable of pfv.object
+            Flow objects that belong to the potentialflowvisualizer module.
+    Returns:
+        points  : list of (float, float)
+    """
+    points = []
+    for object in objects:
+        if hasattr(object, "x") and hasattr(object, "y"):
+            points.append((object.x, object.y))
+        if hasattr(object, "x1"):
+            points += [(object.x1, object.y1), (object.x2, object.y2)]
+
+    return points
+
+def flag_cells(fields, x_coarse, y_coarse, singularities, tolerance=REFINE_TOLERANCE):
+    """
+    Coarse cells to evaluate exactly instead of by interpolation.
+
+    A cell is flagged if it contains a singular point, if a corner value is
+    not finite, or if any field varies over the cell by more than tolerance
+    times its 5-95 percentile range. The flags are dilated by one cell, such
+    that the edges of flagged cells and the surroundings of singularities
+    are resolved as well.
+
+    Parameters:
+        fields        : iterable of np.ndarray
+            (ny, nx) field values on the coarse grid.
+        x_coarse      : np.ndarray
+            x-values of the coarse grid.
+        y_coarse      : np.ndarray
+            y-values of the coarse grid.
+        singularities : list of (float, float)
+            See singular_points().
+        tolerance     : float
+            Refinement threshold.
+    Returns:
+        flags         : np.ndarray
+            (ny - 1, nx - 1) boolean array of the flagged cells.
+    """
+    flags = np.zeros((len(y_coarse) - 1, len(x_coarse) - 1), dtype=bool)
+    for values in fields:
+        corners   = np.stack((values[:-1, :-1], values[:-1, 1:], values[1:, :-1], values[1:, 1:]))
+        finite    = np.isfinite(corners).all(axis=0)
+        flags    |= ~finite
+        if finite.any():
+            low, high  = np.nanpercentile(values[np.isfinite(values)], (5, 95))
+            variation  = np.where(finite, np.ptp(np.where(finite, corners, 0), axis=0), 0)
+            flags     |= variation > tolerance * max(high - low, np.finfo(float).tiny)
+
+    for x, y in singularities:
+        ix = np.searchsorted(x_coarse, x, side="right") - 1
+        iy = np.searchsorted(y_coarse, y, side="right") - 1
+        if 0 <= ix < flags.shape[1] and 0 <= iy < flags.shape[0]:
+            flags[iy, ix] = True
+
+    ## Dilate by one cell in every direction
+    padded = np.pad(flags, 1)
+    dilated = np.zeros_like(flags)
+    for dy in range(3):
+        for dx in range(3):
+            dilated |= padded[dy:dy + flags.shape[0], dx:dx + flags.shape[1]]
+
+    return dilated
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Headless batch runner for parametric sweeps of flow fields.
+
+A sweep spec (JSON file or dictionary) describes the flow elements, the grid
+and the parameters to vary, e.g.
+
+    {"preset"  : "Rotating Cylinder",
+     "grid"    : {"xmin": -2, "xmax": 2, "ymin": -2, "ymax": 2, "xsteps": 100},
+     "sweep"   : {"3.strength": [0, 6.28, 12.57], "1.angle": [0, 5, 10]},
+     "settings": {"n_streamline_density": 0.5}
+    }
+
+Every combination of the swept values is one case. Parameters are named
+"<element number>.<attribute>", numbered from 1 as in the app; uniform flows
+also accept "speed" and "angle" (degrees). Cases are evaluated in a process
+pool and the fields of every case are written to "case_<index>.npz", the
+figures to "case_<index>.html", together with a "cases.json" manifest.
+
+Usage:
+    python -m src.batch spec.json output_dir [--workers N] [--no-figures]
+"""
+
+# Library imports
+import argparse
+import copy
+import itertools
+import json
+import math as m
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from src.flowfield import Flowfield
+from src.renderer import render_figure
+from src.commondicts import PRESET_DEFAULT_DICT, ELEMENT_DEFAULT_DICT
+from src.commonfuncs import flow_element_type
+
+"""
+Grid used when the sweep spec does not give one, same as the app defaults.
+"""
+DEFAULT_GRID = {"xmin": -2.0, "xmax": 2.0, "ymin": -2.0, "ymax": 2.0, "xsteps": 100}
+
+"""
+Keyword arguments of Flowfield.compute() and render_figure() that can be set
+under "settings" in the sweep spec.
+"""
+COMPUTE_SETTINGS = ("n_streamline_density", "potential_streamline_bool", "streamline_method", "analytic_streamlines",
+                    "refine", "streamline_decimate", "streamline_rtol", "streamline_atol")
+RENDER_SETTINGS  = ("colorscheme", "n_contour_lines", "compact", "lod")
+
+## State of a worker process, set once by _init_worker()
+_worker = {}
+
+## Functions
+def make_grid(grid):
+    """
+    Grid points of a sweep, spaced like the grid of the app.
+
+    Parameters:
+        grid     : dict
+            "xmin", "xmax", "ymin", "ymax" and "xsteps", see DEFAULT_GRID.
+    Returns:
+        x_points, y_points : np.ndarray
+            x- and y-values of the grid.
+    """
+    grid     = {**DEFAULT_GRID, **grid}
+    y_steps  = int(grid["xsteps"] * (grid["ymax"] - grid["ymin"]) / (grid["xmax"] - grid["xmin"]))
+    x_points = np.linspace(grid["xmin"], grid["xmax"], int(grid["xsteps"]))
+    y_points = np.linspace(grid["ymin"], grid["ymax"], y_steps)
+
+    return x_points, y_points
+
+def make_elements(spec):
+    """
+    Flow objects of the base case of a sweep.
+
+    Parameters:
+        spec     : dict
+            Sweep spec with either a "preset" name of PRESET_DEFAULT_DICT,
+            or a list of "elements", each a dictionary with a "type" of
+            ELEMENT_DEFAULT_DICT and optionally its parameters.
+    Returns:
+        elements : list of pfv.object
+            Fresh flow objects, in the order of the spec.
+    """
+    if "preset" in spec:
+        try:
+            return [copy.copy(object) for object in PRESET_DEFAULT_DICT[spec["preset"]]]
+        except KeyError:
+            raise ValueError(f"Unknown preset '{spec['preset']}'")
+
+    elements = []
+    for entry in spec.get("elements", []):
+        entry = dict(entry)
+        try:
+            object = copy.copy(ELEMENT_DEFAULT_DICT[entry.pop("type")])
+        except KeyError:
+            raise ValueError(f"Unknown flow element in {entry}")
+        set_parameters(object, entry)
+        elements.append(object)
+
+    return elements
+
+def set_parameters(object, parameters):
+    """
+    Sets parameters of a flow object.
+
+    The "speed" and "angle" of a uniform flow are applied together, such
+    that u and v follow from the given pair; only a missing one of the two
+    is taken from the current components of the flow.
+
+    Parameters:
+        object     : pfv.object
+            Flow object that belongs to the potentialflowvisualizer module.
+        parameters : dict
+            Attribute of the object, or "speed" or "angle" (degrees) for
+            uniform flows, to its new value.
+    """
+    parameters = dict(parameters)
+    if flow_element_type(object) == "Uniform" and ("speed" in parameters or "angle" in parameters):
+        speed = float(parameters.pop("speed", m.hypot(object.u, object.v)))
+        angle = m.radians(float(parameters.pop("angle", m.degrees(m.atan2(object.v, object.u)))))
+        object.u = speed * m.cos(angle)
+        object.v = speed * m.sin(angle)
+
+    for name, value in parameters.items():
+        if name not in object.__dict__:
+            raise ValueError(f"{flow_element_type(object)} has no parameter '{name}'")
+        object.__dict__[name] = float(value)
+
+def expand_sweep(spec):
+    """
+    All cases of a sweep, the Cartesian product of the swept values.
+
+    Parameters:
+        spec  : dict
+            Sweep spec, mapping "<element number>.<attribute>" to a list of
+            values under "sweep".
+    Returns:
+        cases : list of dict
+            Parameter name to value for every case. The last swept
+            parameter varies fastest.
+    """
+    sweep = spec.get("sweep", {})
+    names = list(sweep.keys())
+
+    return [dict(zip(names, values)) for values in itertools.product(*(sweep[name] for name in names))]
+
+def apply_case(elements, base, parameters):
+    """
+    Resets flow objects in place to the base case and applies the
+    parameters of one case.
+
+    The objects are modified rather than replaced; run_case() copies them
+    into the element store of the worker under the same IDs, such that the
+    field only re-evaluates the elements that differ from its previous case,
+    see Flowfield.superpose().
+    """
+    for object, reference in zip(elements, base):
+        object.__dict__.update(reference.__dict__)
+
+    ## Grouped per element, such that a swept speed and angle are applied as a pair
+    grouped = {}
+    for name, value in parameters.items():
+        number, attribute = name.split(".", 1)
+        index = int(number) - 1
+        if not 0 <= index < len(elements):
+            raise ValueError(f"Parameter '{name}' refers to a missing flow element")
+        grouped.setdefault(index, {})[attribute] = value
+    for index, attributes in grouped.items():
+        set_parameters(elements[index], attributes)
+
+def _init_worker(spec, output_dir, figures):
+    """
+    Sets up the state shared by all cases of a worker process: the grid,
+    the flow objects and the Flowfield reusing its results across cases.
+    """
+    base     = make_elements(spec)
+    elements = [copy.copy(object) for object in base]
+    settings = spec.get("settings", {})
+    field    = Flowfield(elements)
+
+    _worker.clear()
+    _worker.update(grid       = make_grid(spec.get("grid", {})),
+                   base       = base,
+                   elements   = elements,
+                   field      = field,
+                   ids        = list(field.objects),
+                   compute    = {k: settings[k] for k in COMPUTE_SETTINGS if k in settings},
+                   render     = {k: settings[k] for k in RENDER_SETTINGS if k in settings},
+                   output_dir = output_dir,
+                   figures    = figures,
+                  )
+
+def run_case(index, parameters):
+    """
+    Evaluates one case in the worker process and writes it to disk.
+
+    Parameters:
+        index      : int
+            Number of the case, used in the file names.
+        parameters : dict
+            Parameter name to value, see expand_sweep().
+    Returns:
+        files      : list of string
+            Paths of the files written.
+    """
+    x_points, y_points = _worker["grid"]
+    apply_case(_worker["elements"], _worker["base"], parameters)
+    for id, object in zip(_worker["ids"], _worker["elements"]):
+        _worker["field"].objects.update(id, **object.__dict__)
+    result = _worker["field"].compute(x_points, y_points, **_worker["compute"])
+
+    stem   = os.path.join(_worker["output_dir"], f"case_{index:05d}")
+    arrays = {name: getattr(result, name) for name in ("xvel", "yvel", "potential", "streamfunction",
+                                                       "pressure", "velmag")
+              if getattr(result, name) is not None}
+    if result.streamlines is not None:
+        arrays["streamlines_x"] = result.streamlines.lines_x
+        arrays["streamlines_y"] = result.streamlines.lines_y
+    np.savez_compressed(stem + ".npz", x_points=x_points, y_points=y_points, **arrays)
+    files  = [stem + ".npz"]
+
+    if _worker["figures"]:
+        render_figure(result, **_worker["render"]).write_html(stem + ".html", include_plotlyjs="cdn")
+        files.append(stem + ".html")
+
+    return files
+
+def run_sweep(spec, output_dir, max_workers=None, figures=True):
+    """
+    Evaluates all cases of a sweep in a process pool.
+
+    Consecutive cases, which differ in the fastest varying parameters only,
+    are handed to the same worker in chunks, so that most cases only
+    re-evaluate the swept elements.
+
+    Parameters:
+        spec        : dict
+            Sweep spec, see the module docstring.
+        output_dir  : string
+            Directory the results are written to, created if needed.
+        max_workers : int, optional
+            Number of worker processes, defaults to the number of CPUs.
+        figures     : bool, optional
+            Also write the plotly figure of every case.
+    Returns:
+        cases       : list of dict
+            Index, parameters and written files of every case, as stored in
+            the "cases.json" manifest.
+    """
+    cases = expand_sweep(spec)
+    make_elements(spec)                         ## Fail early on an invalid spec
+    os.makedirs(output_dir, exist_ok=True)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize   = max(1, len(cases) // (4 * max_workers))
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(spec, output_dir, figures)
+                            ) as executor:
+        files = list(executor.map(run_case, range(len(cases)), cases, chunksize=chunksize))
+
+    manifest = [{"index": i, "parameters": parameters, "files": [os.path.basename(f) for f in written]}
+                for i, (parameters, written) in enumerate(zip(cases, files))]
+    with open(os.path.join(output_dir, "cases.json"), "w") as ofstream:
+        json.dump({"spec": spec, "cases": manifest}, ofstream, indent=4)
+
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate a parametric sweep of potential flows without the app.")
+    parser.add_argument("spec", help="JSON file with the sweep spec")
+    parser.add_argument("output_dir", help="directory to write the results to")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: all CPUs)")
+    parser.add_argument("--no-figures", action="store_true", help="only write the fields, not the figures")
+    args = parser.parse_args(argv)
+
+    with open(args.spec, "r") as ifstream:
+        spec = json.load(ifstream)
+
+    cases = run_sweep(spec, args.output_dir, args.workers, not args.no_figures)
+    print(f"Wrote {len(cases)} cases to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite for the field evaluation, streamline integration and figure
+construction behind Flowfield.draw().
+
+Every scenario of SCENARIO_DICT is run through the stages of a draw, each on
+a fresh Flowfield so that no cached results are reused:
+
+    fields               : Flowfield.compute_fields()
+    streamlines          : Flowfield.compute_streamlines(), default scheme
+    streamlines_rk4      : Flowfield.compute_streamlines(), one seed at a time
+                           (_Streamline.rk4_integrate)
+    streamlines_parallel : Flowfield.compute_streamlines(), default scheme in
+                           tiles on all CPUs (Flowfield.streamline_workers)
+    figure               : render_figure()
+
+Per stage, the best and median wall time over the repeats, the peak memory
+allocated (tracemalloc, in a separate untimed pass) and the number of
+points produced are reported. Results can be written to JSON and compared
+against an earlier run to track regressions.
+
+With --imports, the startup cost of the app is measured instead: the time
+to import the modules of main.py in a fresh interpreter, checked against
+IMPORT_BUDGET.
+
+Usage:
+    python -m src.benchmark [--scenarios a b ...] [--repeat N] [--output results.json]
+                            [--compare baseline.json] [--threshold 0.1]
+    python -m src.benchmark --imports [--repeat N]
+"""
+
+# Library imports
+import argparse
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import potentialflowvisualizer as pfv
+from src.flowfield import Flowfield
+from src.fieldresult import FieldResult, element_markers
+from src.renderer import render_figure
+from src.commondicts import PRESET_DEFAULT_DICT
+
+## Scenario builders
+## Every builder returns the flow objects, the grid points and keyword
+## arguments of Flowfield.compute_streamlines(). Random scenarios are seeded,
+## such that every run evaluates the same flow.
+def _preset(name):
+    return [copy.copy(object) for object in PRESET_DEFAULT_DICT[name]]
+
+def _cylinder():
+    return _preset("Cylinder"), np.linspace(-2, 2, 200), np.linspace(-2, 2, 200), {}
+
+def _rotating_cylinder():
+    return _preset("Rotating Cylinder"), np.linspace(-2, 2, 200), np.linspace(-2, 2, 200), {}
+
+def _random_sources():
+    rng      = np.random.default_rng(0)
+    objects  = [pfv.Freestream(1, 0)]
+    for strength, x, y in zip(rng.choice([-1, 1], 100) * rng.uniform(0.5, 2, 100),
+                              rng.uniform(-8, 8, 100), rng.uniform(-8, 8, 100)):
+        objects.append(pfv.Source(float(strength), float(x), float(y)))
+    return objects, np.linspace(-10, 10, 200), np.linspace(-10, 10, 200), {}
+
+def _vortex_sheet():
+    objects  = [pfv.Freestream(1, 0)]
+    objects += [pfv.Vortex(0.02, float(x), 0) for x in np.linspace(-1, 1, 200)]
+    return objects, np.linspace(-2, 2, 200), np.linspace(-2, 2, 200), {}
+
+def _large_grid():
+    return _preset("Rotating Cylinder"), np.linspace(-2, 2, 1000), np.linspace(-2, 2, 1000), {}
+
+def _dense_streamlines():
+    return (_preset("Rotating Cylinder"), np.linspace(-2, 2, 200), np.linspace(-2, 2, 200),
+            {"n_streamline_density": 3})
+
+"""
+Benchmark scenarios, name to builder.
+"""
+SCENARIO_DICT = {
+    "cylinder"          : _cylinder,
+    "rotating_cylinder" : _rotating_cylinder,
+    "random_sources"    : _random_sources,
+    "vortex_sheet"      : _vortex_sheet,
+    "large_grid"        : _large_grid,
+    "dense_streamlines" : _dense_streamlines,
+}
+
+"""
+Stages of a draw, in execution order.
+"""
+STAGES = ("fields", "streamlines", "streamlines_rk4", "streamlines_parallel", "figure")
+
+"""
+Modules imported by the app entry point, main.py, apart from streamlit.
+Third-party modules the app cannot start without are imported first and
+timed separately, the import budget applies to the rest [s].
+"""
+BASE_MODULES  = ("numpy", "potentialflowvisualizer")
+APP_MODULES   = ("src.cache", "src.instrumentation", "src.flowfield", "src.progressive", "src.commondicts",
+                 "src.commonfuncs")
+IMPORT_BUDGET = 0.25
+
+## Functions
+def measure_imports(repeat=3):
+    """
+    Import times of BASE_MODULES and APP_MODULES, each the best over
+    repeat fresh interpreters, such that no module is cached.
+
+    Returns:
+        times : dict
+            "base" and "app" import times [s].
+    """
+    code = ("import time\n"
+            "start = time.perf_counter()\n"
+            f"import {', '.join(BASE_MODULES)}\n"
+            "middle = time.perf_counter()\n"
+            f"import {', '.join(APP_MODULES)}\n"
+            "print(middle - start, time.perf_counter() - middle)\n")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        runs.append([float(value) for value in output.stdout.split()[-2:]])
+
+    return {"base": min(run[0] for run in runs), "app": min(run[1] for run in runs)}
+
+def _streamline_points(streamlines):
+    return 0 if streamlines is None else int(streamlines.n_points)
+
+def _measure(function, trace_memory):
+    """
+    Wall time, and peak memory if tracemalloc is tracing, of function().
+    """
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start   = time.perf_counter()
+    value   = function()
+    elapsed = time.perf_counter() - start
+    peak    = tracemalloc.get_traced_memory()[1] if trace_memory else None
+
+    return value, elapsed, peak
+
+def run_stages(objects, x_points, y_points, options, stages=STAGES, trace_memory=False):
+    """
+    Runs the stages of one draw on a fresh Flowfield.
+
+    Inputs a stage depends on (e.g. the fields for the streamlines) are
+    computed beforehand and are not part of its measurement.
+
+    Returns:
+        stats : dict
+            Per stage: "time" [s], "peak_bytes" (only with trace_memory)
+            and the point counts of its output.
+    """
+    field             = Flowfield(objects)
+    field_key, fields = field.compute_fields(x_points, y_points) if "fields" not in stages else (None, None)
+    lines             = None
+    stats             = {}
+
+    for stage in stages:
+        if stage == "fields":
+            (field_key, fields), elapsed, peak = _measure(lambda: field.compute_fields(x_points, y_points),
+                                                         trace_memory)
+            counts = {"grid_points": int(x_points.size * y_points.size)}
+
+        elif stage in ("streamlines", "streamlines_rk4", "streamlines_parallel"):
+            kwargs = dict(options)
+            if stage == "streamlines_rk4":
+                kwargs["streamline_method"] = "rk4"
+            field.streamline_workers = (os.cpu_count() or 1) if stage == "streamlines_parallel" else 0
+            field.streamline_cache.clear()
+            (streamlines, potentiallines), elapsed, peak = _measure(
+                lambda: field.compute_streamlines(field_key, fields, x_points, y_points, **kwargs),
+                trace_memory)
+            if stage == "streamlines":
+                lines = (streamlines, potentiallines)
+            counts = {"lines" : int(streamlines.n_lines),
+                      "steps" : int(streamlines.n_steps),
+                      "points": _streamline_points(streamlines) + _streamline_points(potentiallines)}
+
+        elif stage == "figure":
+            field.streamline_workers = 0
+            if lines is None:
+                lines = field.compute_streamlines(field_key, fields, x_points, y_points, **options)
+            result = FieldResult(x_points, y_points, fields, *lines, element_markers(objects))
+            fig, elapsed, peak = _measure(lambda: render_figure(result), trace_memory)
+            counts = {"traces"    : len(fig.data),
+                      "json_bytes": len(fig.to_json())}
+
+        stats[stage] = {"time": elapsed, **counts}
+        if trace_memory:
+            stats[stage]["peak_bytes"] = peak
+
+    return stats
+
+def run_scenario(name, repeat=3, stages=STAGES):
+    """
+    Benchmarks one scenario.
+
+    Parameters:
+        name   : string
+            Key of SCENARIO_DICT.
+        repeat : int
+            Number of timed runs per stage.
+        stages : tuple of string
+            Stages to run, see STAGES.
+    Returns:
+        report : dict
+            Per stage: "best" and "median" wall time [s], "peak_bytes" and
+            the point counts of its output.
+    """
+    objects, x_points, y_points, options = SCENARIO_DICT[name]()
+    runs   = [run_stages(objects, x_points, y_points, options, stages) for _ in range(repeat)]
+
+    ## Peak memory in a separate pass, as tracing allocations slows them down
+    tracemalloc.start()
+    try:
+        traced = run_stages(objects, x_points, y_points, options, stages, trace_memory=True)
+    finally:
+        tracemalloc.stop()
+
+    report = {}
+    for stage in stages:
+        times         = [run[stage].pop("time") for run in runs]
+        report[stage] = {**runs[-1][stage],
+                         "peak_bytes": traced[stage]["peak_bytes"],
+                         "best"      : min(times),
+                         "median"    : float(np.median(times)),
+                        }
+
+    return report
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Stages whose best time regressed compared to an earlier run.
+
+    Parameters:
+        results   : dict
+            Output of run_scenario() per scenario.
+        baseline  : dict
+            Same structure, from an earlier run.
+        threshold : float
+            Relative slowdown that counts as a regression.
+    Returns:
+        regressions : list of (scenario, stage, baseline, current)
+            Best wall times of every regressed stage.
+    """
+    regressions = []
+    for scenario, report in results.items():
+        for stage, stats in report.items():
+            try:
+                reference = baseline[scenario][stage]["best"]
+            except KeyError:
+                continue
+            if stats["best"] > reference * (1 + threshold):
+                regressions.append((scenario, stage, reference, stats["best"]))
+
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark field evaluation, streamlines and figure construction.")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIO_DICT), default=list(SCENARIO_DICT))
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (default: 3)")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as regression")
+    parser.add_argument("--imports", action="store_true", help="only measure the import time of the app")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        times = measure_imports(args.repeat)
+        print(f"third-party modules {times['base']:.3f}s, app modules {times['app']:.3f}s "
+              f"(budget {IMPORT_BUDGET:.3f}s)")
+        if times["app"] > IMPORT_BUDGET:
+            print("Import time over budget")
+            raise SystemExit(1)
+        return
+
+    results = {}
+    print(f"{'scenario':<20}{'stage':<22}{'best [s]':>10}{'median [s]':>12}{'peak [MiB]':>12}  output")
+    for name in args.scenarios:
+        results[name] = run_scenario(name, args.repeat, tuple(s for s in STAGES if s in args.stages))
+        for stage, stats in results[name].items():
+            counts = ", ".join(f"{k}={v}" for k, v in stats.items() if k not in ("best", "median", "peak_bytes"))
+            print(f"{name:<20}{stage:<22}{stats['best']:>10.4f}{stats['median']:>12.4f}"
+                  f"{stats['peak_bytes'] / 2**20:>12.1f}  {counts}")
+
+    if args.output:
+        with open(args.output, "w") as ofstream:
+            json.dump({"machine": platform.platform(), "numpy": np.__version__, "results": results},
+                      ofstream, indent=4)
+
+    if args.compare:
+        with open(args.compare, "r") as ifstream:
+            baseline = json.load(ifstream)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for scenario, stage, reference, current in regressions:
+            print(f"Regression: {scenario}/{stage} {reference:.4f}s -> {current:.4f}s")
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import src.cancellation as cancel
+from src.elementstore import ElementStore
+
+"""
+Seconds between checks for cancellation while waiting for a value that
+another thread is computing, see LRUCache.get_or_compute().
+"""
+PENDING_POLL = 0.05
+
+## Functions
+def nbytes_of(value):
+    """
+    Estimates the memory held by a cached value.
+
+    Parameters:
+        value  : object
+            numpy array, or a (nested) tuple, list, dict or object whose
+            attributes hold numpy arrays.
+    Returns:
+        nbytes : int
+            Sum of the sizes of all numpy arrays found in the value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes_of(item) for item in value)
+    if isinstance(value, dict):
+        return sum(nbytes_of(item) for item in value.values())
+    if hasattr(value, "__dict__"):
+        return nbytes_of(vars(value))
+    return 0
+
+def hash_elements(objects):
+    """
+    Content hash of flow objects, independent of their identity.
+
+    Parameters:
+        objects : iterable of pfv.object or ElementStore
+            Flow objects that belong to the potentialflowvisualizer module,
+            in summation order.
+    Returns:
+        digest  : string
+            Hexadecimal digest of the class and parameters of every object.
+    """
+    if isinstance(objects, ElementStore):
+        return objects.content_hash()
+
+    h = hashlib.sha1()
+    for object in objects:
+        h.update(object.__class__.__qualname__.encode())
+        h.update(repr(sorted(object.__dict__.items())).encode())
+    return h.hexdigest()
+
+def hash_arrays(*arrays):
+    """
+    Content hash of numpy arrays, including their shape and type.
+
+    Parameters:
+        arrays : np.ndarray
+            Arrays to hash.
+    Returns:
+        digest : string
+            Hexadecimal digest of all arrays.
+    """
+    h = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        h.update(f"{array.dtype.str}{array.shape}".encode())
+        h.update(array.tobytes())
+    return h.hexdigest()
+
+def make_key(*parts):
+    """
+    Combines hashable parts (digests, numbers, strings) into one cache key.
+    """
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+## LRUCache Class
+class LRUCache:
+    """
+    Least-recently-used cache bounded in number of entries and in memory.
+    Safe to share between threads.
+
+    Parameters:
+        max_entries : int
+            Maximum number of entries kept.
+        max_bytes   : int
+            Maximum total size of the numpy arrays held by the entries, see
+            nbytes_of(). A single entry larger than this is not stored.
+    """
+    def __init__(self, max_entries=16, max_bytes=256 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.nbytes      = 0
+        self.hits        = 0
+        self.misses      = 0
+        self._entries    = OrderedDict()    ## key -> (value, nbytes)
+        self._pending    = {}               ## key -> lock held while computing it, see get_or_compute()
+        self._lock       = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored under key and marks it as most recently
+        used, or default if there is none.
+        """
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Stores value under key, evicting the least recently used entries
+        until the cache fits its bounds again.
+        """
+        nbytes = nbytes_of(value)
+        with self._lock:
+            self.pop(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.nbytes       += nbytes
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes    -= evicted
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the value stored under key, or computes it with compute()
+        and stores it. Threads asking for a key that is being computed wait
+        for that result instead of computing it again; a cancelled
+        computation stops waiting at the next check, see
+        src/cancellation.py.
+
+        Returns:
+            value : object
+            hit   : bool
+                False if this call computed the value.
+        """
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    return self.get(key), True
+                pending = self._pending.setdefault(key, threading.Lock())
+
+            while not pending.acquire(timeout=PENDING_POLL):
+                cancel.checkpoint()
+            try:
+                ## Woken by a computation that stored its value, or that failed or stored nothing and
+                ## thereby left this lock orphaned: retry, such that only the holder of the registered
+                ## lock computes
+                with self._lock:
+                    if key in self._entries:
+                        return self.get(key), True
+                    if self._pending.get(key) is not pending:
+                        continue
+                try:
+                    value = compute()
+                    self.put(key, value)
+                finally:
+                    with self._lock:
+                        if self._pending.get(key) is pending:
+                            del self._pending[key]
+                return value, False
+            finally:
+                pending.release()
+
+    def pop(self, key):
+        """
+        Removes the entry stored under key, if any, and returns its value.
+        """
+        with self._lock:
+            try:
+                value, nbytes = self._entries.pop(key)
+            except KeyError:
+                return None
+            self.nbytes -= nbytes
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
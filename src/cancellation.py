@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cooperative cancellation of long computations.
+
+A computation running inside a cancellable() block stops at its next
+checkpoint() once the token of the block is cancelled, by raising
+Cancelled. The field evaluation checks between element types and point
+chunks, the tree code between clusters and the streamlines between seeds.
+Outside a cancellable() block, checkpoint() does nothing. The active token
+is kept per thread, like the recorder of src/instrumentation.py.
+
+    token = CancelToken()
+    with cancellable(token):
+        field.compute(...)      ## raises Cancelled once token.cancel() is called
+"""
+
+# Library imports
+import threading
+from contextlib import contextmanager
+
+## Token of the current thread, see cancellable()
+_local = threading.local()
+
+## Exceptions
+class Cancelled(Exception):
+    """
+    Raised by checkpoint() inside a cancelled computation.
+    """
+
+## CancelToken Class
+class CancelToken:
+    """
+    Flag shared between a computation and the thread that may cancel it.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the token is cancelled, or timeout seconds have passed.
+        Returns True if it was cancelled.
+        """
+        return self._event.wait(timeout)
+
+## Functions
+def active_token():
+    """
+    Token of the enclosing cancellable() block of this thread, or None.
+    """
+    return getattr(_local, "token", None)
+
+@contextmanager
+def cancellable(token):
+    """
+    Makes the checkpoints of the block raise Cancelled once token is
+    cancelled.
+    """
+    previous     = active_token()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+def checkpoint():
+    """
+    Raises Cancelled if the computation of this thread has been cancelled.
+    """
+    token = active_token()
+    if token is not None and token.cancelled:
+        raise Cancelled()
@@ -50,3 +50,15 @@ LONG_NAME_DICT = {
     "velmag": "Velocity Magnitude",
     "pressure": "Pressure Coefficient",
 }
+
+"""
+Attribute names of the flow objects from potentialflowvisualizer module, in
+constructor order. Used to pack elements of one type into parameter arrays.
+"""
+PARAMETER_NAME_DICT = {
+    pfv.Freestream  : ("u", "v"),
+    pfv.Source      : ("strength", "x", "y"),
+    pfv.Doublet     : ("strength", "x", "y", "alpha"),
+    pfv.Vortex      : ("strength", "x", "y"),
+    pfv.LineSource  : ("strength", "x1", "y1", "x2", "y2"),
+}
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compiled element kernels, used by fieldengine.evaluate_field() with the
+"numba" backend.
+
+All flow objects are packed into one parameter table in summation order; a
+single loop per point then sums the x-velocity, y-velocity, potential and
+streamfunction of every element without temporary arrays, and the points
+are spread over all cores. Requires numba; AVAILABLE is False without it.
+numba itself is only imported, and the kernel compiled, on first use.
+
+The default workqueue threading layer of numba aborts the process when a
+parallel kernel is called from several threads at once, as the app does
+for concurrent draws and sessions; kernel launches are therefore
+serialized, each of them using all cores anyway.
+"""
+
+# Library imports
+import cmath
+import importlib.util
+import math
+import threading
+import numpy as np
+import potentialflowvisualizer as pfv
+import src.cancellation as cancel
+from src.commondicts import PARAMETER_NAME_DICT
+from src.elementstore import ElementStore
+
+numba     = None     ## Imported by _kernel()
+
+## Held while compiling or running the kernel, see the module docstring
+_kernel_lock = threading.Lock()
+
+"""
+Number of points per call of the kernel; a cancelled computation stops
+between calls, see src/cancellation.py.
+"""
+CHUNK_POINTS = 2**16
+AVAILABLE = importlib.util.find_spec("numba") is not None
+
+"""
+Type code of every flow object class in the parameter table.
+"""
+CODE_DICT = {
+    pfv.Freestream  : 0,
+    pfv.Source      : 1,
+    pfv.Vortex      : 2,
+    pfv.Doublet     : 3,
+    pfv.LineSource  : 4,
+}
+
+## Functions
+def pack(objects):
+    """
+    Packs flow objects into a parameter table.
+
+    Parameters:
+        objects : list of pfv.object or ElementStore
+            Flow objects, all of a class in CODE_DICT.
+    Returns:
+        codes   : np.ndarray
+            (n,) type code per object.
+        params  : np.ndarray
+            (n x 5) parameters per object, in the order of
+            PARAMETER_NAME_DICT, padded with zeros.
+    """
+    if isinstance(objects, ElementStore):
+        classes, params = objects.table()
+        return np.array([CODE_DICT[cls] for cls in classes], dtype=np.int64), params
+
+    codes  = np.empty(len(objects), dtype=np.int64)
+    params = np.zeros((len(objects), 5))
+    for row, object in enumerate(objects):
+        codes[row] = CODE_DICT[object.__class__]
+        for column, name in enumerate(PARAMETER_NAME_DICT[object.__class__]):
+            params[row, column] = float(getattr(object, name))
+
+    return codes, params
+
+def supports(objects):
+    """
+    True if the compiled kernels can evaluate all given flow objects.
+    """
+    if isinstance(objects, ElementStore):
+        return AVAILABLE                        ## A store only holds supported classes
+    return AVAILABLE and all(object.__class__ in CODE_DICT for object in objects)
+
+def _fused_kernel(codes, params, px, py, potentials, x_vels, y_vels, phis, psis):
+    ## The arithmetic follows the numpy kernels of fieldengine, per point
+    two_pi = 2 * math.pi
+    for i in numba.prange(px.shape[0]):
+        x  = px[i]
+        y  = py[i]
+        su = 0.0
+        sv = 0.0
+        sp = 0.0
+        ss = 0.0
+        for e in range(codes.shape[0]):
+            code = codes[e]
+            if code == 0:                                       ## Freestream
+                u  = params[e, 0]
+                v  = params[e, 1]
+                su += u
+                sv += v
+                if potentials:
+                    sp += u * x + v * y
+                    ss += -v * x + u * y
+            elif code == 1 or code == 2:                        ## Source, Vortex
+                k  = params[e, 0] / two_pi
+                dx = x - params[e, 1]
+                dy = y - params[e, 2]
+                r2 = dx ** 2 + dy ** 2
+                if code == 1:
+                    su += k * dx / r2
+                    sv += k * dy / r2
+                    if potentials:
+                        sp += k * math.log(math.sqrt(r2))
+                        ss += k * math.atan2(dy, dx)
+                else:
+                    su += k * -dy / r2
+                    sv += k * dx / r2
+                    if potentials:
+                        sp += k * math.atan2(dy, dx)
+                        ss += k * math.log(math.sqrt(r2))
+            elif code == 3:                                     ## Doublet
+                k     = params[e, 0] / two_pi
+                k_neg = -params[e, 0] / two_pi
+                cos   = math.cos(params[e, 3])
+                sin   = math.sin(params[e, 3])
+                dx    = x - params[e, 1]
+                dy    = y - params[e, 2]
+                r2    = dx ** 2 + dy ** 2
+                proj  = dx * cos + dy * sin
+                su   += k_neg * (r2 * cos - 2 * dx * proj) / r2 ** 2
+                sv   += k_neg * (r2 * sin - 2 * dy * proj) / r2 ** 2
+                if potentials:
+                    sp += k_neg * proj / r2
+                    ss += k * (dx * sin + dy * cos) / r2
+            else:                                               ## LineSource
+                k      = params[e, 0] / two_pi
+                k_half = -params[e, 0] / (4 * math.pi)
+                x1     = params[e, 1]
+                y1     = params[e, 2]
+                x2     = params[e, 3]
+                y2     = params[e, 4]
+                L2     = (x2 - x1) ** 2 + (y2 - y1) ** 2
+                scale  = math.sqrt(L2)
+                xf     = ((x2 - x1) * (x - x1) + (y2 - y1) * (y - y1)) / L2
+                yf     = ((y1 - y2) * (x - x1) + (x2 - x1) * (y - y1)) / L2
+                r2     = xf ** 2 + yf ** 2
+                theta  = math.atan(xf / yf) - math.atan((xf - 1) / yf)
+                su    += k_half * (math.log(xf ** 2 - 2 * xf + yf ** 2 + 1) - math.log(r2)) / scale
+                sv    += k * theta / scale
+                if potentials:
+                    d1  = math.sqrt((xf - 1) ** 2 + yf ** 2)
+                    s1  = complex(-yf / 2, xf / 2)
+                    s2  = complex(yf / 2, xf / 2)
+                    s3  = complex(xf - 1, yf)
+                    sp += k * (yf * theta + xf * math.log(r2) / 2 - math.log(d1) * (xf - 1) - 1)
+                    ss += (k * (-cmath.log(s3 / d1) * 1j
+                                - cmath.log(complex(xf, yf)) * s1
+                                + cmath.log(s3) * s1
+                                + cmath.log(complex(-xf, yf)) * s2
+                                - cmath.log(complex(1 - xf, yf)) * s2
+                               )).real
+        x_vels[i] = su
+        y_vels[i] = sv
+        if potentials:
+            phis[i] = sp
+            psis[i] = ss
+
+_compiled_kernel = None
+
+def _kernel():
+    ## Compiles _fused_kernel once; division by zero gives inf/nan like numpy instead of raising
+    global numba, _compiled_kernel
+    if _compiled_kernel is None:
+        import numba
+        _compiled_kernel = numba.njit(parallel=True, cache=True, error_model="numpy")(_fused_kernel)
+    return _compiled_kernel
+
+def evaluate_field(objects, points, potentials=True, out=None):
+    """
+    Compiled counterpart of fieldengine.evaluate_field(), see there for the
+    parameters. All objects must be supported, see supports().
+    """
+    n_points = points.shape[0]
+    n_fields = 4 if potentials else 2
+    fields   = tuple(out[:n_fields]) if out is not None else tuple(np.empty(n_points) for _ in range(n_fields))
+    buffers  = [np.empty(n_points) if field.dtype != np.float64 or not field.flags.c_contiguous else field
+                for field in fields]
+    while len(buffers) < 4:
+        buffers.append(np.empty(0))
+
+    codes, params = pack(objects)
+    px = np.ascontiguousarray(points[:, 0], dtype=np.float64)
+    py = np.ascontiguousarray(points[:, 1], dtype=np.float64)
+    for start in range(0, n_points, CHUNK_POINTS):
+        cancel.checkpoint()
+        stop = min(start + CHUNK_POINTS, n_points)
+        with _kernel_lock:
+            _kernel()(codes, params, px[start:stop], py[start:stop], potentials,
+                      *(buffer[start:stop] for buffer in buffers))
+
+    for field, buffer in zip(fields, buffers):
+        if field is not buffer:
+            field[...] = buffer
+
+    return fields
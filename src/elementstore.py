@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import hashlib
+import numpy as np
+from src.commondicts import PARAMETER_NAME_DICT, TYPE_NAME_DICT
+
+"""
+Initial number of rows allocated per flow type; the arrays double when full.
+"""
+INITIAL_CAPACITY = 8
+
+"""
+Structured dtype of the rows of every flow type: the stable element ID and
+the parameters of PARAMETER_NAME_DICT.
+"""
+DTYPE_DICT = {cls: np.dtype([("id", np.int64)] + [(name, np.float64) for name in names])
+              for cls, names in PARAMETER_NAME_DICT.items()}
+
+## ElementStore Class
+class ElementStore:
+    """
+    Registry of flow elements, one numpy structured array per flow type.
+
+    Every element gets a stable integer ID when added. Adding, removing and
+    updating an element takes constant time: rows are appended to the array
+    of their type, and a removed row is replaced by the last one of its
+    array. The insertion order of the IDs is kept separately, it is the
+    summation order of the evaluators and the numbering shown in the app.
+
+    Elements are added and exported as potentialflowvisualizer objects,
+    while the evaluators read the parameter arrays directly, see blocks()
+    and table().
+
+    Parameters:
+        objects : iterable of pfv.object, optional
+            Flow objects to add, in order.
+    """
+    def __init__(self, objects=()):
+        self._arrays  = {}      ## Flow class to structured array, with spare rows
+        self._counts  = {}      ## Flow class to number of rows in use
+        self._rows    = {}      ## ID to (flow class, row), in insertion order
+        self._next_id = 1
+        for object in objects:
+            self.add(object)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        """IDs of the elements, in insertion order."""
+        return iter(list(self._rows))
+
+    def __contains__(self, id):
+        return id in self._rows
+
+    def _row(self, id):
+        try:
+            return self._rows[id]
+        except KeyError:
+            raise KeyError(f"No flow element with ID {id}")
+
+    def add(self, object):
+        """
+        Adds a copy of the parameters of a flow object and returns its ID.
+
+        Raises:
+            ValueError : if the object is not a supported flow element.
+        """
+        cls = object.__class__
+        if cls not in DTYPE_DICT:
+            raise ValueError("The given object is not a flow element")
+
+        id             = self._next_id
+        self._next_id += 1
+        self._append(cls, id, (id, *(float(getattr(object, name)) for name in PARAMETER_NAME_DICT[cls])))
+
+        return id
+
+    def remove(self, id):
+        """
+        Removes an element, moving the last row of its type into its place.
+        """
+        cls, row = self._row(id)
+        del self._rows[id]
+        array    = self._arrays[cls]
+        last     = self._counts[cls] - 1
+        if row != last:
+            array[row] = array[last]
+            self._rows[int(array[row]["id"])] = (cls, row)
+        self._counts[cls] = last
+
+    def update(self, id, **parameters):
+        """
+        Sets parameters of an element, e.g. update(id, x=1.0, strength=2.0).
+
+        Raises:
+            ValueError : if a parameter does not belong to the flow type.
+        """
+        cls, row = self._row(id)
+        for name, value in parameters.items():
+            if name not in PARAMETER_NAME_DICT[cls]:
+                raise ValueError(f"{TYPE_NAME_DICT[cls]} has no parameter '{name}'")
+            self._arrays[cls][name][row] = float(value)
+
+    def clear(self):
+        """
+        Removes all elements. IDs are not reused.
+        """
+        self._arrays.clear()
+        self._counts.clear()
+        self._rows.clear()
+
+    def copy(self):
+        """
+        Independent store with the same elements and IDs.
+        """
+        store           = ElementStore()
+        store._arrays   = {cls: array.copy() for cls, array in self._arrays.items()}
+        store._counts   = dict(self._counts)
+        store._rows     = dict(self._rows)
+        store._next_id  = self._next_id
+        return store
+
+    def get(self, id):
+        """
+        Flow object with the current parameters of an element. Editing it
+        does not change the store, see update().
+        """
+        cls, row = self._row(id)
+        values   = self._arrays[cls][row]
+        return cls(*(float(values[name]) for name in PARAMETER_NAME_DICT[cls]))
+
+    def parameters(self, id):
+        """
+        Parameters of an element as a dictionary, in constructor order.
+        """
+        cls, row = self._row(id)
+        values   = self._arrays[cls][row]
+        return {name: float(values[name]) for name in PARAMETER_NAME_DICT[cls]}
+
+    def element_class(self, id):
+        """
+        Flow class of an element, e.g. pfv.Source.
+        """
+        return self._row(id)[0]
+
+    def type_name(self, id):
+        """
+        Name of the flow type of an element, like flow_element_type().
+        """
+        cls, row = self._row(id)
+        name     = TYPE_NAME_DICT[cls]
+        if name == "Source" and self._arrays[cls][row]["strength"] < 0:
+            name = "Sink"
+        return name
+
+    def labels(self):
+        """
+        ID to the label shown in the app, "<number>. [<type>]", numbered
+        from 1 in insertion order.
+        """
+        return {id: f"{i + 1}. [{self.type_name(id)}]" for i, id in enumerate(self._rows)}
+
+    def objects(self):
+        """
+        Flow objects of all elements, in insertion order.
+        """
+        return [self.get(id) for id in self._rows]
+
+    def items(self):
+        """
+        (ID, flow object) of all elements, in insertion order.
+        """
+        return [(id, self.get(id)) for id in self._rows]
+
+    def records(self):
+        """
+        ID to (flow class, parameter tuple) of all elements, a cheap
+        comparable snapshot of the contents.
+        """
+        records = {}
+        for cls, array in self._arrays.items():
+            rows = array[:self._counts[cls]]
+            for values in rows.tolist():
+                records[values[0]] = (cls, tuple(values[1:]))
+        return records
+
+    def params(self, cls):
+        """
+        View of the used rows of one flow type, in row order (not insertion
+        order), empty if there are none.
+        """
+        if cls not in self._arrays:
+            return np.zeros(0, dtype=DTYPE_DICT[cls])
+        return self._arrays[cls][:self._counts[cls]]
+
+    def blocks(self):
+        """
+        Parameter blocks of all flow types present, in the layout of
+        fieldengine.pack_elements().
+
+        Returns:
+            blocks : list of (flow class, rows, params)
+                The insertion-order positions of the elements of one type,
+                and a dictionary of (n x 1) parameter arrays.
+        """
+        order  = {id: i for i, id in enumerate(self._rows)}
+        blocks = []
+        for cls, array in self._arrays.items():
+            rows = array[:self._counts[cls]]
+            if len(rows) == 0:
+                continue
+            positions = np.fromiter((order[id] for id in rows["id"].tolist()), dtype=np.int64, count=len(rows))
+            blocks.append((cls, positions, {name: rows[name][:, None].copy() for name in PARAMETER_NAME_DICT[cls]}))
+        return blocks
+
+    def table(self):
+        """
+        Classes and parameters of all elements in insertion order.
+
+        Returns:
+            classes : list of type
+                Flow class per element.
+            params  : np.ndarray
+                (n x 5) parameters per element, in the order of
+                PARAMETER_NAME_DICT, padded with zeros.
+        """
+        classes = [None] * len(self)
+        params  = np.zeros((len(self), 5))
+        for cls, positions, columns in self.blocks():
+            for position in positions.tolist():
+                classes[position] = cls
+            for column, name in enumerate(PARAMETER_NAME_DICT[cls]):
+                params[positions, column] = columns[name][:, 0]
+        return classes, params
+
+    def subset(self, classes):
+        """
+        New store with the elements of the given flow classes only, in the
+        same order. IDs are kept.
+        """
+        store = ElementStore()
+        for id, (cls, row) in self._rows.items():
+            if cls in classes:
+                store._append(cls, id, self._arrays[cls][row])
+        store._next_id = self._next_id
+        return store
+
+    def take(self, ids):
+        """
+        New store with the given elements only, in the order of ids.
+        """
+        store = ElementStore()
+        for id in ids:
+            cls, row = self._row(id)
+            store._append(cls, id, self._arrays[cls][row])
+        store._next_id = self._next_id
+        return store
+
+    def _append(self, cls, id, values):
+        ## Appends a row including its ID, growing the array of the type if needed
+        array = self._arrays.get(cls)
+        count = self._counts.get(cls, 0)
+        if array is None or count == len(array):
+            grown = np.zeros(max(INITIAL_CAPACITY, 2 * count), dtype=DTYPE_DICT[cls])
+            if array is not None:
+                grown[:count] = array[:count]
+            self._arrays[cls] = array = grown
+        array[count]      = values
+        self._counts[cls] = count + 1
+        self._rows[id]    = (cls, count)
+
+    def content_hash(self):
+        """
+        Hexadecimal digest of the flow types and parameters, independent of
+        the IDs and of the order of the elements, like their superposition.
+        Stores with the same elements thereby share cached results.
+        """
+        classes, params = self.table()
+        names = np.array([cls.__qualname__ for cls in classes], dtype=str)
+        order = np.lexsort(tuple(params.T[::-1]) + (names,))      ## By type, then by parameters
+        h = hashlib.sha1()
+        h.update(" ".join(names[order]).encode())
+        h.update(params[order].tobytes())
+        return h.hexdigest()
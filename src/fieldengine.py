@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import numpy as np
+import potentialflowvisualizer as pfv
+import src.cancellation as cancel
+import src.compiled as compiled
+from src.commondicts import PARAMETER_NAME_DICT
+from src.elementstore import ElementStore
+
+"""
+Upper bound on the number of (element, point) pairs evaluated at once. The
+point chunk size is derived from it, such that the temporary arrays of one
+pass stay bounded regardless of the number of elements or grid points.
+"""
+CHUNK_PAIRS = 2**20
+
+"""
+Smaller bound used by evaluate_grid(), trading some speed for a low peak memory.
+"""
+LEAN_CHUNK_PAIRS = 2**16
+
+"""
+Element kernel backends. "numpy" evaluates every flow type in broadcasted
+passes, "numba" in one compiled multithreaded loop per point (see
+src/compiled.py), and "auto" picks numba when it is installed.
+"""
+BACKENDS = ("numpy", "numba", "auto")
+
+## Element kernels
+## Every kernel takes a dictionary of parameter column vectors (n x 1) and
+## the point coordinates as row vectors (1 x m), and returns the x-velocity,
+## y-velocity, potential and streamfunction (n x m) of all n elements at once.
+## With potentials=False, only the two velocity components are returned.
+## The arithmetic mirrors the potentialflowvisualizer module operation for
+## operation, so that the results are bit-compatible with it.
+def _freestream_kernel(p, px, py, potentials=True):
+    shape   = (p["u"].shape[0], px.shape[1])
+    x_vel   = np.broadcast_to(p["u"], shape)
+    y_vel   = np.broadcast_to(p["v"], shape)
+    if not potentials:
+        return x_vel, y_vel
+    phi     = p["u"] * px + p["v"] * py
+    psi     = -p["v"] * px + p["u"] * py
+
+    return x_vel, y_vel, phi, psi
+
+def _source_kernel(p, px, py, potentials=True):
+    k       = p["strength"] / (2 * np.pi)
+    dx      = px - p["x"]
+    dy      = py - p["y"]
+    r2      = dx ** 2 + dy ** 2
+
+    x_vel   = k * dx / r2
+    y_vel   = k * dy / r2
+    if not potentials:
+        return x_vel, y_vel
+    phi     = k * np.log(np.sqrt(r2))
+    psi     = k * np.arctan2(dy, dx)
+
+    return x_vel, y_vel, phi, psi
+
+def _vortex_kernel(p, px, py, potentials=True):
+    k       = p["strength"] / (2 * np.pi)
+    dx      = px - p["x"]
+    dy      = py - p["y"]
+    r2      = dx ** 2 + dy ** 2
+
+    x_vel   = k * -dy / r2
+    y_vel   = k * dx / r2
+    if not potentials:
+        return x_vel, y_vel
+    phi     = k * np.arctan2(dy, dx)
+    psi     = k * np.log(np.sqrt(r2))
+
+    return x_vel, y_vel, phi, psi
+
+def _doublet_kernel(p, px, py, potentials=True):
+    k       = p["strength"] / (2 * np.pi)
+    k_neg   = -p["strength"] / (2 * np.pi)
+    cos     = np.cos(p["alpha"])
+    sin     = np.sin(p["alpha"])
+    dx      = px - p["x"]
+    dy      = py - p["y"]
+    r2      = dx ** 2 + dy ** 2
+    proj    = dx * cos + dy * sin
+
+    x_vel   = k_neg * (r2 * cos - 2 * dx * proj) / r2 ** 2
+    y_vel   = k_neg * (r2 * sin - 2 * dy * proj) / r2 ** 2
+    if not potentials:
+        return x_vel, y_vel
+    phi     = k_neg * proj / r2
+    psi     = k * (dx * sin + dy * cos) / r2
+
+    return x_vel, y_vel, phi, psi
+
+def _linesource_kernel(p, px, py, potentials=True):
+    n       = p["strength"].shape[0]
+    k       = p["strength"] / (2 * np.pi)
+    k_half  = -p["strength"] / (4 * np.pi)
+    L2      = (p["x2"] - p["x1"]) ** 2 + (p["y2"] - p["y1"]) ** 2
+    scale   = np.sqrt(L2)
+
+    ## Transform the points into the frame of each panel, (0, 0) -> (1, 0)
+    A       = np.empty((n, 2, 2))
+    A[:, 0, 0] = (p["x2"] - p["x1"])[:, 0]
+    A[:, 0, 1] = (p["y2"] - p["y1"])[:, 0]
+    A[:, 1, 0] = (p["y1"] - p["y2"])[:, 0]
+    A[:, 1, 1] = (p["x2"] - p["x1"])[:, 0]
+    A      /= L2[:, :, None]
+    b       = np.stack((p["x1"], p["y1"]), axis=-1)
+    points  = np.stack((px, py), axis=-1)
+    transformed = A @ np.swapaxes(points - b, 1, 2)
+    xf      = transformed[:, 0, :]
+    yf      = transformed[:, 1, :]
+
+    r2      = xf ** 2 + yf ** 2
+    theta   = np.arctan(xf / yf) - np.arctan((xf - 1) / yf)
+
+    x_vel   = k_half * (np.log(xf ** 2 - 2 * xf + yf ** 2 + 1) - np.log(r2)) / scale
+    y_vel   = k * theta / scale
+    if not potentials:
+        return x_vel, y_vel
+
+    s1      = -yf / 2 + xf / 2 * 1j
+    s2      = yf / 2 + xf / 2 * 1j
+    s3      = xf - 1 + yf * 1j
+    phi     = k * (yf * theta +
+                   xf * np.log(r2) / 2 -
+                   np.log(np.sqrt((xf - 1) ** 2 + yf ** 2)) * (xf - 1) - 1
+                  )
+    psi     = np.real(k * (-np.log(s3 / np.sqrt((xf - 1) ** 2 + yf ** 2)) * 1j
+                           - np.log(xf + yf * 1j) * s1
+                           + np.log(s3) * s1
+                           + np.log(-xf + yf * 1j) * s2
+                           - np.log(1 - xf + yf * 1j) * s2
+                          ))
+
+    return x_vel, y_vel, phi, psi
+
+"""
+Kernel used to evaluate all elements of one flow object type at once.
+"""
+KERNEL_DICT = {
+    pfv.Freestream  : _freestream_kernel,
+    pfv.Source      : _source_kernel,
+    pfv.Doublet     : _doublet_kernel,
+    pfv.Vortex      : _vortex_kernel,
+    pfv.LineSource  : _linesource_kernel,
+}
+
+## Functions
+def resolve_backend(backend):
+    """
+    Backend that will actually be used for the given choice: "numba" and
+    "auto" fall back to "numpy" if numba is not installed.
+
+    Raises:
+        ValueError : if backend is not in BACKENDS.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+    if backend == "numpy" or not compiled.AVAILABLE:
+        return "numpy"
+    return "numba"
+
+def collect(objects):
+    """
+    Flow objects as a sized collection: an ElementStore as is, any other
+    iterable as a list.
+    """
+    return objects if isinstance(objects, ElementStore) else list(objects)
+
+def pack_elements(objects):
+    """
+    Groups flow objects by type into struct-of-arrays parameter blocks.
+
+    Parameters:
+        objects : list of pfv.object or ElementStore
+            Flow objects that belong to the potentialflowvisualizer
+            module, in summation order. The parameter arrays of a store
+            are read directly.
+    Returns:
+        blocks  : list of (kernel, rows, params)
+            For every flow type present, the kernel evaluating it, the
+            positions of its elements in the given order, and a dictionary
+            of (n x 1) parameter arrays.
+        others  : list of (row, pfv.object)
+            Objects without a registered kernel, evaluated one by one.
+    """
+    if isinstance(objects, ElementStore):
+        return [(KERNEL_DICT[cls], rows, params) for cls, rows, params in objects.blocks()], []
+
+    grouped = {}
+    others  = []
+    for row, object in enumerate(objects):
+        if object.__class__ in KERNEL_DICT:
+            grouped.setdefault(object.__class__, []).append((row, object))
+        else:
+            others.append((row, object))
+
+    blocks = []
+    for cls, members in grouped.items():
+        rows   = np.array([row for row, _ in members], dtype=np.int64)
+        params = {name: np.array([[float(getattr(object, name))] for _, object in members])
+                  for name in PARAMETER_NAME_DICT[cls]}
+        blocks.append((KERNEL_DICT[cls], rows, params))
+
+    return blocks, others
+
+def evaluate_field(objects, points, chunk_size=None, potentials=True, out=None, backend="numpy",
+                   tree_tolerance=0):
+    """
+    Evaluates the superposed velocity, potential and streamfunction of all
+    flow objects at the given points.
+
+    The points are processed in chunks; within a chunk, every flow type is
+    evaluated in one broadcasted pass and the contributions are summed in
+    the order of the given objects, which reproduces the element-by-element
+    summation exactly.
+
+    Parameters:
+        objects    : iterable of pfv.object or ElementStore
+            Flow objects that belong to the potentialflowvisualizer module.
+        points     : np.ndarray
+            (N x 2) array of the points to evaluate at.
+        chunk_size : int, optional
+            Number of points per chunk, defaults to CHUNK_PAIRS divided by
+            the number of objects.
+        potentials : bool, optional
+            If False, skips the potential and streamfunction.
+        out        : tuple of np.ndarray, optional
+            (N,) arrays to write the fields into, e.g. float32 buffers.
+            The contributions are always summed in float64.
+        backend    : string, optional
+            One of BACKENDS. The compiled kernels are used only if all
+            objects are supported, otherwise the numpy kernels are.
+        tree_tolerance : float, optional
+            If positive, approximates the far field of many point elements
+            with this relative tolerance, see src/treecode.py.
+    Returns:
+        x_vels, y_vels, potential, streamfunction : np.ndarray
+            (N,) arrays of the superposed fields, the last two only if
+            potentials is True.
+    """
+    objects       = collect(objects)
+    if tree_tolerance > 0:
+        import src.treecode as tc
+        return tc.evaluate_field(objects, points, tree_tolerance, potentials, out, backend)
+    if resolve_backend(backend) == "numba" and compiled.supports(objects):
+        return compiled.evaluate_field(objects, points, potentials, out)
+
+    n_points      = points.shape[0]
+    n_fields      = 4 if potentials else 2
+    if out is None:
+        fields    = tuple(np.zeros(n_points) for _ in range(n_fields))
+    else:
+        fields    = tuple(out[:n_fields])
+        for field in fields:
+            field[...] = 0
+    if len(objects) == 0:
+        return fields
+
+    blocks, others = pack_elements(objects)
+    if chunk_size is None:
+        chunk_size = max(1, CHUNK_PAIRS // len(objects))
+
+    for start in range(0, n_points, chunk_size):
+        stop  = min(start + chunk_size, n_points)
+        chunk = points[start:stop]
+        px    = chunk[:, 0][None, :]
+        py    = chunk[:, 1][None, :]
+
+        ## Contributions of every object, one row per object in summation order
+        stacked = np.empty((n_fields, len(objects), stop - start))
+        for kernel, rows, params in blocks:
+            cancel.checkpoint()
+            for q, values in enumerate(kernel(params, px, py, potentials)):
+                stacked[q, rows] = values
+        for row, object in others:
+            cancel.checkpoint()
+            stacked[0, row] = object.get_x_velocity_at(chunk)
+            stacked[1, row] = object.get_y_velocity_at(chunk)
+            if potentials:
+                stacked[2, row] = object.get_potential_at(chunk)
+                stacked[3, row] = object.get_streamfunction_at(chunk)
+
+        ## Reducing over the leading axis adds the rows one after another
+        for q in range(n_fields):
+            np.add.reduce(stacked[q], axis=0, out=fields[q][start:stop])
+
+    return fields
+
+def evaluate_grid(objects, x_points, y_points, out, chunk_size=None, backend="numpy", tree_tolerance=0):
+    """
+    Evaluates the superposed fields on a grid, tile by tile, straight into
+    preallocated buffers.
+
+    Unlike evaluate_field(), no (N x 2) array of grid points is built: the
+    points of one tile of grid rows are generated, evaluated and written to
+    out, such that the memory used besides out is bounded by the tile size.
+
+    Parameters:
+        objects    : iterable of pfv.object or ElementStore
+            Flow objects that belong to the potentialflowvisualizer module.
+        x_points   : np.ndarray
+            x-values of the grid.
+        y_points   : np.ndarray
+            y-values of the grid.
+        out        : tuple of np.ndarray
+            Four (len(y_points), len(x_points)) arrays receiving the
+            x-velocity, y-velocity, potential and streamfunction, of any
+            float type.
+        chunk_size : int, optional
+            Number of points per tile, defaults to LEAN_CHUNK_PAIRS divided
+            by the number of objects, but at least one grid row. With a
+            tree_tolerance, the tree is rebuilt per tile, so the tiles hold
+            LEAN_CHUNK_PAIRS points.
+        backend    : string, optional
+            One of BACKENDS, see evaluate_field().
+        tree_tolerance : float, optional
+            See evaluate_field().
+    Returns:
+        out        : tuple of np.ndarray
+    """
+    objects    = collect(objects)
+    nx         = len(x_points)
+    if chunk_size is None:
+        chunk_size = max(1, LEAN_CHUNK_PAIRS // (1 if tree_tolerance > 0 else max(len(objects), 1)))
+    tile_rows  = max(1, chunk_size // nx)
+
+    for start in range(0, len(y_points), tile_rows):
+        stop   = min(start + tile_rows, len(y_points))
+        X, Y   = np.meshgrid(x_points, y_points[start:stop])
+        points = np.stack((X.ravel(), Y.ravel()), axis=-1)
+        evaluate_field(objects, points, chunk_size,
+                       out=tuple(field[start:stop].reshape(-1) for field in out), backend=backend,
+                       tree_tolerance=tree_tolerance)
+
+    return out
+
+def evaluate_velocity(objects, points, chunk_size=None, backend="numpy", tree_tolerance=0):
+    """
+    Evaluates the superposed velocity of all flow objects at the given
+    points, see evaluate_field().
+
+    Parameters:
+        objects    : iterable of pfv.object or ElementStore
+            Flow objects that belong to the potentialflowvisualizer module.
+        points     : np.ndarray
+            (N x 2) array of the points to evaluate at.
+        chunk_size : int, optional
+            Number of points per chunk.
+        backend    : string, optional
+            One of BACKENDS, see evaluate_field().
+        tree_tolerance : float, optional
+            See evaluate_field().
+    Returns:
+        x_vels, y_vels : np.ndarray
+            (N,) arrays of the superposed velocity components.
+    """
+    return evaluate_field(objects, points, chunk_size, potentials=False, backend=backend,
+                          tree_tolerance=tree_tolerance)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+from types import SimpleNamespace
+from src.commonfuncs import flow_element_type
+
+## Functions
+def element_markers(objects):
+    """
+    Plain copies of the flow objects used to mark them in the plots.
+
+    Parameters:
+        objects : iterable of pfv.object
+            Flow objects that belong to the potentialflowvisualizer module.
+    Returns:
+        markers : list of SimpleNamespace
+            Parameters of every object (strength, x, y, ...), together with
+            its flow type under "type" and its label under "name".
+    """
+    markers = []
+    for i, object in enumerate(objects):
+        element_type = flow_element_type(object)
+        markers.append(SimpleNamespace(name=f"{i + 1}. [{element_type}]", type=element_type, **object.__dict__))
+
+    return markers
+
+## FieldResult Class
+class FieldResult:
+    """
+    Numerical result of Flowfield.compute(), everything needed to render
+    the plots without evaluating the flow elements again.
+
+    Attributes:
+        x_points, y_points  : np.ndarray
+            x- and y-values of the grid.
+        xvel, yvel          : np.ndarray
+            Velocity components, shaped (len(y_points), len(x_points)).
+        potential           : np.ndarray
+            Velocity potential on the grid.
+        streamfunction      : np.ndarray
+            Stream function on the grid.
+        pressure            : np.ndarray
+            Pressure coefficient on the grid.
+        velmag              : np.ndarray
+            Velocity magnitude on the grid.
+        ranges              : dict
+            (min, max) contour bounds per plotted field.
+        streamlines         : strline.Streamlines
+            Streamline geometry.
+        potentiallines      : strline.Streamlines
+            Potential 'streamline' geometry, None if not requested.
+        markers             : list of SimpleNamespace
+            Flow elements to mark in the plots, see element_markers().
+    """
+    def __init__(self, x_points, y_points, fields=None, streamlines=None, potentiallines=None, markers=()):
+        fields              = {} if fields is None else fields
+        self.x_points       = x_points
+        self.y_points       = y_points
+        self.xvel           = fields.get("xvel")
+        self.yvel           = fields.get("yvel")
+        self.potential      = fields.get("potential")
+        self.streamfunction = fields.get("streamfunction")
+        self.pressure       = fields.get("pressure")
+        self.velmag         = fields.get("velmag")
+        self.ranges         = fields.get("ranges", {})
+        self.streamlines    = streamlines
+        self.potentiallines = potentiallines
+        self.markers        = list(markers)
+
+    @property
+    def is_empty(self):
+        """True if there were no flow elements to evaluate."""
+        return self.xvel is None
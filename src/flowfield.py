@@ -2,372 +2,632 @@
 # -*- coding: utf-8 -*-
 
 # Library imports
+import math
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import plotly as ply
-import plotly.graph_objects as go
-import plotly.figure_factory as ff
-import src.plotly_streamline as strline
-import plotly.io as pio
-from plotly.subplots import make_subplots
-from src.commondicts import TYPE_NAME_DICT, LONG_NAME_DICT
-from src.commonfuncs import flow_element_type
 import potentialflowvisualizer as pfv
+import src.plotly_streamline as strline
+import src.fieldengine as fe
+import src.cache as cache
+import src.adaptive as ad
+import src.instrumentation as instr
+from src.elementstore import ElementStore
+from src.fieldresult import FieldResult, element_markers
+from src.renderer import render_figure
+
+"""
+Grids whose superposition totals a field keeps, the least recently computed
+are dropped first: the preview and the full grid of a progressive draw.
+"""
+SUPERPOSITION_GRIDS = 2
+
+## Process pools integrating the streamlines, per number of workers
+_executors     = {}
+_executor_lock = threading.Lock()
+
+## Functions
+def streamline_executor(workers):
+    """
+    Process pool with the given number of workers, created on first use and
+    shared by all fields. Workers are spawned rather than forked, as the app
+    computes on several threads.
+    """
+    with _executor_lock:
+        if workers not in _executors:
+            _executors[workers] = ProcessPoolExecutor(max_workers=workers,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+        return _executors[workers]
 
-pio.renderers.default = (
-    "browser"  # Feel free to disable this if you're running in notebook mode or prefer a different frontend.
-)
+def count_streamlines(name, streamlines):
+    """
+    Adds the integration statistics of strline.Streamlines to the counters
+    of the active instrumentation recording, if any.
+    """
+    instr.count(f"{name}.seeds_tried", streamlines.n_seeds)
+    instr.count(f"{name}.seeds_accepted", streamlines.n_lines)
+    instr.count(f"{name}.steps", streamlines.n_steps)
+    instr.count(f"{name}.points", streamlines.n_points)
 
-def line_color(object):
-    try:
-        color = "green" if object.strength > 0 else "red"
-    except AttributeError:
-        color = "black"
+def percentile_ranges(fields, q=(5, 95), accuracy=0, seed=0):
+    """
+    Percentiles of several fields, ignoring NaN values like np.nanpercentile
+    with linear interpolation.
 
-    return color
+    Every field is partitioned once for all requested percentiles, instead
+    of being sorted once per percentile. With a non-zero accuracy, the
+    percentiles are estimated from a random subsample just large enough
+    that the rank error stays below accuracy percentage points with
+    overwhelming probability (three standard deviations).
 
-def dot_size(object):
-    try:
-        strength = abs(object.strength) / 10
-    except AttributeError:
-        strength = 1
+    Parameters:
+        fields   : dict
+            Name to np.ndarray of values.
+        q        : tuple of float
+            Percentiles to compute, in [0, 100].
+        accuracy : float, optional
+            Tolerated rank error in percentage points, 0 for exact values.
+        seed     : int, optional
+            Seed of the subsample, such that estimates are reproducible.
+    Returns:
+        ranges   : dict
+            Name to tuple of the percentiles, in the order of q.
+    """
+    rng    = np.random.default_rng(seed)
+    ranges = {}
+    for name, values in fields.items():
+        values = np.ravel(values)
+        values = values[~np.isnan(values)]
+        if accuracy > 0:
+            p_var    = max(p / 100 * (1 - p / 100) for p in q)
+            n_sample = int(np.ceil(9 * p_var / (accuracy / 100) ** 2))
+            if n_sample < values.size:
+                values = values[rng.integers(0, values.size, n_sample)]
+        if values.size == 0:
+            ranges[name] = tuple(np.nan for _ in q)
+            continue
 
-    return 10 + np.tanh(strength) * 10
+        index  = np.asarray(q, dtype=float) / 100 * (values.size - 1)
+        lower  = np.floor(index).astype(np.int64)
+        upper  = np.ceil(index).astype(np.int64)
+        values.partition(np.unique(np.concatenate((lower, upper))))     ## values is a copy already, partition in place
+        with np.errstate(invalid="ignore"):
+            ranges[name] = tuple(values[lower] + (values[upper] - values[lower]) * (index - lower))
 
-def line_width(object):
-    try:
-        strength = abs(object.strength) / 10
-    except AttributeError:
-        strength = 1
+    return ranges
 
-    return 10 + np.tanh(strength) * 10
+## ElementVelocity Class
+class ElementVelocity:
+    """
+    Velocity of flow elements as a function of the points, in the frames
+    the streamlines are integrated in. Unlike a closure over the Flowfield,
+    it can be sent to the worker processes of streamline_executor().
+
+    Parameters:
+        objects        : ElementStore
+            Flow elements.
+        backend        : string
+            Element kernels, see fe.BACKENDS.
+        tree_tolerance : float
+            See fe.evaluate_velocity().
+        potential      : bool
+            False for the streamlines, in the x-axis reflection of the
+            plot, True for the potential lines, along (v, -u).
+    """
+    def __init__(self, objects, backend, tree_tolerance, potential=False):
+        self.objects        = objects
+        self.backend        = backend
+        self.tree_tolerance = tree_tolerance
+        self.potential      = potential
+
+    def __call__(self, points):
+        if self.potential:
+            u, v = fe.evaluate_velocity(self.objects, points, backend=self.backend, tree_tolerance=self.tree_tolerance)
+            return v, -u
+        u, v = fe.evaluate_velocity(self.objects, points * [1, -1], backend=self.backend,
+                                    tree_tolerance=self.tree_tolerance)
+        return u, -v
 
 ## FlowField Class
 class Flowfield:
-    def __init__(self, objects={}):
-        self.objects = objects
+    def __init__(self, objects=(), cache_entries=8, cache_bytes=256 * 2**20, field_cache=None, streamline_cache=None):
+        ## Flow elements; a dictionary or iterable of pfv objects is copied into a store
+        if isinstance(objects, ElementStore):
+            self.objects      = objects
+        else:
+            self.objects      = ElementStore(objects.values() if isinstance(objects, dict) else objects)
+        self.streamlines      = None  ## strline.Streamlines of the last draw, reusable
+        self.potentiallines   = None  ## strline.Streamlines of the last draw, if requested
 
-    def draw(self,
-             x_points=np.linspace(-10, 10, 200),
-             y_points=np.linspace(-10, 10, 200),
-             colorscheme="rainbow",
-             n_contour_lines=15,
-             n_streamline_density=0.5,
-             potential_streamline_bool=False
-            ):
+        ## Results of earlier draws, keyed on the content of their inputs; pass caches to share them between fields
+        self.field_cache      = field_cache if field_cache is not None else cache.LRUCache(cache_entries, cache_bytes)
+        self.streamline_cache = (streamline_cache if streamline_cache is not None
+                                 else cache.LRUCache(cache_entries, cache_bytes))
 
-        ## Create plots
-        fig = make_subplots(rows=2, cols=2,
-                            subplot_titles=(LONG_NAME_DICT["xvel"], LONG_NAME_DICT["pressure"],
-                                            LONG_NAME_DICT["potential"], LONG_NAME_DICT["streamfunction"]),
-                            shared_xaxes=True,
-                            shared_yaxes=True,
-                            x_title='x',
-                            y_title='y',
-                            horizontal_spacing=0.08,
-                            vertical_spacing=0.08
-                           )
-        if len(self.objects) == 0:  # Edge scenario
-            return fig
+        ## Running totals of the superposed fields on the last grids and kernels, see superpose()
+        self.superposition    = {}
+        self._superposition_lock = threading.Lock()
+        self.refresh_interval = 32    ## Incremental updates before a full recomputation
+        self.range_accuracy   = 0     ## Rank error of the contour bounds in percent, 0 is exact, see percentile_ranges()
+        self.memory_lean      = False ## Evaluate in tiles into preallocated buffers, see lean_fields()
+        self.dtype            = np.float64  ## Type of the fields in memory-lean mode, e.g. np.float32
+        self.backend          = "numpy"     ## Element kernels, see fe.BACKENDS
+        self.tree_tolerance   = 0           ## Tree code tolerance for many point elements, 0 sums directly
+        self.streamline_workers = 0         ## Processes integrating the streamlines in tiles, below 2 integrates in one pass
+
+    def snapshot(self):
+        """
+        Flowfield with copies of the current flow objects that shares the
+        result caches of this one, such that it can compute on another
+        thread while the objects of this one are being edited.
+
+        The incremental superposition is copied too; hand it back with
+        adopt_superposition() once the snapshot has computed.
+        """
+        field                  = Flowfield(self.objects.copy(), field_cache=self.field_cache,
+                                           streamline_cache=self.streamline_cache)
+        for name in ("refresh_interval", "range_accuracy", "memory_lean", "dtype", "backend", "tree_tolerance",
+                     "streamline_workers"):
+            setattr(field, name, getattr(self, name))
+        with self._superposition_lock:
+            field.superposition = {key: dict(state, totals=tuple(total.copy() for total in state["totals"]))
+                                   for key, state in self.superposition.items()}
+
+        return field
+
+    def adopt_superposition(self, other):
+        """
+        Takes over the superposition states that other, a snapshot() of
+        this field, has updated, such that the next superpose() on those
+        grids only evaluates the elements edited since.
+        """
+        with other._superposition_lock:
+            states = dict(other.superposition)
+        with self._superposition_lock:
+            for key, state in states.items():
+                if key not in self.superposition or self.superposition[key]["snapshot"] is not state["snapshot"]:
+                    self.superposition.pop(key, None)
+                    self.superposition[key] = state
+            while len(self.superposition) > SUPERPOSITION_GRIDS:
+                self.superposition.pop(next(iter(self.superposition)))
 
+    def superpose(self, x_points, y_points, points):
+        """
+        Superposed x-velocity, y-velocity, potential and streamfunction at
+        the grid points.
+
+        As potential flow is linear, the totals of the previous call on the
+        same grid, with the same backend and tree tolerance, are updated by the contributions of the added, removed or
+        modified flow elements only. Every refresh_interval updates, or if
+        most elements changed, the totals are recomputed from scratch to
+        bound the accumulation of round-off errors.
+
+        Parameters:
+            x_points : np.ndarray
+                x-values of the grid.
+            y_points : np.ndarray
+                y-values of the grid.
+            points   : np.ndarray
+                (N x 2) array of the grid points.
+        Returns:
+            x_vels, y_vels, potential, streamfunction : np.ndarray
+                (N,) arrays of the superposed fields.
+        """
+        grid_key = (cache.hash_arrays(x_points, y_points), fe.resolve_backend(self.backend), float(self.tree_tolerance))
+        current  = self.objects.records()
+        with self._superposition_lock:
+            state = self.superposition.get(grid_key)
+
+        if state is not None and state["n_updates"] < self.refresh_interval:
+            snapshot = state["snapshot"]
+            removed  = [cls(*params) for key, (cls, params) in snapshot.items()
+                        if current.get(key) != (cls, params)]
+            added    = [cls(*params) for key, (cls, params) in current.items()
+                        if snapshot.get(key) != (cls, params)]
+
+            if len(removed) + len(added) < len(current):
+                plus  = fe.evaluate_field(added, points, backend=self.backend, tree_tolerance=self.tree_tolerance)
+                minus = fe.evaluate_field(removed, points, backend=self.backend, tree_tolerance=self.tree_tolerance)
+                ## Singular values (element on a grid point) cannot be subtracted again
+                if all(np.isfinite(field).all() for field in minus):
+                    if len(removed) + len(added) > 0:
+                        for total, p, m in zip(state["totals"], plus, minus):
+                            total += p
+                            total -= m
+                        state["n_updates"] += 1
+                        state["snapshot"]   = current
+                    return tuple(total.copy() for total in state["totals"])
+
+        totals = fe.evaluate_field(self.objects, points, backend=self.backend, tree_tolerance=self.tree_tolerance)
+        with self._superposition_lock:
+            self.superposition.pop(grid_key, None)
+            self.superposition[grid_key] = {"totals"    : tuple(total.copy() for total in totals),
+                                            "snapshot"  : current,
+                                            "n_updates" : 0,
+                                           }
+            while len(self.superposition) > SUPERPOSITION_GRIDS:
+                self.superposition.pop(next(iter(self.superposition)))
+        return totals
+
+    def adaptive_superpose(self, x_points, y_points, refine, tolerance=ad.REFINE_TOLERANCE):
+        """
+        Superposed fields on the grid, evaluated exactly only where needed.
+
+        The flow elements are evaluated on every refine-th grid sample
+        (incrementally, see superpose()). Coarse cells around singularities
+        or with large field variations, see ad.flag_cells(), are evaluated
+        exactly at all their grid points; everywhere else the fields are
+        resampled bilinearly from the coarse grid.
+
+        Parameters:
+            x_points  : np.ndarray
+                x-values of the grid.
+            y_points  : np.ndarray
+                y-values of the grid.
+            refine    : int
+                Stride of the coarse grid.
+            tolerance : float
+                Refinement threshold, see ad.flag_cells().
+        Returns:
+            x_vels, y_vels, potential, streamfunction : np.ndarray
+                (N,) arrays of the superposed fields.
+        """
+        cx, cy   = ad.coarse_indices(len(x_points), refine), ad.coarse_indices(len(y_points), refine)
+        Xc, Yc   = np.meshgrid(x_points[cx], y_points[cy])
+        coarse   = self.superpose(x_points[cx], y_points[cy], np.vstack((Xc.flatten(), Yc.flatten())).T)
+        coarse   = [np.reshape(values, Xc.shape) for values in coarse]
+
+        flags    = ad.flag_cells(coarse, x_points[cx], y_points[cy],
+                                 ad.singular_points(self.objects.objects()), tolerance)
+        cells_x, weights_x = ad.cell_coordinates(len(x_points), cx)
+        cells_y, weights_y = ad.cell_coordinates(len(y_points), cy)
+        fields   = [ad.interpolate(values, cells_x, weights_x, cells_y, weights_y) for values in coarse]
+
+        ## Exact values in the flagged cells
+        exact    = flags[cells_y[:, None], cells_x[None, :]]
+        X, Y     = np.meshgrid(x_points, y_points)
+        values   = fe.evaluate_field(self.objects, np.vstack((X[exact], Y[exact])).T,
+                                     backend=self.backend, tree_tolerance=self.tree_tolerance)
+        for field, value in zip(fields, values):
+            field[exact] = value
+        instr.count("fields.exact_points", Xc.size + int(exact.sum()))
+
+        return tuple(field.flatten() for field in fields)
+
+    def freestream_speed2(self):
+        """
+        Squared free stream velocity, the sum of all uniform flows, used as
+        reference for the pressure coefficient. 1 if there is none.
+        """
+        uniform  = self.objects.params(pfv.Freestream)
+        V2_infty = float(uniform["u"].sum())**2 + float(uniform["v"].sum())**2
+        if V2_infty == 0: V2_infty = 1                  ## No uniform flow objects, or edge exception in calculation of Cp
+
+        return V2_infty
+
+    def dense_fields(self, x_points, y_points, refine=1, tolerance=ad.REFINE_TOLERANCE):
+        """
+        Fields of compute_fields(), without contour bounds, evaluated on the
+        whole grid at once, incrementally or adaptively.
+        """
         ## System variables
         X, Y    = np.meshgrid(x_points, y_points)
         X_r     = X.flatten()
         Y_r     = Y.flatten()
         points  = np.vstack((X_r, Y_r)).T
 
-        ## Get initial variables that are written into
-        x_vels              = np.zeros_like(X_r)
-        y_vels              = np.zeros_like(X_r)
-        potential           = np.zeros_like(X_r)
-        streamfunction      = np.zeros_like(X_r)
-        u_cumulative        = 0
-        v_cumulative        = 0
-        V2_infty            = 1 ## Default value in case no uniform flow objects
-
-        ## Get plotting values
-        for object in self.objects.values():
-            x_vels              += object.get_x_velocity_at(points)
-            y_vels              += object.get_y_velocity_at(points)
-            potential           += object.get_potential_at(points)
-            streamfunction      += object.get_streamfunction_at(points)
-            if flow_element_type(object) == "Uniform":
-                u_cumulative += object.u
-                v_cumulative += object.v
-                V2_infty      = u_cumulative**2 + v_cumulative**2   ## Gets overwritten
-                if V2_infty  == 0: V2_infty = 1                     ## Edge exception in calculation of Cp
-
-            V2      = x_vels**2 + y_vels**2            ## Gets overwritten
-            # V       = np.sqrt(V2)                      ## Gets overwritten
-            Cp      = 1 - V2/V2_infty                  ## Cp calculation
-
-        #### ================ ####
-        #### Plotting Routine ####
-        #### ================ ####
-        ## Velocity Magnitude
-        min = np.nanpercentile(x_vels, 5)
-        max = np.nanpercentile(x_vels, 95)
-        fig.add_trace(go.Contour(name=LONG_NAME_DICT["xvel"],
-                                 x=x_points, y=y_points, z=np.reshape(x_vels, X.shape),
-                                 colorscale=colorscheme,
-                                 contours=dict(start=min,
-                                               end=max,
-                                               size=(max - min) / n_contour_lines,
-                                              ),
-                                 contours_showlines=False,
-                                 showscale=True,
-                                 hovertemplate='x = %{x:.4f}'+
-                                               '<br>y = %{y:.4f}'+
-                                               '<br>u = %{z:.4e}'+
-                                               '<extra></extra>', ## '<extra></extra>' removes the trace name from hover text
-                                 colorbar=dict(title_text= LONG_NAME_DICT["xvel"] + '   [m s<sup>-1</sup>]',
-                                               title_side= 'right',
-                                               ticks     = "inside",
-                                               len       = 0.45,                          ## vertical height of colorbar, expressed in a fraction of graph height, final height reduced by ypad
-                                               tickwidth = 2,
-                                               ticklen   = 10,
-                                               x         = 1.02,
-                                               y         = 0.77,
-                                               ypad      = 0
-                                              ),
-                                ),
-                      row=1, col=1
-                     )
-
-        #### Impose contour lines from the streamfunction field onto the x-velocity field
-        #### It is an alternative option to strline.create_streamline()!
-        # min = np.nanpercentile(streamfunction, 5)
-        # max = np.nanpercentile(streamfunction, 95)
-        # fig.add_trace(go.Contour(x=x_points, y=y_points, z=np.reshape(streamfunction, X.shape),
-        #                          colorscale=[[0,'#000000'],[1,'#000000']],
-        #                          contours=dict(start=min,
-        #                                        end=max,
-        #                                        size=(max - min) / n_contour_lines,
-        #                                       ),
-        #                          showscale=False,
-        #                          contours_coloring='lines',
-        #                          hoverinfo='skip'
-        #                         ),
-        #               row=1, col=1
-        #              )
-
-        ## Pressure Coefficient
-        min = np.nanpercentile(Cp, 5)
-        max = np.nanpercentile(Cp, 95)
-        fig.add_trace(go.Contour(name=LONG_NAME_DICT["pressure"],
-                                 x=x_points, y=y_points, z=np.reshape(Cp, X.shape),
-                                 colorscale=colorscheme,
-                                 contours=dict(start=min,
-                                               end=max,
-                                               size=(max - min) / n_contour_lines,
-                                              ),
-                                 contours_showlines=False,
-                                 showscale=True,
-                                 hovertemplate='x = %{x:.4f}'+
-                                               '<br>y = %{y:.4f}'+
-                                               '<br>Cp = %{z:.4e}'+
-                                               '<extra></extra>',
-                                 colorbar=dict(title_text= LONG_NAME_DICT["pressure"] + '   [-]',
-                                               title_side= 'right',
-                                               ticks     = "inside",
-                                               len       = 0.45,                          ## vertical height of colorbar, expressed in a fraction of graph height, final height reduced by ypad
-                                               tickwidth = 2,
-                                               ticklen   = 10,
-                                               x         = 1.17,
-                                               y         = 0.77,
-                                               ypad      = 0
-                                              ),
-                                ),
-                      row=1, col=2
-                     )
-
-        ## Potential Function
-        min = np.nanpercentile(potential, 5)
-        max = np.nanpercentile(potential, 95)
-        fig.add_trace(go.Contour(name=LONG_NAME_DICT['potential'],
-                                 x=x_points, y=y_points, z=np.reshape(potential, X.shape),
-                                 colorscale=colorscheme,
-                                 contours=dict(start=min,
-                                               end=max,
-                                               size=(max - min) / n_contour_lines,
-                                              ),
-                                 contours_showlines=False,
-                                 showscale=True,
-                                 hovertemplate='x = %{x:.4f}'+
-                                               '<br>y = %{y:.4f}'+
-                                               '<br>phi = %{z:.4e}'+
-                                               '<extra></extra>',
-                                 colorbar=dict(title_text= LONG_NAME_DICT["potential"] + '   [m<sup>2</sup> s<sup>-1</sup>]',
-                                               title_side= 'right',
-                                               ticks     = "inside",
-                                               len       = 0.45,                          ## vertical height of colorbar, expressed in a fraction of graph height, final height reduced by ypad
-                                               tickwidth = 2,
-                                               ticklen   = 10,
-                                               x         = 1.02,
-                                               y         = 0.23,
-                                               ypad      = 0
-                                              ),
-                                ),
-                      row=2, col=1
-                     )
-
-        ## Streamfunction
-        min = np.nanpercentile(streamfunction, 5)
-        max = np.nanpercentile(streamfunction, 95)
-        fig.add_trace(go.Contour(name=LONG_NAME_DICT['streamfunction'],
-                                 x=x_points, y=y_points, z=np.reshape(streamfunction, X.shape),
-                                 colorscale=colorscheme,
-                                 contours=dict(start=min,
-                                               end=max,
-                                               size=(max - min) / n_contour_lines,
-                                              ),
-                                 contours_showlines=False,
-                                 showscale=True,
-                                 hovertemplate='x = %{x:.4f}'+
-                                               '<br>y = %{y:.4f}'+
-                                               '<br>psi = %{z:.4e}'+
-                                               '<extra></extra>',
-                                 colorbar=dict(title_text= LONG_NAME_DICT["streamfunction"] + '   [m<sup>2</sup> s<sup>-1</sup>]',
-                                               title_side= 'right',
-                                               ticks     = "inside",
-                                               len       = 0.45,                          ## vertical height of colorbar, expressed in a fraction of graph height, final height reduced by ypad
-                                               tickwidth = 2,
-                                               ticklen   = 10,
-                                               x         = 1.17,
-                                               y         = 0.23,
-                                               ypad      = 0
-                                              ),
-                                 ),
-                      row=2, col=2
-                     )
-
-
-        streamlines = strline.create_streamline(x_points, -y_points,                                  # for some reason, we need the x-axis reflection, so we need negative y
-                                      np.reshape(x_vels, X.shape), -np.reshape(y_vels, Y.shape), # for some reason, we need the x-axis reflection, so we need negative y
-                                      density=n_streamline_density,
-                                      hoverinfo='skip',
-                                      name='stream_lines',
-                                      line=dict(color='rgba(0,0,0,1)',
-                                                width=1)
-                                     )
-        if potential_streamline_bool:
-            potentiallines = strline.create_streamline(x_points, y_points,
-                                          np.reshape(y_vels, Y.shape), -(np.reshape(x_vels, X.shape)),
-                                          density=n_streamline_density,
-                                          arrow_scale=0.00001,
-                                          hoverinfo='skip',
-                                          name='potential_lines',
-                                          line=dict(color='rgba(0,0,0,1)',
-                                                    width=1)
-                                         )
-        # https://stackoverflow.com/questions/68187485/subplot-for-go-figure-objects-with-multiple-plots-within-them
-        for t in streamlines.data:
-            fig.append_trace(t, row=1, col=1)
-            fig.append_trace(t, row=1, col=2)
-            fig.append_trace(t, row=2, col=2)
+        ## Get plotting values, updated incrementally from the previous grid values if possible
+        with instr.timer("fields.evaluate"):
+            if refine > 1:
+                x_vels, y_vels, potential, streamfunction = self.adaptive_superpose(x_points, y_points, refine,
+                                                                                    tolerance)
+            else:
+                x_vels, y_vels, potential, streamfunction = self.superpose(x_points, y_points, points)
+
+        V2      = x_vels**2 + y_vels**2
+        V       = np.sqrt(V2)
+        Cp      = 1 - V2/self.freestream_speed2()  ## Cp calculation
+
+        return {"xvel"           : np.reshape(x_vels, X.shape),
+                "yvel"           : np.reshape(y_vels, X.shape),
+                "potential"      : np.reshape(potential, X.shape),
+                "streamfunction" : np.reshape(streamfunction, X.shape),
+                "pressure"       : np.reshape(Cp, X.shape),
+                "velmag"         : np.reshape(V, X.shape),
+               }
+
+    def lean_fields(self, x_points, y_points):
+        """
+        Fields of compute_fields(), without contour bounds, evaluated with
+        as little memory as possible.
+
+        The grid is evaluated in tiles straight into the six output arrays
+        of type self.dtype, see fe.evaluate_grid(), and the velocity
+        magnitude and pressure coefficient are derived from them in place.
+        For N grid points, the peak memory is 6 N output values plus the
+        temporaries of one tile, at most about 40 x 8 bytes per pair of
+        fe.LEAN_CHUNK_PAIRS (~20 MiB, for line sources). The contour bounds
+        add another N values and N bytes, see percentile_ranges(). A
+        2000 x 2000 grid thus peaks at ~220 MiB in float64 and ~110 MiB in
+        float32, against ~550 MiB for dense_fields(). No incremental
+        superposition is kept between calls.
+        """
+        shape   = (len(y_points), len(x_points))
+        fields  = {name: np.empty(shape, dtype=self.dtype)
+                   for name in ("xvel", "yvel", "potential", "streamfunction", "pressure", "velmag")}
+
+        with instr.timer("fields.evaluate"):
+            fe.evaluate_grid(self.objects, x_points, y_points,
+                             out=(fields["xvel"], fields["yvel"], fields["potential"], fields["streamfunction"]),
+                             backend=self.backend, tree_tolerance=self.tree_tolerance)
+
+        ## Derived quantities, once, in place
+        np.hypot(fields["xvel"], fields["yvel"], out=fields["velmag"])
+        np.square(fields["velmag"], out=fields["pressure"])
+        fields["pressure"] *= -1 / self.freestream_speed2()
+        fields["pressure"] += 1
+
+        return fields
+
+    def compute_fields(self, x_points, y_points, refine=1, tolerance=ad.REFINE_TOLERANCE):
+        """
+        Velocity, potential, streamfunction and pressure coefficient on the
+        grid, together with their 5th and 95th percentiles.
+
+        Results are cached on the parameters of the flow elements and the
+        grid, so unchanged inputs are not evaluated again.
+
+        Parameters:
+            x_points  : np.ndarray
+                x-values of the grid.
+            y_points  : np.ndarray
+                y-values of the grid.
+            refine    : int, optional
+                If larger than 1, evaluates the grid adaptively with this
+                coarse stride, see adaptive_superpose().
+            tolerance : float, optional
+                Refinement threshold of the adaptive evaluation.
+        Returns:
+            key      : string
+                Cache key of the fields.
+            fields   : dict
+                Arrays shaped like the grid under the keys of LONG_NAME_DICT
+                ("xvel", "yvel", "potential", "streamfunction", "pressure",
+                "velmag"),
+                and (min, max) contour bounds per field under "ranges".
+        """
+        key    = cache.make_key(cache.hash_elements(self.objects),
+                                cache.hash_arrays(x_points, y_points), int(refine), float(tolerance),
+                                float(self.range_accuracy), bool(self.memory_lean), np.dtype(self.dtype).str,
+                                fe.resolve_backend(self.backend), float(self.tree_tolerance))
+        compute     = lambda: self.evaluate_fields(x_points, y_points, refine, tolerance)
+        fields, hit = self.field_cache.get_or_compute(key, compute)
+        if hit:
+            instr.count("fields.cache_hits")
+        return key, fields
+
+    def evaluate_fields(self, x_points, y_points, refine=1, tolerance=ad.REFINE_TOLERANCE):
+        """
+        Fields of compute_fields(), evaluated without the cache.
+        """
+        if self.memory_lean and refine <= 1:
+            fields = self.lean_fields(x_points, y_points)
+        else:
+            fields = self.dense_fields(x_points, y_points, refine, tolerance)
+        instr.count("fields.grid_points", x_points.size * y_points.size)
+
+        ## Contour bounds, kept with the fields so that restyling a draw does not recompute them
+        with instr.timer("fields.percentiles"):
+            fields["ranges"] = percentile_ranges({name: fields[name] for name in ("xvel", "pressure",
+                                                                                  "potential", "streamfunction")},
+                                                 accuracy=self.range_accuracy)
+
+        return fields
+
+    def compute_streamlines(self, field_key, fields, x_points, y_points,
+                            n_streamline_density=0.5,
+                            potential_streamline_bool=False,
+                            streamline_method="auto",
+                            analytic_streamlines=False,
+                            decimate=0,
+                            rtol=1e-4,
+                            atol=1e-3
+                           ):
+        """
+        Streamlines, and optionally potential 'streamlines', of the fields
+        returned by compute_fields(). decimate, rtol and atol are passed to
+        strline.Streamlines.
+
+        Results are cached on the field key and the streamline settings,
+        see cache.LRUCache.get_or_compute(). With streamline_workers, the
+        streamlines are integrated in tiles on a process pool, see
+        streamline_tiles().
+
+        Returns:
+            streamlines, potentiallines : strline.Streamlines
+                The latter is None unless potential_streamline_bool is set.
+        """
+        key    = cache.make_key(field_key, float(n_streamline_density), bool(potential_streamline_bool),
+                                streamline_method, bool(analytic_streamlines), self.streamline_tiles(),
+                                float(decimate), float(rtol), float(atol))
+        compute     = lambda: self.integrate_streamlines(fields, x_points, y_points, n_streamline_density,
+                                                     potential_streamline_bool, streamline_method, analytic_streamlines,
+                                                     decimate, rtol, atol)
+        result, hit = self.streamline_cache.get_or_compute(key, compute)
+        if hit:
+            instr.count("streamlines.cache_hits")
+        return result
+
+    def integrate_streamlines(self, fields, x_points, y_points, n_streamline_density, potential_streamline_bool,
+                              streamline_method, analytic_streamlines, decimate=0, rtol=1e-4, atol=1e-3):
+        """
+        Streamlines of compute_streamlines(), integrated without the cache.
+        """
+        ## With analytic streamlines, the velocity is evaluated exactly at the integration points
+        ## instead of being interpolated on the grid, such that a coarse grid suffices for the contours
+        streamline_velocity    = None
+        potentialline_velocity = None
+        if analytic_streamlines:
+            streamline_velocity    = ElementVelocity(self.objects, self.backend, self.tree_tolerance)    # same reflection as the grid values below
+            potentialline_velocity = ElementVelocity(self.objects, self.backend, self.tree_tolerance, potential=True)
+
+        tiles    = self.streamline_tiles()
+        executor = streamline_executor(self.streamline_workers) if tiles > 1 else None
+
+        with instr.timer("streamlines"):
+            streamlines = strline.Streamlines(x_points, -y_points,                          # for some reason, we need the x-axis reflection, so we need negative y
+                                              fields["xvel"], -fields["yvel"],              # for some reason, we need the x-axis reflection, so we need negative y
+                                              density=n_streamline_density,
+                                              method=streamline_method,
+                                              rtol=rtol,
+                                              atol=atol,
+                                              decimate=decimate,
+                                              velocity=streamline_velocity,
+                                              tiles=tiles,
+                                              executor=executor
+                                             )
+        count_streamlines("streamlines", streamlines)
+        potentiallines = None
         if potential_streamline_bool:
-            for t in potentiallines.data:
-                fig.append_trace(t, row=2, col=1)
-
-        ## Plot flow element origins
-        rows, cols = fig._get_subplot_rows_columns()    ## rows, cols are range, not int
-        for row in rows:
-            for col in cols:
-                for i, object in enumerate(self.objects.values()):
-                    ## All flow elements that are described by a point
-                    try:
-                        fig.add_trace(go.Scatter(name=f"{i + 1}. [{flow_element_type(object)}]",
-                                                 x=[object.x], y=[object.y],
-                                                 marker=dict(color=line_color(object),
-                                                             size=dot_size(object)
-                                                            ),
-                                                 hovertemplate=f'<b>{i + 1}. [{flow_element_type(object)}]</b>'+
-                                                               '<br>x = %{x:.4f}'+
-                                                               '<br>y = %{y:.4f}'+
-                                                               f'<br>strength = {object.strength:.4e}'+
-                                                               '<br>%{text}'
-                                                               '<extra></extra>',
-                                                               text = [f'alpha = {object.alpha:.4e}' if flow_element_type(object) == "Doublet" else ''],
-                                                ),
-                                      row=row, col=col
-                                     )
-                    except AttributeError:
-                        pass
-
-                    ## All flow elements that are described by a line
-                    try:
-                        fig.add_trace(go.Line(name=f"{i + 1}. [{flow_element_type(object)}]",
-                                              x=[object.x1, object.x2], y=[object.y1, object.y2],
-                                              line=dict(color=line_color(object),
-                                                        width=line_width(object)
-                                                       ),
-                                              hovertemplate=f'<b>{i + 1}. [{flow_element_type(object)}]</b>'+
-                                                            '<br>x = %{x:.4f}'+
-                                                            '<br>y = %{y:.4f}'+
-                                                            f'<br>strength = {object.strength:.4e}'+
-                                                            '<extra></extra>',
-                                             ),
-                                      row=row, col=col
-                                     )
-                    except AttributeError:
-                        pass
-
-        ## Update x-axis properties
-        fig.update_xaxes(#title_text='x',
-                         title_font_color='#000000',
-                         title_standoff=0,
-                         gridcolor='rgba(153, 153, 153, 0.75)', #999999 in RGB
-                         gridwidth=1,
-                         zerolinecolor='#000000',
-                         zerolinewidth=2,
-                         linecolor='#000000',
-                         linewidth=1,
-                         ticks='outside',
-                         ticklen=10,
-                         tickwidth=2,
-                         tickcolor='#000000',
-                         tickfont_color='#000000',
-                         minor_showgrid=True,
-                         minor_gridcolor='rgba(221, 221, 221, 0.50)', #DDDDDD in RGB, 0.50 opacity
-                         minor_ticks='outside',
-                         minor_ticklen=5,
-                         minor_tickwidth=2,
-                         minor_griddash='dot',
-                         hoverformat='.4f',
-                         range=[x_points.min(),x_points.max()],
-                        )
-
-
-        ## Update y-axis properties
-        fig.update_yaxes(#title_text='y',
-                         title_font_color='#000000',
-                         title_standoff=0,
-                         gridcolor='rgba(153, 153, 153, 0.75)', #999999 in RGB, 0.75 opacity
-                         gridwidth=1,
-                         zerolinecolor='#000000',
-                         zerolinewidth=2,
-                         linecolor='#000000',
-                         linewidth=1,
-                         ticks='outside',
-                         ticklen=10,
-                         tickwidth=2,
-                         tickcolor='#000000',
-                         tickfont_color='#000000',
-                         minor_showgrid=True,
-                         minor_gridcolor='rgba(221, 221, 221, 0.50)', #DDDDDD in RGB, 0.50 opacity
-                         minor_ticks='outside',
-                         minor_ticklen=5,
-                         minor_tickwidth=2,
-                         minor_griddash='dot',
-                         range=[y_points.min(),y_points.max()],
-                        )
-
-        ## Update figure layout
-        fig.update_layout(font_color='#000000',
-                          plot_bgcolor='rgba(255,255,255,1)',
-                          paper_bgcolor='rgba(255,255,255,1)',
-                          width=900,
-                          height=800,
-                          showlegend=False,
-                         )
-
-        return fig
+            with instr.timer("potentiallines"):
+                potentiallines = strline.Streamlines(x_points, y_points,
+                                                     fields["yvel"], -fields["xvel"],
+                                                     density=n_streamline_density,
+                                                     arrow_scale=0.00001,
+                                                     method=streamline_method,
+                                                     rtol=rtol,
+                                                     atol=atol,
+                                                     decimate=decimate,
+                                                     velocity=potentialline_velocity,
+                                                     tiles=tiles,
+                                                     executor=executor
+                                                    )
+            count_streamlines("potentiallines", potentiallines)
+
+        return streamlines, potentiallines
+
+    def streamline_tiles(self):
+        """
+        Tiles per axis the streamlines are integrated in, see
+        strline.Streamlines. About two tiles per worker: more tiles shorten
+        the longest tile, but add work, as the trajectories of independent
+        tiles overlap and are cut when merged.
+        """
+        if self.streamline_workers < 2:
+            return 1
+        return math.ceil(math.sqrt(2 * self.streamline_workers))
+
+    def velocity_at(self, points):
+        """
+        Superposed velocity of all flow elements at the given points.
+
+        Parameters:
+            points : np.ndarray
+                (N x 2) array of the points to evaluate at.
+        Returns:
+            x_vels, y_vels : np.ndarray
+                (N,) arrays of the velocity components.
+        """
+        return fe.evaluate_velocity(self.objects, points, backend=self.backend, tree_tolerance=self.tree_tolerance)
+
+    def compute(self,
+                x_points=np.linspace(-10, 10, 200),
+                y_points=np.linspace(-10, 10, 200),
+                n_streamline_density=0.5,
+                potential_streamline_bool=False,
+                streamline_method="auto",
+                analytic_streamlines=False,
+                refine=1,
+                streamline_decimate=0,
+                streamline_rtol=1e-4,
+                streamline_atol=1e-3
+               ):
+        """
+        Evaluates the flow field and its streamlines, without plotting.
+
+        Parameters:
+            x_points, y_points        : np.ndarray
+                x- and y-values of the grid.
+            n_streamline_density      : float
+                Density of the streamlines, see strline.create_streamline().
+            potential_streamline_bool : bool
+                Also compute the potential 'streamlines'.
+            streamline_method         : string
+                Integration scheme, see strline.STREAMLINE_METHODS.
+            analytic_streamlines      : bool
+                Trace the streamlines with the exact velocity.
+            refine                    : int
+                Returns the fields on a grid refine times finer than the
+                given one, evaluated exactly only near singularities and
+                large variations, see adaptive_superpose().
+            streamline_decimate       : float
+                Drop streamline vertices deviating less than this fraction
+                of the domain size from a straight line, 0 keeps all of
+                them, see strline.create_streamline().
+            streamline_rtol, streamline_atol : float
+                Tolerances of the 'rk45' streamline steps.
+        Returns:
+            result                    : FieldResult
+                Fields, contour bounds, streamlines and element markers.
+        """
+        if refine > 1:
+            x_points = ad.refine_axis(x_points, refine)
+            y_points = ad.refine_axis(y_points, refine)
+
+        if len(self.objects) == 0:  # Edge scenario
+            return FieldResult(x_points, y_points)
+
+        ## Field values and streamlines, only recomputed if their inputs changed
+        field_key, fields = self.compute_fields(x_points, y_points, refine)
+        self.streamlines, self.potentiallines = self.compute_streamlines(field_key, fields,
+                                                                         x_points, y_points,
+                                                                         n_streamline_density,
+                                                                         potential_streamline_bool,
+                                                                         streamline_method,
+                                                                         analytic_streamlines,
+                                                                         streamline_decimate,
+                                                                         streamline_rtol,
+                                                                         streamline_atol
+                                                                        )
+
+        with instr.timer("markers"):
+            markers = element_markers(self.objects.objects())
+
+        return FieldResult(x_points, y_points, fields, self.streamlines, self.potentiallines, markers)
+
+    def draw(self,
+             x_points=np.linspace(-10, 10, 200),
+             y_points=np.linspace(-10, 10, 200),
+             colorscheme="rainbow",
+             n_contour_lines=15,
+             n_streamline_density=0.5,
+             potential_streamline_bool=False,
+             streamline_method="auto",
+             analytic_streamlines=False,
+             compact=False,
+             lod=False,
+             window=None,
+             refine=1,
+             streamline_decimate=0,
+             streamline_rtol=1e-4,
+             streamline_atol=1e-3
+            ):
+        """
+        Computes the flow field and renders it, see compute() and
+        render_figure().
+        """
+        with instr.timer("compute"):
+            result = self.compute(x_points, y_points,
+                                  n_streamline_density,
+                                  potential_streamline_bool,
+                                  streamline_method,
+                                  analytic_streamlines,
+                                  refine,
+                                  streamline_decimate,
+                                  streamline_rtol,
+                                  streamline_atol
+                                 )
+
+        with instr.timer("render"):
+            return render_figure(result, colorscheme, n_contour_lines, compact, lod, window)
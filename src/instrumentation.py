@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Lightweight timers and counters for the hot paths of a draw.
+
+Measurements are only taken inside a recording() block; elsewhere timer()
+and count() do nothing, such that the instrumented code pays next to
+nothing when nobody is looking. The active recorder is kept per thread, as
+Streamlit runs every session in a thread of its own.
+
+    with recording() as recorder:
+        field.draw(...)
+    recorder.log()
+"""
+
+# Library imports
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+Logger receiving the structured measurements, one JSON record per draw.
+"""
+LOGGER = logging.getLogger("potential_flow.performance")
+
+## Recorder of the current thread, see recording()
+_local = threading.local()
+
+## Recorder Class
+class Recorder:
+    """
+    Wall time per stage and counters of one instrumented run.
+
+    A recorder may be written by a background thread while another one
+    reads it, see ProgressiveDraw; to_dict() takes a consistent copy.
+
+    Attributes:
+        timings  : dict
+            Stage name to accumulated wall time [s], in order of first use.
+        calls    : dict
+            Stage name to number of times it was timed.
+        counters : dict
+            Counter name to accumulated value.
+    """
+    def __init__(self):
+        self.timings  = {}
+        self.calls    = {}
+        self.counters = {}
+        self._lock    = threading.Lock()
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Adds the wall time of the block to the stage name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+                self.calls[name]   = self.calls.get(name, 0) + 1
+
+    def count(self, name, value=1):
+        """
+        Adds value to the counter name.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        """
+        Measurements as plain types, ready to be serialized.
+        """
+        with self._lock:
+            return {"timings" : {name: {"seconds": seconds, "calls": self.calls[name]}
+                                 for name, seconds in self.timings.items()},
+                    "counters": dict(self.counters),
+                   }
+
+    def log(self, logger=LOGGER, level=logging.INFO):
+        """
+        Emits the measurements as a single JSON log record.
+        """
+        logger.log(level, json.dumps(self.to_dict()))
+
+## Functions
+def active_recorder():
+    """
+    Recorder of the enclosing recording() block of this thread, or None.
+    """
+    return getattr(_local, "recorder", None)
+
+@contextmanager
+def recording(recorder=None):
+    """
+    Collects the timers and counters of the block into a Recorder.
+
+    Parameters:
+        recorder : Recorder, optional
+            Recorder to add to, a new one by default.
+    Returns:
+        recorder : Recorder
+            Yielded by the context manager.
+    """
+    recorder         = Recorder() if recorder is None else recorder
+    previous         = active_recorder()
+    _local.recorder  = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+@contextmanager
+def timer(name):
+    """
+    Times the block under the stage name, if a recording is active.
+    """
+    recorder = active_recorder()
+    if recorder is None:
+        yield
+        return
+    with recorder.timer(name):
+        yield
+
+def count(name, value=1):
+    """
+    Adds value to the counter name, if a recording is active.
+    """
+    recorder = active_recorder()
+    if recorder is not None:
+        recorder.count(name, value)
@@ -1,13 +1,110 @@
 from __future__ import absolute_import
 
+import concurrent.futures
+import copy
 import math
 
 from plotly import exceptions, optional_imports
-from plotly.figure_factory import utils
 from plotly.graph_objs import graph_objs
+import src.cancellation as cancel
 
 np = optional_imports.get_module("numpy")
 
+# Integration schemes accepted by create_streamline(method=...)
+STREAMLINE_METHODS = ("auto", "rk4", "rk4_vectorized", "rk45")
+
+# Density from which method="auto" integrates the seeds of a ring at once,
+# below it the rings are too short to pay for the vectorized bookkeeping
+VECTORIZED_DENSITY = 1
+
+# Rounds of tiles integrated in parallel with create_streamline(tiles=...),
+# before the seeds left in the gaps are integrated one after another
+TILE_ROUNDS = 3
+
+# Dormand-Prince 5(4) tableau, the last row of A doubles as 5th order weights
+DOPRI_C = (0.0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1.0, 1.0)
+DOPRI_A = (
+    (),
+    (1 / 5,),
+    (3 / 40, 9 / 40),
+    (44 / 45, -56 / 15, 32 / 9),
+    (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+    (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+    (35 / 384, 0.0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84),
+)
+# Difference between the 5th and the embedded 4th order weights
+DOPRI_E = (
+    35 / 384 - 5179 / 57600,
+    0.0,
+    500 / 1113 - 7571 / 16695,
+    125 / 192 - 393 / 640,
+    -2187 / 6784 + 92097 / 339200,
+    11 / 84 - 187 / 2100,
+    -1 / 40,
+)
+
+
+def validate_method(method):
+    """
+    Checks that the streamline integration scheme is known.
+
+    :raises: (PlotlyError) If method is not in STREAMLINE_METHODS.
+    """
+    if method not in STREAMLINE_METHODS:
+        raise exceptions.PlotlyError(
+            "method must be one of " + ", ".join(STREAMLINE_METHODS)
+        )
+
+
+def resolve_method(method, density):
+    """
+    Integration scheme used for method at the given density: 'auto' picks
+    'rk4_vectorized' from VECTORIZED_DENSITY on and 'rk4' below it.
+    """
+    if method == "auto":
+        return "rk4_vectorized" if density >= VECTORIZED_DENSITY else "rk4"
+    return method
+
+
+def simplify_trajectory(x, y, tolerance):
+    """
+    Drops (nearly) collinear vertices of a polyline.
+
+    Ramer-Douglas-Peucker simplification: a vertex is only kept if the
+    polyline would otherwise deviate more than tolerance from it.
+
+    :param (ndarray) x: x-values of the polyline
+    :param (ndarray) y: y-values of the polyline
+    :param (float) tolerance: maximum perpendicular deviation
+    :rtype (ndarray): boolean array flagging the vertices to keep
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    if len(x) == 0:
+        return keep
+    keep[0] = True
+    keep[-1] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        norm = math.hypot(dx, dy)
+        px = x[start + 1 : end] - x[start]
+        py = y[start + 1 : end] - y[start]
+        if norm == 0:
+            dist = np.hypot(px, py)
+        else:
+            dist = np.abs(px * dy - py * dx) / norm
+        index = int(np.argmax(dist))
+        if dist[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
 
 def validate_streamline(x, y):
     """
@@ -37,7 +134,9 @@ def validate_streamline(x, y):
 
 
 def create_streamline(
-    x, y, u, v, density=1, angle=math.pi / 9, arrow_scale=0.09, **kwargs
+    x, y, u, v, density=1, angle=math.pi / 9, arrow_scale=0.09, method="rk4",
+    rtol=1e-4, atol=1e-3, decimate=0, velocity=None, tiles=1, executor=None,
+    **kwargs
 ):
     """
     Returns data for a streamline plot.
@@ -53,6 +152,30 @@ def create_streamline(
     :param (angle in radians) angle: angle of arrowhead. Default = pi/9
     :param (float in [0,1]) arrow_scale: value to scale length of arrowhead
         Default = .09
+    :param (str) method: integration scheme. 'rk4' integrates one seed
+        at a time, 'rk4_vectorized' advances all seeds of a seeding ring
+        at once and yields the same streamlines, 'auto' picks one of the
+        two by density, see resolve_method, 'rk45' uses adaptive
+        Dormand-Prince steps. Default = 'rk4'
+    :param (float) rtol: relative tolerance of the 'rk45' steps.
+        Default = 1e-4
+    :param (float) atol: absolute tolerance of the 'rk45' steps, in grid
+        cells. Default = 1e-3
+    :param (float) decimate: drop streamline vertices deviating less than
+        this fraction of the domain size from a straight line, 0 keeps
+        every vertex. Default = 0
+    :param (callable) velocity: function mapping an (N x 2) array of (x, y)
+        points to the (u, v) arrays at those points. If given, u and v are
+        not interpolated on the grid but evaluated exactly where needed,
+        and may be None. Only the extent and number of x and y values are
+        then used. Default = None
+    :param (int) tiles: split the seeds into tiles x tiles rectangles that
+        are integrated independently, then merged in seeding order such
+        that streamlines of different tiles do not overlap. The result
+        depends on tiles, but not on the executor. Default = 1 (one pass)
+    :param (concurrent.futures.Executor) executor: runs the tiles in
+        parallel, e.g. a ProcessPoolExecutor, in which case velocity must
+        be picklable. Default = None (one after another)
     :param kwargs: kwargs passed through plotly.graph_objs.Scatter
         for more information on valid kwargs call
         help(plotly.graph_objs.Scatter)
@@ -109,21 +232,17 @@ def create_streamline(
     >>> fig.add_trace(point) # doctest: +SKIP
     >>> fig.show()
     """
+    from plotly.figure_factory import utils     ## Deferred, importing figure_factory is slow
+
     utils.validate_equal_length(x, y)
     utils.validate_equal_length(u, v)
     validate_streamline(x, y)
     utils.validate_positive_scalars(density=density, arrow_scale=arrow_scale)
 
-    streamline_x, streamline_y = _Streamline(
-        x, y, u, v, density, angle, arrow_scale
-    ).sum_streamlines()
-    arrow_x, arrow_y = _Streamline(
-        x, y, u, v, density, angle, arrow_scale
-    ).get_streamline_arrows()
-
-    streamline = graph_objs.Scatter(
-        x=streamline_x + arrow_x, y=streamline_y + arrow_y, mode="lines", **kwargs
-    )
+    streamline = Streamlines(
+        x, y, u, v, density, angle, arrow_scale, method, rtol, atol, decimate,
+        velocity, tiles, executor
+    ).to_scatter(**kwargs)
 
     data = [streamline]
     layout = graph_objs.Layout(hovermode="closest")
@@ -131,18 +250,103 @@ def create_streamline(
     return graph_objs.Figure(data=data, layout=layout)
 
 
+class Streamlines(object):
+    """
+    Streamline geometry, integrated once and kept for reuse.
+
+    Takes the same parameters as create_streamline(). The trajectories are
+    integrated a single time on construction; the streamlines and their
+    arrowheads are stored as NaN-separated numpy arrays, such that several
+    traces (e.g. one per subplot) can be built from the same result.
+
+    :ivar (ndarray) lines_x: x-values of all streamlines, NaN-separated
+    :ivar (ndarray) lines_y: y-values of all streamlines, NaN-separated
+    :ivar (ndarray) arrows_x: x-values of all arrowheads, NaN-separated
+    :ivar (ndarray) arrows_y: y-values of all arrowheads, NaN-separated
+    :ivar (int) n_lines: number of streamlines
+    :ivar (int) n_seeds: number of seeds integrated, accepted or not
+    :ivar (int) n_steps: number of accepted integration steps
+    :ivar (int) n_points: number of streamline vertices emitted
+    """
+
+    def __init__(
+        self, x, y, u, v, density=1, angle=math.pi / 9, arrow_scale=0.09,
+        method="rk4", rtol=1e-4, atol=1e-3, decimate=0, velocity=None,
+        tiles=1, executor=None
+    ):
+        from plotly.figure_factory import utils     ## Deferred, importing figure_factory is slow
+
+        utils.validate_equal_length(x, y)
+        if velocity is None:
+            utils.validate_equal_length(u, v)
+        validate_streamline(x, y)
+        validate_method(method)
+        utils.validate_positive_scalars(
+            density=density, arrow_scale=arrow_scale, rtol=rtol, atol=atol
+        )
+        if decimate < 0:
+            raise exceptions.PlotlyError("decimate must be non-negative")
+        if int(tiles) != tiles or tiles < 1:
+            raise exceptions.PlotlyError("tiles must be a positive integer")
+
+        streamline = _Streamline(
+            x, y, u, v, density, angle, arrow_scale, resolve_method(method, density), rtol, atol, velocity,
+            int(tiles), executor
+        )
+        if decimate > 0:
+            streamline.decimate_trajectories(decimate)
+        self.n_lines = len(streamline.trajectories)
+        self.n_seeds = streamline.n_seeds
+        self.n_steps = streamline.n_steps
+        self.n_points = sum(len(t[0]) for t in streamline.trajectories)
+        self.lines_x, self.lines_y = streamline.sum_streamlines()
+        self.arrows_x, self.arrows_y = streamline.get_streamline_arrows(
+            self.lines_x, self.lines_y
+        )
+
+    @property
+    def x(self):
+        """x-values of the streamlines followed by the arrowheads"""
+        return np.concatenate((self.lines_x, self.arrows_x))
+
+    @property
+    def y(self):
+        """y-values of the streamlines followed by the arrowheads"""
+        return np.concatenate((self.lines_y, self.arrows_y))
+
+    def to_scatter(self, dtype=None, **kwargs):
+        """
+        Single trace containing all streamlines and arrowheads.
+
+        :param (numpy.dtype) dtype: type the coordinate arrays are cast to,
+            e.g. float32 for a compact payload. Default = None (float64)
+        :param kwargs: kwargs passed through plotly.graph_objs.Scatter
+        :rtype (plotly.graph_objs.Scatter)
+        """
+        x = self.x if dtype is None else self.x.astype(dtype)
+        y = self.y if dtype is None else self.y.astype(dtype)
+        return graph_objs.Scatter(x=x, y=y, mode="lines", **kwargs)
+
+
 class _Streamline(object):
     """
     Refer to FigureFactory.create_streamline() for docstring
     """
 
-    def __init__(self, x, y, u, v, density, angle, arrow_scale, **kwargs):
+    def __init__(
+        self, x, y, u, v, density, angle, arrow_scale, method="rk4",
+        rtol=1e-4, atol=1e-3, velocity=None, tiles=1, executor=None, **kwargs
+    ):
         self.x = np.array(x)
         self.y = np.array(y)
-        self.u = np.array(u)
-        self.v = np.array(v)
+        self.velocity = velocity
         self.angle = angle
         self.arrow_scale = arrow_scale
+        self.method = method
+        self.rtol = rtol
+        self.atol = atol
+        self.n_steps = 0
+        self.n_seeds = 0
         self.density = int(30 * density)  # Scale similarly to other functions
         self.delta_x = self.x[1] - self.x[0]
         self.delta_y = self.y[1] - self.y[0]
@@ -154,20 +358,44 @@ class _Streamline(object):
         self.spacing_x = len(self.x) / float(self.density - 1)
         self.spacing_y = len(self.y) / float(self.density - 1)
         self.trajectories = []
+        self.trajectory_seeds = []  # (xb, yb, index of the seed) per trajectory
+        self.tiles = tiles
+        self.executor = executor
+
+        if velocity is None:
+            # Rescale speed onto axes-coordinates
+            self.u = np.array(u) / (self.x[-1] - self.x[0])
+            self.v = np.array(v) / (self.y[-1] - self.y[0])
+            self.speed = np.sqrt(self.u**2 + self.v**2)
+
+            # Rescale u and v for integrations.
+            self.u *= len(self.x)
+            self.v *= len(self.y)
+            self.fields = np.stack((self.speed, self.u, self.v), axis=-1).reshape(-1, 3)
+
+        # Trajectory length after each rk4 step, summed like rk4 does
+        self.stotals = [0]
+        while self.stotals[-1] <= 2:
+            self.stotals.append(self.stotals[-1] + 0.01)
 
-        # Rescale speed onto axes-coordinates
-        self.u = self.u / (self.x[-1] - self.x[0])
-        self.v = self.v / (self.y[-1] - self.y[0])
-        self.speed = np.sqrt(self.u**2 + self.v**2)
-
-        # Rescale u and v for integrations.
-        self.u *= len(self.x)
-        self.v *= len(self.y)
         self.st_x = []
         self.st_y = []
         self.get_streamlines()
-        streamline_x, streamline_y = self.sum_streamlines()
-        arrows_x, arrows_y = self.get_streamline_arrows()
+
+    def __getstate__(self):
+        # Sent to the worker processes without the executor, and with the
+        # grids only once, in fields
+        state = self.__dict__.copy()
+        state["executor"] = None
+        for name in ("speed", "u", "v"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.velocity is None:
+            grids = self.fields.reshape(len(self.y), len(self.x), 3)
+            self.speed, self.u, self.v = grids[..., 0], grids[..., 1], grids[..., 2]
 
     def blank_pos(self, xi, yi):
         """
@@ -195,24 +423,58 @@ class _Streamline(object):
         a1 = a10 * (1 - xt) + a11 * xt
         return a0 * (1 - yt) + a1 * yt
 
+    def velocity_at(self, xi, yi):
+        """
+        Speed, u and v at one position, in the rescaled integration units.
+
+        :raises: (IndexError) If the grid lookup falls outside of the grid.
+        """
+        if self.velocity is not None:
+            speed, ui, vi, valid = self.values_at(np.array([xi]), np.array([yi]))
+            return speed[0], ui[0], vi[0]
+        return (
+            self.value_at(self.speed, xi, yi),
+            self.value_at(self.u, xi, yi),
+            self.value_at(self.v, xi, yi),
+        )
+
+    def analytic_values_at(self, xi, yi):
+        """
+        Speed, u and v from the velocity function, rescaled like the grids.
+
+        :param (ndarray) xi: x-positions in grid-index units
+        :param (ndarray) yi: y-positions in grid-index units
+        :rtype (ndarray, ndarray, ndarray, ndarray): speed, u, v and a
+            boolean array flagging valid lookups (all of them)
+        """
+        points = np.stack(
+            (self.x[0] + xi * self.delta_x, self.y[0] + yi * self.delta_y), axis=-1
+        )
+        u, v = self.velocity(points)
+        u = np.asarray(u) / (self.x[-1] - self.x[0])
+        v = np.asarray(v) / (self.y[-1] - self.y[0])
+        speed = np.sqrt(u**2 + v**2)
+        return speed, u * len(self.x), v * len(self.y), np.ones(len(xi), dtype=bool)
+
     def rk4_integrate(self, x0, y0):
         """
         RK4 forward and back trajectories from the initial conditions.
 
         Adapted from Bokeh's streamline -uses Runge-Kutta method to fill
         x and y trajectories then checks length of traj (s in units of axes)
+
+        :rtype (list, list, int): x- and y-values of the trajectory and the
+            index of the initial condition in them, or None if rejected
         """
 
         def f(xi, yi):
-            dt_ds = 1.0 / self.value_at(self.speed, xi, yi)
-            ui = self.value_at(self.u, xi, yi)
-            vi = self.value_at(self.v, xi, yi)
+            speed, ui, vi = self.velocity_at(xi, yi)
+            dt_ds = 1.0 / speed
             return ui * dt_ds, vi * dt_ds
 
         def g(xi, yi):
-            dt_ds = 1.0 / self.value_at(self.speed, xi, yi)
-            ui = self.value_at(self.u, xi, yi)
-            vi = self.value_at(self.v, xi, yi)
+            speed, ui, vi = self.velocity_at(xi, yi)
+            dt_ds = 1.0 / speed
             return -ui * dt_ds, -vi * dt_ds
 
         check = lambda xi, yi: (0 <= xi < len(self.x) - 1 and 0 <= yi < len(self.y) - 1)
@@ -242,6 +504,7 @@ class _Streamline(object):
                 if not check(xi, yi):
                     break
                 stotal += ds
+                self.n_steps += 1
                 new_xb, new_yb = self.blank_pos(xi, yi)
                 if new_xb != xb or new_yb != yb:
                     if self.blank[new_yb, new_xb] == 0:
@@ -267,7 +530,121 @@ class _Streamline(object):
         if stotal > 0.2:
             initxb, inityb = self.blank_pos(x0, y0)
             self.blank[inityb, initxb] = 1
-            return x_traj, y_traj
+            return x_traj, y_traj, len(xb_traj) - 1
+        else:
+            for xb, yb in zip(xb_changes, yb_changes):
+                self.blank[yb, xb] = 0
+            return None
+
+    def rk45_integrate(self, x0, y0):
+        """
+        Adaptive forward and back trajectories from the initial conditions.
+
+        Same as rk4_integrate, but with embedded Dormand-Prince 5(4) steps
+        whose length follows the local error estimate. A step may cross
+        several blank cells; all of them are checked and marked, such that
+        the blank grid sees every cell a trajectory passes through.
+        """
+
+        def f(xi, yi):
+            speed, ui, vi = self.velocity_at(xi, yi)
+            dt_ds = 1.0 / speed
+            return ui * dt_ds, vi * dt_ds
+
+        def g(xi, yi):
+            speed, ui, vi = self.velocity_at(xi, yi)
+            dt_ds = 1.0 / speed
+            return -ui * dt_ds, -vi * dt_ds
+
+        check = lambda xi, yi: (0 <= xi < len(self.x) - 1 and 0 <= yi < len(self.y) - 1)
+        xb_changes = []
+        yb_changes = []
+        ds_max = 0.1
+        ds_min = 1e-6
+        max_turn = 0.3  # radians
+
+        def rk45(x0, y0, f):
+            ds = 0.01
+            stotal = 0
+            xi = x0
+            yi = y0
+            xb, yb = self.blank_pos(xi, yi)
+            xf_traj = []
+            yf_traj = []
+            while check(xi, yi):
+                xf_traj.append(xi)
+                yf_traj.append(yi)
+                while True:
+                    kx = []
+                    ky = []
+                    try:
+                        for c, a in zip(DOPRI_C, DOPRI_A):
+                            kxi, kyi = f(
+                                xi + ds * sum(aj * k for aj, k in zip(a, kx)),
+                                yi + ds * sum(aj * k for aj, k in zip(a, ky)),
+                            )
+                            kx.append(kxi)
+                            ky.append(kyi)
+                    except IndexError:
+                        return stotal, xf_traj, yf_traj
+                    x_new = xi + ds * sum(aj * k for aj, k in zip(DOPRI_A[-1], kx))
+                    y_new = yi + ds * sum(aj * k for aj, k in zip(DOPRI_A[-1], ky))
+                    err_x = ds * sum(e * k for e, k in zip(DOPRI_E, kx))
+                    err_y = ds * sum(e * k for e, k in zip(DOPRI_E, ky))
+                    err = max(
+                        abs(err_x) / (self.atol + self.rtol * max(abs(xi), abs(x_new))),
+                        abs(err_y) / (self.atol + self.rtol * max(abs(yi), abs(y_new))),
+                    )
+                    # Also bound the turning of the direction over one step,
+                    # as the vertices are joined by straight line segments
+                    turn = abs(math.atan2(
+                        kx[0] * ky[-1] - ky[0] * kx[-1], kx[0] * kx[-1] + ky[0] * ky[-1]
+                    ))
+                    err = max(err, turn / max_turn)
+                    if not err <= 1 and ds > ds_min:
+                        ds = max(ds_min, ds * max(0.2, 0.9 * err ** -0.2))
+                        continue
+                    break
+                if not (err <= 1 and check(x_new, y_new)):
+                    break
+                # Visit every blank cell on the way, long steps may cross several
+                n_sub = int(
+                    2 * max(abs(x_new - xi) / self.spacing_x, abs(y_new - yi) / self.spacing_y)
+                ) + 1
+                for i in range(1, n_sub + 1):
+                    new_xb, new_yb = self.blank_pos(
+                        xi + (x_new - xi) * i / n_sub, yi + (y_new - yi) * i / n_sub
+                    )
+                    if new_xb != xb or new_yb != yb:
+                        if self.blank[new_yb, new_xb] == 0:
+                            self.blank[new_yb, new_xb] = 1
+                            xb_changes.append(new_xb)
+                            yb_changes.append(new_yb)
+                            xb = new_xb
+                            yb = new_yb
+                        else:
+                            return stotal + ds, xf_traj, yf_traj
+                xi = x_new
+                yi = y_new
+                stotal += ds
+                self.n_steps += 1
+                ds = min(ds_max, ds * min(5.0, 0.9 * err ** -0.2 if err > 0 else 5.0))
+                if stotal > 2:
+                    break
+            return stotal, xf_traj, yf_traj
+
+        sf, xf_traj, yf_traj = rk45(x0, y0, f)
+        sb, xb_traj, yb_traj = rk45(x0, y0, g)
+        stotal = sf + sb
+        x_traj = xb_traj[::-1] + xf_traj[1:]
+        y_traj = yb_traj[::-1] + yf_traj[1:]
+
+        if len(x_traj) < 1:
+            return None
+        if stotal > 0.2:
+            initxb, inityb = self.blank_pos(x0, y0)
+            self.blank[inityb, initxb] = 1
+            return x_traj, y_traj, len(xb_traj) - 1
         else:
             for xb, yb in zip(xb_changes, yb_changes):
                 self.blank[yb, xb] = 0
@@ -286,21 +663,456 @@ class _Streamline(object):
         if xb < 0 or xb >= self.density or yb < 0 or yb >= self.density:
             return
         if self.blank[yb, xb] == 0:
-            t = self.rk4_integrate(xb * self.spacing_x, yb * self.spacing_y)
+            cancel.checkpoint()
+            self.n_seeds += 1
+            if self.method == "rk45":
+                t = self.rk45_integrate(xb * self.spacing_x, yb * self.spacing_y)
+            else:
+                t = self.rk4_integrate(xb * self.spacing_x, yb * self.spacing_y)
             if t is not None:
-                self.trajectories.append(t)
+                self.trajectories.append(t[:2])
+                self.trajectory_seeds.append((xb, yb, t[2]))
+
+    def values_at(self, xi, yi):
+        """
+        Vectorized counterpart of value_at for speed, u and v at once.
+
+        Indices are treated exactly like the scalar lookup, including the
+        wrap-around of negative indices. Positions whose lookup would raise
+        an IndexError in value_at are flagged as invalid instead.
+
+        :param (ndarray) xi: x-positions in grid-index units
+        :param (ndarray) yi: y-positions in grid-index units
+        :rtype (ndarray, ndarray, ndarray, ndarray): speed, u, v and a
+            boolean array flagging valid lookups
+        """
+        if self.velocity is not None:
+            return self.analytic_values_at(xi, yi)
+        nx = len(self.x)
+        ny = len(self.y)
+        ix = xi.astype(np.int64)
+        iy = yi.astype(np.int64)
+        valid = (ix >= -nx) & (ix <= nx - 2) & (iy >= -ny) & (iy <= ny - 2)
+        ix0 = np.where(valid, ix, 0) % nx
+        iy0 = np.where(valid, iy, 0) % ny
+        ix1 = (ix0 + 1) % nx
+        row0 = iy0 * nx
+        row1 = ((iy0 + 1) % ny) * nx
+
+        a00 = self.fields.take(row0 + ix0, axis=0)
+        a01 = self.fields.take(row0 + ix1, axis=0)
+        a10 = self.fields.take(row1 + ix0, axis=0)
+        a11 = self.fields.take(row1 + ix1, axis=0)
+        xt = (xi - ix)[:, None]
+        yt = (yi - iy)[:, None]
+        a0 = a00 * (1 - xt) + a01 * xt
+        a1 = a10 * (1 - xt) + a11 * xt
+        values = a0 * (1 - yt) + a1 * yt
+        return values[:, 0], values[:, 1], values[:, 2], valid
+
+    def rk4_integrate_lanes(self, x0, y0, sign, blank):
+        """
+        RK4 trajectories from many initial conditions at once.
+
+        Every lane follows the same arithmetic as rk4_integrate, in the
+        direction given by sign (1 forward, -1 backward). Lanes stop when
+        leaving the domain, when the lookup fails, when the length cap is
+        exceeded, or when entering a cell that is already occupied in
+        blank. Occupancy created by the lanes themselves is not taken into
+        account here, see resolve_lane.
+
+        :param (ndarray) x0: initial x-positions in grid-index units
+        :param (ndarray) y0: initial y-positions in grid-index units
+        :param (ndarray) sign: direction of integration per lane
+        :param (ndarray) blank: occupancy grid at the start of the ring
+        :rtype (dict): positions and blank cells per step, and per lane
+            the number of steps carrying a cell event, the number of
+            trajectory points and the number of steps in the length
+        """
+        ds = 0.01
+        stotals = self.stotals
+        n_iter = len(stotals) - 1
+        n_lanes = len(x0)
+        nx = len(self.x)
+        ny = len(self.y)
+
+        xs = np.full((n_iter + 1, n_lanes), np.nan)
+        ys = np.full((n_iter + 1, n_lanes), np.nan)
+        xbs = np.zeros((n_iter + 1, n_lanes), dtype=np.int64)
+        ybs = np.zeros((n_iter + 1, n_lanes), dtype=np.int64)
+        n_events = np.zeros(n_lanes, dtype=np.int64)
+        n_points = np.zeros(n_lanes, dtype=np.int64)
+        n_steps = np.zeros(n_lanes, dtype=np.int64)
+
+        def check(xi, yi):
+            return (0 <= xi) & (xi < nx - 1) & (0 <= yi) & (yi < ny - 1)
+
+        def f(xi, yi, lanes):
+            speed, ui, vi, valid = self.values_at(xi, yi)
+            dt_ds = 1.0 / speed
+            return sign[lanes] * ui * dt_ds, sign[lanes] * vi * dt_ds, valid
+
+        xi = np.array(x0, dtype=float)
+        yi = np.array(y0, dtype=float)
+        xs[0] = xi
+        ys[0] = yi
+        xbs[0] = (xi / self.spacing_x + 0.5).astype(np.int64)
+        ybs[0] = (yi / self.spacing_y + 0.5).astype(np.int64)
+        lanes = np.nonzero(check(xi, yi))[0]
+
+        with np.errstate(all="ignore"):
+            for k in range(n_iter):
+                if len(lanes) == 0:
+                    break
+                cancel.checkpoint()
+                xi = xs[k, lanes]
+                yi = ys[k, lanes]
+                k1x, k1y, ok1 = f(xi, yi, lanes)
+                k2x, k2y, ok2 = f(xi + 0.5 * ds * k1x, yi + 0.5 * ds * k1y, lanes)
+                k3x, k3y, ok3 = f(xi + 0.5 * ds * k2x, yi + 0.5 * ds * k2y, lanes)
+                k4x, k4y, ok4 = f(xi + ds * k3x, yi + ds * k3y, lanes)
+                xi = xi + ds * (k1x + 2 * k2x + 2 * k3x + k4x) / 6.0
+                yi = yi + ds * (k1y + 2 * k2y + 2 * k3y + k4y) / 6.0
+
+                # Failed lookup or leaving the domain: the step is not counted
+                moved = ok1 & ok2 & ok3 & ok4 & check(xi, yi)
+                stopped = lanes[~moved]
+                n_events[stopped] = k
+                n_points[stopped] = k + 1
+                n_steps[stopped] = k
+                lanes = lanes[moved]
+                xi = xi[moved]
+                yi = yi[moved]
+
+                xs[k + 1, lanes] = xi
+                ys[k + 1, lanes] = yi
+                new_xb = (xi / self.spacing_x + 0.5).astype(np.int64)
+                new_yb = (yi / self.spacing_y + 0.5).astype(np.int64)
+                xbs[k + 1, lanes] = new_xb
+                ybs[k + 1, lanes] = new_yb
+
+                # Entering an occupied cell, or exceeding the length cap
+                changed = (new_xb != xbs[k, lanes]) | (new_yb != ybs[k, lanes])
+                done = (changed & (blank[new_yb, new_xb] != 0)) | (stotals[k + 1] > 2)
+                stopped = lanes[done]
+                n_events[stopped] = k + 1
+                n_points[stopped] = k + 1
+                n_steps[stopped] = k + 1
+                lanes = lanes[~done]
+
+        n_events[lanes] = n_iter
+        n_points[lanes] = n_iter + 1
+        n_steps[lanes] = n_iter
+        return dict(xs=xs, ys=ys, xbs=xbs, ybs=ybs,
+                    n_events=n_events, n_points=n_points, n_steps=n_steps)
+
+    def resolve_lane(self, lanes, lane, changes):
+        """
+        Replays the cell events of one integrated lane on the blank grid.
+
+        The lane is cut at the first cell that is already occupied, and
+        every cell it enters is marked, exactly like rk4 does while
+        integrating.
+
+        :param (dict) lanes: result of rk4_integrate_lanes
+        :param (int) lane: index of the lane to replay
+        :param (list) changes: receives the (xb, yb) cells marked
+        :rtype (int, int): number of trajectory points and of steps
+        """
+        n_events = lanes["n_events"][lane]
+        xbs = lanes["xbs"][: n_events + 1, lane]
+        ybs = lanes["ybs"][: n_events + 1, lane]
+        events = np.nonzero((xbs[1:] != xbs[:-1]) | (ybs[1:] != ybs[:-1]))[0] + 1
+        for j in events:
+            if self.blank[ybs[j], xbs[j]] == 0:
+                self.blank[ybs[j], xbs[j]] = 1
+                changes.append((xbs[j], ybs[j]))
+            else:
+                return j, j
+        return lanes["n_points"][lane], lanes["n_steps"][lane]
+
+    def ring_seeds(self, indent):
+        """
+        Seeds of one ring, in the order they are integrated
+
+        :param (int) indent: distance of the ring from the blank grid edge
+        :rtype (list): (xb, yb) blank cells, corners appear twice
+        """
+        seeds = []
+        for xi in range(self.density - 2 * indent):
+            seeds.append((xi + indent, indent))
+            seeds.append((xi + indent, self.density - 1 - indent))
+            seeds.append((indent, xi + indent))
+            seeds.append((self.density - 1 - indent, xi + indent))
+        return [
+            (xb, yb) for xb, yb in seeds
+            if 0 <= xb < self.density and 0 <= yb < self.density
+        ]
+
+    def traj_ring(self, seeds):
+        """
+        Integrate the trajectories of one seeding ring at once
+
+        :param (list) seeds: (xb, yb) seeds of the ring, see ring_seeds
+
+        All candidate seeds of the ring are integrated simultaneously with
+        rk4_integrate_lanes. The results are then replayed in the seeding
+        order of get_streamlines, which resolves conflicts on the blank
+        grid in the same way as integrating the seeds one by one.
+        """
+        # Seeds already occupied at the start of the ring are never integrated
+        candidates = list(dict.fromkeys(
+            (xb, yb) for xb, yb in seeds if self.blank[yb, xb] == 0
+        ))
+        if len(candidates) == 0:
+            return
+        cancel.checkpoint()
+        lane_of = {seed: i for i, seed in enumerate(candidates)}
+        xb0 = np.array([xb for xb, _ in candidates])
+        yb0 = np.array([yb for _, yb in candidates])
+        x0 = np.tile(xb0 * self.spacing_x, 2)
+        y0 = np.tile(yb0 * self.spacing_y, 2)
+        sign = np.repeat([1.0, -1.0], len(candidates))
+        lanes = self.rk4_integrate_lanes(x0, y0, sign, self.blank.copy())
+
+        for xb, yb in seeds:
+            if self.blank[yb, xb] != 0:
+                continue
+            self.n_seeds += 1
+            forward = lane_of[(xb, yb)]
+            backward = forward + len(candidates)
+            changes = []
+            nf, sf = self.resolve_lane(lanes, forward, changes)
+            nb, sb = self.resolve_lane(lanes, backward, changes)
+            # Only the steps up to the cuts count, like the ones of rk4
+            self.n_steps += int(sf + sb)
+            if nf + nb < 1:
+                continue
+            if self.stotals[sf] + self.stotals[sb] > 0.2:
+                self.blank[yb, xb] = 1
+                x_traj = np.concatenate((
+                    lanes["xs"][:nb, backward][::-1], lanes["xs"][1:nf, forward]
+                ))
+                y_traj = np.concatenate((
+                    lanes["ys"][:nb, backward][::-1], lanes["ys"][1:nf, forward]
+                ))
+                self.trajectories.append((x_traj, y_traj))
+                self.trajectory_seeds.append((xb, yb, nb - 1))
+            else:
+                for cx, cy in changes:
+                    self.blank[cy, cx] = 0
+
+    def decimate_trajectories(self, tolerance):
+        """
+        Drops collinear vertices from all trajectories.
+
+        :param (float) tolerance: maximum deviation from the original
+            trajectory, as a fraction of the domain size
+
+        Trajectories are simplified in axes units, such that the tolerance
+        is independent of the grid resolution and aspect ratio.
+        """
+        for index, (x_traj, y_traj) in enumerate(self.trajectories):
+            x_traj = np.asarray(x_traj)
+            y_traj = np.asarray(y_traj)
+            keep = simplify_trajectory(
+                x_traj / len(self.x), y_traj / len(self.y), tolerance
+            )
+            self.trajectories[index] = (x_traj[keep], y_traj[keep])
+        self.scale_trajectories()
 
     def get_streamlines(self):
         """
         Get streamlines by building trajectory set.
         """
+        if self.tiles > 1:
+            self.get_streamlines_tiled()
+        else:
+            for indent in range(self.density // 2):
+                self.traj_seeds(self.ring_seeds(indent))
+
+        self.scale_trajectories()
+
+    def traj_seeds(self, seeds):
+        """
+        Integrate the trajectories of the seeds of one ring, in order
+
+        :param (list) seeds: (xb, yb) seeds, see ring_seeds
+        """
+        if self.method == "rk4_vectorized":
+            self.traj_ring(seeds)
+            return
+        for xb, yb in seeds:
+            self.traj(xb, yb)
+
+    def tile_of(self, xb, yb):
+        """
+        Index of the tile of a seed, the blank grid being split into
+        tiles x tiles rectangles.
+        """
+        return (yb * self.tiles // self.density) * self.tiles + xb * self.tiles // self.density
+
+    def integrate_tile(self, tile, seeds):
+        """
+        Trajectories of some seeds of one tile only, on a copy of the blank
+        grid
+
+        The seeds are integrated in the order of get_streamlines. This is
+        the unit of work of get_streamlines_tiled, and runs in a worker
+        process if the executor is a process pool.
+
+        :param (int) tile: index of the tile, see tile_of
+        :param (ndarray) seeds: boolean blank grid flagging the seeds to
+            integrate
+        :rtype (list, ndarray, int, int): (xb, yb, seed index, x-values,
+            y-values) per trajectory, the blank cells occupied by them, and
+            the number of seeds and of steps integrated
+        """
+        part = copy.copy(self)
+        part.blank = self.blank.copy()
+        part.trajectories = []
+        part.trajectory_seeds = []
+        part.n_seeds = 0
+        part.n_steps = 0
+        for indent in range(self.density // 2):
+            part.traj_seeds([
+                (xb, yb) for xb, yb in self.ring_seeds(indent)
+                if seeds[yb, xb] and self.tile_of(xb, yb) == tile
+            ])
+
+        trajectories = [
+            (xb, yb, start, np.asarray(x_traj, dtype=float), np.asarray(y_traj, dtype=float))
+            for (xb, yb, start), (x_traj, y_traj)
+            in zip(part.trajectory_seeds, part.trajectories)
+        ]
+        return trajectories, (part.blank != 0) & (self.blank == 0), part.n_seeds, part.n_steps
+
+    def get_streamlines_tiled(self):
+        """
+        Get streamlines by integrating the tiles independently and merging
+
+        Every tile integrates its own seeds with integrate_tile, on the
+        executor if given. The trajectories of all tiles are then merged in
+        the seeding order of get_streamlines, see merge_trajectories. The
+        merge leaves gaps where trajectories were cut short, so the seeds a
+        tile skipped because its own trajectories covered them are
+        integrated again, in TILE_ROUNDS rounds of tiles and finally one
+        after another. The result only depends on the number of tiles, not
+        on the executor or the order the tiles finish.
+        """
+        seeds = np.zeros(self.blank.shape, dtype=bool)
+        for indent in range(self.density // 2):
+            for xb, yb in self.ring_seeds(indent):
+                seeds[yb, xb] = True
+        tile_grid = self.tile_of(*np.meshgrid(np.arange(self.density), np.arange(self.density)))
+
+        for _ in range(TILE_ROUNDS):
+            tiles = np.unique(tile_grid[seeds]).tolist()
+            if len(tiles) == 0:
+                break
+            if self.executor is None:
+                results = []
+                for tile in tiles:
+                    cancel.checkpoint()
+                    results.append(self.integrate_tile(tile, seeds))
+            else:
+                futures = [self.executor.submit(self.integrate_tile, tile, seeds) for tile in tiles]
+                try:
+                    pending = set(futures)
+                    while pending:
+                        cancel.checkpoint()
+                        _, pending = concurrent.futures.wait(pending, timeout=0.05)
+                finally:
+                    for future in futures:
+                        future.cancel()
+                results = [future.result() for future in futures]
+
+            covered = np.zeros(self.blank.shape, dtype=bool)
+            trajectories = []
+            for tile, (tile_trajectories, occupied, n_seeds, n_steps) in zip(tiles, results):
+                covered |= occupied & (tile_grid == tile)
+                trajectories.extend(tile_trajectories)
+                self.n_seeds += n_seeds
+                self.n_steps += n_steps
+            self.merge_trajectories(trajectories)
+            seeds &= covered & (self.blank == 0)
+
+        for indent in range(self.density // 2):
+            self.traj_seeds([(xb, yb) for xb, yb in self.ring_seeds(indent) if seeds[yb, xb]])
+
+    def merge_trajectories(self, trajectories):
+        """
+        Replays trajectories integrated independently on the blank grid
+
+        In the seeding order of get_streamlines, a trajectory whose seed is
+        already occupied is dropped, and each half is cut at the first
+        occupied cell, see cut_trajectory. A trajectory cut below the
+        minimum length is dropped as well.
+
+        :param (list) trajectories: (xb, yb, seed index, x-values,
+            y-values) per trajectory, see integrate_tile
+        """
+        rank = {}
         for indent in range(self.density // 2):
-            for xi in range(self.density - 2 * indent):
-                self.traj(xi + indent, indent)
-                self.traj(xi + indent, self.density - 1 - indent)
-                self.traj(indent, xi + indent)
-                self.traj(self.density - 1 - indent, xi + indent)
+            for seed in self.ring_seeds(indent):
+                rank.setdefault(seed, len(rank))
+
+        for xb, yb, start, x_traj, y_traj in sorted(trajectories, key=lambda t: rank[t[:2]]):
+            cancel.checkpoint()
+            if self.blank[yb, xb] != 0:
+                continue
+            n_points = len(x_traj)
+            nb, back = self.cut_trajectory(x_traj[start::-1], y_traj[start::-1])
+            nf, forward = self.cut_trajectory(x_traj[start:], y_traj[start:])
+            x_traj = x_traj[start - nb + 1:start + nf]
+            y_traj = y_traj[start - nb + 1:start + nf]
+            if len(x_traj) < n_points:
+                # Cut short by an earlier trajectory, check its length again
+                length = np.hypot(np.diff(x_traj) / len(self.x), np.diff(y_traj) / len(self.y)).sum()
+                if length <= 0.2:
+                    continue
+            for cx, cy in back + forward:
+                self.blank[cy, cx] = 1
+            self.blank[yb, xb] = 1
+            self.trajectories.append((x_traj, y_traj))
+            self.trajectory_seeds.append((xb, yb, nb - 1))
+
+    def cut_trajectory(self, xs, ys):
+        """
+        Cuts one half of a trajectory at the first occupied blank cell
 
+        The cells are entered like while integrating: at the vertices for
+        'rk4', and along the whole step for 'rk45'.
+
+        :param (ndarray) xs: x-values from the seed outwards
+        :param (ndarray) ys: y-values from the seed outwards
+        :rtype (int, list): number of vertices kept and the (xb, yb) cells
+            they enter
+        """
+        dx = np.diff(xs)
+        dy = np.diff(ys)
+        if self.method == "rk45":
+            n_sub = (2 * np.maximum(np.abs(dx) / self.spacing_x, np.abs(dy) / self.spacing_y)).astype(np.int64) + 1
+        else:
+            n_sub = np.ones(len(dx), dtype=np.int64)
+        step = np.repeat(np.arange(len(dx)), n_sub)
+        frac = (np.arange(len(step)) - np.repeat(np.cumsum(n_sub) - n_sub, n_sub) + 1) / n_sub[step]
+        xb = ((xs[step] + dx[step] * frac) / self.spacing_x + 0.5).astype(np.int64)
+        yb = ((ys[step] + dy[step] * frac) / self.spacing_y + 0.5).astype(np.int64)
+
+        x0, y0 = self.blank_pos(xs[0], ys[0])
+        entered = (xb != np.concatenate(([x0], xb[:-1]))) | (yb != np.concatenate(([y0], yb[:-1])))
+        step, xb, yb = step[entered], xb[entered], yb[entered]
+        occupied = np.nonzero(self.blank[yb, xb] != 0)[0]
+        if len(occupied) == 0:
+            return len(xs), list(zip(xb.tolist(), yb.tolist()))
+        first = occupied[0]
+        return int(step[first]) + 1, list(zip(xb[:first].tolist(), yb[:first].tolist()))
+
+    def scale_trajectories(self):
+        """
+        Convert trajectories from grid-index units to the x and y values.
+        """
         self.st_x = [
             np.array(t[0]) * self.delta_x + self.x[0] for t in self.trajectories
         ]
@@ -308,42 +1120,39 @@ class _Streamline(object):
             np.array(t[1]) * self.delta_y + self.y[0] for t in self.trajectories
         ]
 
-        for index in range(len(self.st_x)):
-            self.st_x[index] = self.st_x[index].tolist()
-            self.st_x[index].append(np.nan)
+        # Offsets of each streamline in the NaN-separated output arrays
+        lengths = np.array([len(st) + 1 for st in self.st_x], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(lengths)))
 
-        for index in range(len(self.st_y)):
-            self.st_y[index] = self.st_y[index].tolist()
-            self.st_y[index].append(np.nan)
-
-    def get_streamline_arrows(self):
+    def get_streamline_arrows(self, streamline_x=None, streamline_y=None):
         """
         Makes an arrow for each streamline.
 
         Gets angle of streamline at 1/3 mark and creates arrow coordinates
         based off of user defined angle and arrow_scale.
 
-        :param (array) st_x: x-values for all streamlines
-        :param (array) st_y: y-values for all streamlines
+        :param (ndarray) streamline_x: result of sum_streamlines, if already
+            computed. Default = None (computed here)
+        :param (ndarray) streamline_y: result of sum_streamlines, if already
+            computed. Default = None (computed here)
         :param (angle in radians) angle: angle of arrowhead. Default = pi/9
         :param (float in [0,1]) arrow_scale: value to scale length of arrowhead
             Default = .09
-        :rtype (list, list) arrows_x: x-values to create arrowhead and
-            arrows_y: y-values to create arrowhead
-        """
-        arrow_end_x = np.empty((len(self.st_x)))
-        arrow_end_y = np.empty((len(self.st_y)))
-        arrow_start_x = np.empty((len(self.st_x)))
-        arrow_start_y = np.empty((len(self.st_y)))
-        for index in range(len(self.st_x)):
-            arrow_end_x[index] = self.st_x[index][int(len(self.st_x[index]) / 3)]
-            arrow_start_x[index] = self.st_x[index][
-                (int(len(self.st_x[index]) / 3)) - 1
-            ]
-            arrow_end_y[index] = self.st_y[index][int(len(self.st_y[index]) / 3)]
-            arrow_start_y[index] = self.st_y[index][
-                (int(len(self.st_y[index]) / 3)) - 1
-            ]
+        :rtype (ndarray, ndarray) arrows_x: x-values to create arrowhead and
+            arrows_y: y-values to create arrowhead, NaN-separated
+        """
+        if streamline_x is None or streamline_y is None:
+            streamline_x, streamline_y = self.sum_streamlines()
+        starts = self.offsets[:-1]
+        lengths = np.diff(self.offsets)
+
+        # The index before the arrow end wraps around onto the separating NaN
+        end_index = starts + (lengths / 3).astype(np.int64)
+        start_index = starts + ((lengths / 3).astype(np.int64) - 1) % lengths
+        arrow_end_x = streamline_x[end_index]
+        arrow_start_x = streamline_x[start_index]
+        arrow_end_y = streamline_y[end_index]
+        arrow_start_y = streamline_y[start_index]
 
         dif_x = arrow_end_x - arrow_start_x
         dif_y = arrow_end_y - arrow_start_y
@@ -361,48 +1170,34 @@ class _Streamline(object):
         seg2_x = np.cos(ang2) * self.arrow_scale
         seg2_y = np.sin(ang2) * self.arrow_scale
 
-        point1_x = np.empty((len(dif_x)))
-        point1_y = np.empty((len(dif_y)))
-        point2_x = np.empty((len(dif_x)))
-        point2_y = np.empty((len(dif_y)))
-
-        for index in range(len(dif_x)):
-            if dif_x[index] >= 0:
-                point1_x[index] = arrow_end_x[index] - seg1_x[index]
-                point1_y[index] = arrow_end_y[index] - seg1_y[index]
-                point2_x[index] = arrow_end_x[index] - seg2_x[index]
-                point2_y[index] = arrow_end_y[index] - seg2_y[index]
-            else:
-                point1_x[index] = arrow_end_x[index] + seg1_x[index]
-                point1_y[index] = arrow_end_y[index] + seg1_y[index]
-                point2_x[index] = arrow_end_x[index] + seg2_x[index]
-                point2_y[index] = arrow_end_y[index] + seg2_y[index]
-
-        space = np.empty((len(point1_x)))
-        space[:] = np.nan
+        # Arrowheads point backwards along the streamline direction
+        sign = np.where(dif_x >= 0, -1.0, 1.0)
 
-        # Combine arrays into matrix
-        arrows_x = np.matrix([point1_x, arrow_end_x, point2_x, space])
-        arrows_x = np.array(arrows_x)
-        arrows_x = arrows_x.flatten("F")
-        arrows_x = arrows_x.tolist()
+        # Interleave point1, arrow end, point2 and a separating NaN
+        arrows_x = np.full((len(dif_x), 4), np.nan)
+        arrows_x[:, 0] = arrow_end_x + sign * seg1_x
+        arrows_x[:, 1] = arrow_end_x
+        arrows_x[:, 2] = arrow_end_x + sign * seg2_x
 
-        # Combine arrays into matrix
-        arrows_y = np.matrix([point1_y, arrow_end_y, point2_y, space])
-        arrows_y = np.array(arrows_y)
-        arrows_y = arrows_y.flatten("F")
-        arrows_y = arrows_y.tolist()
+        arrows_y = np.full((len(dif_y), 4), np.nan)
+        arrows_y[:, 0] = arrow_end_y + sign * seg1_y
+        arrows_y[:, 1] = arrow_end_y
+        arrows_y[:, 2] = arrow_end_y + sign * seg2_y
 
-        return arrows_x, arrows_y
+        return arrows_x.ravel(), arrows_y.ravel()
 
     def sum_streamlines(self):
         """
         Makes all streamlines readable as a single trace.
 
-        :rtype (list, list): streamline_x: all x values for each streamline
-            combined into single list and streamline_y: all y values for each
-            streamline combined into single list
+        :rtype (ndarray, ndarray): streamline_x: all x values for each
+            streamline combined into single NaN-separated array and
+            streamline_y: all y values for each streamline combined into
+            single NaN-separated array
         """
-        streamline_x = sum(self.st_x, [])
-        streamline_y = sum(self.st_y, [])
+        streamline_x = np.full(self.offsets[-1], np.nan)
+        streamline_y = np.full(self.offsets[-1], np.nan)
+        for start, st_x, st_y in zip(self.offsets, self.st_x, self.st_y):
+            streamline_x[start:start + len(st_x)] = st_x
+            streamline_y[start:start + len(st_y)] = st_y
         return streamline_x, streamline_y
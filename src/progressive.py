@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import threading
+import numpy as np
+import src.cancellation as cancel
+import src.instrumentation as instr
+from src.renderer import render_figure
+
+"""
+Seconds a draw of several passes waits on the executor before computing
+them, such that inputs changing in quick succession cancel it before it
+costs anything. A single pass starts right away.
+"""
+DEBOUNCE = 0.3
+
+## Functions
+def coarse_pass(compute_kwargs, factor=4, density_scale=0.5):
+    """
+    Settings of a quick preview of a draw: a grid factor times coarser and
+    sparser streamlines.
+
+    Parameters:
+        compute_kwargs : dict
+            Keyword arguments of Flowfield.compute() of the full draw,
+            including x_points and y_points.
+        factor         : int
+            Coarsening of the grid along each axis.
+        density_scale  : float
+            Factor applied to the streamline density.
+    Returns:
+        kwargs         : dict
+            Keyword arguments of Flowfield.compute() of the preview.
+    """
+    kwargs = dict(compute_kwargs)
+    for axis in ("x_points", "y_points"):
+        points       = kwargs[axis]
+        kwargs[axis] = np.linspace(points[0], points[-1], max(len(points) // factor, 10))
+    kwargs["n_streamline_density"] = kwargs.get("n_streamline_density", 0.5) * density_scale
+    kwargs["refine"]               = 1
+
+    return kwargs
+
+## ProgressiveDraw Class
+class ProgressiveDraw:
+    """
+    Draw computed as a cancellable job, optionally showing a coarse preview
+    first.
+
+    The first pass can be computed right away by preview(); start()
+    computes the remaining passes, or all of them without a preview, on an
+    executor, each replacing the figure of the previous one. The background
+    passes work on a snapshot of the flow objects, see Flowfield.snapshot(),
+    so editing them does not affect it; the incremental superposition of
+    each finished pass is handed back to the field. cancel() stops a
+    running pass at its next checkpoint, see src/cancellation.py.
+
+    Parameters:
+        field         : Flowfield
+            Flow field to draw.
+        passes        : list of dict
+            Keyword arguments of Flowfield.compute() per pass, from coarse
+            to fine.
+        render_kwargs : dict
+            Keyword arguments of render_figure().
+        signature     : object, optional
+            Identifies the inputs of the draw, see is_current().
+        debounce      : float, optional
+            Delay before the background passes start, if there are more
+            than one, see DEBOUNCE.
+
+    Attributes:
+        figure        : go.Figure
+            Figure of the finest pass computed so far, None before preview().
+        level         : int
+            Index of that pass in passes.
+        recorder      : instr.Recorder
+            Timings and counters of all passes.
+    """
+    def __init__(self, field, passes, render_kwargs, signature=None, debounce=DEBOUNCE):
+        self.field         = field
+        self.passes        = list(passes)
+        self.render_kwargs = dict(render_kwargs)
+        self.signature     = signature
+        self.debounce      = debounce
+        self.figure        = None
+        self.level         = -1
+        self.recorder      = instr.Recorder()
+        self.token         = cancel.CancelToken()
+        self._finished     = threading.Event()
+        self._lock         = threading.Lock()
+        self._future       = None
+
+    def _compute(self, field, level):
+        try:
+            with cancel.cancellable(self.token), instr.recording(self.recorder):
+                result = field.compute(**self.passes[level])
+                with instr.timer("render"):
+                    figure = render_figure(result, **self.render_kwargs)
+        except cancel.Cancelled:
+            return
+        with self._lock:
+            if not self.token.cancelled:
+                self.figure, self.level = figure, level
+        if field is not self.field:
+            self.field.adopt_superposition(field)
+
+    def preview(self):
+        """
+        Computes the first pass in the calling thread and returns its figure.
+        """
+        self._compute(self.field, 0)
+        if len(self.passes) == 1:
+            self._finished.set()
+        return self.figure
+
+    def _refine(self, field, first):
+        try:
+            if len(self.passes) > 1 and self.token.wait(self.debounce):
+                return
+            for level in range(first, len(self.passes)):
+                if self.token.cancelled:
+                    return
+                self._compute(field, level)
+        finally:
+            self._finished.set()
+
+    def start(self, executor):
+        """
+        Submits the passes not computed by preview() to the executor.
+        """
+        if self.level + 1 < len(self.passes):
+            self._future = executor.submit(self._refine, self.field.snapshot(), self.level + 1)
+        else:
+            self._finished.set()
+
+    def cancel(self):
+        """
+        Stops the background passes; a pass already running stops at its
+        next checkpoint and its figure is discarded.
+        """
+        self.token.cancel()
+        if self._future is not None and self._future.cancel():
+            self._finished.set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the background passes have finished, or timeout seconds have
+        passed. Returns True if it has finished.
+        """
+        return self._finished.wait(timeout)
+
+    def is_current(self, signature):
+        """
+        True if the draw was started with the given input signature.
+        """
+        return self.signature == signature
+
+    @property
+    def done(self):
+        """True once all passes are computed, or the draw was cancelled."""
+        return self._finished.is_set()
+
+    @property
+    def cancelled(self):
+        return self.token.cancelled
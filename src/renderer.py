@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import os
+import numpy as np
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+import src.instrumentation as instr
+from src.commondicts import LONG_NAME_DICT
+
+## Default renderer of fig.show(), read when plotly.io is first imported; importing it here would load
+## IPython at startup
+os.environ.setdefault(
+    "PLOTLY_RENDERER", "browser"  # Feel free to disable this if you're running in notebook mode or prefer a different frontend.
+)
+
+"""
+Size of the figure in pixels, and the spacing and margins of its 2x2 subplots,
+used to size the contour data to the screen.
+"""
+FIGURE_WIDTH    = 900
+FIGURE_HEIGHT   = 800
+SUBPLOT_SPACING = 0.08
+FIGURE_MARGINS  = (80, 80, 100, 80)     ## plotly default margins (left, right, top, bottom)
+
+def line_color(object):
+    try:
+        color = "green" if object.strength > 0 else "red"
+    except AttributeError:
+        color = "black"
+
+    return color
+
+def dot_size(object):
+    try:
+        strength = abs(object.strength) / 10
+    except AttributeError:
+        strength = 1
+
+    return 10 + np.tanh(strength) * 10
+
+def line_width(object):
+    try:
+        strength = abs(object.strength) / 10
+    except AttributeError:
+        strength = 1
+
+    return 10 + np.tanh(strength) * 10
+
+## Functions
+def subplot_pixels():
+    """
+    Approximate width and height in pixels of the plotting area of one
+    subplot.
+    """
+    left, right, top, bottom = FIGURE_MARGINS
+    width  = (FIGURE_WIDTH - left - right) * (1 - SUBPLOT_SPACING) / 2
+    height = (FIGURE_HEIGHT - top - bottom) * (1 - SUBPLOT_SPACING) / 2
+
+    return int(width), int(height)
+
+def decimate_indices(n, n_max):
+    """
+    At most n_max evenly spread indices of an axis of n samples, always
+    including the first and the last one.
+    """
+    if n <= n_max:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, max(n_max, 2)).round().astype(np.int64))
+
+def level_of_detail(x_points, y_points, max_samples, window=None):
+    """
+    Indices of the grid samples to plot, such that a subplot does not get
+    more contour samples than it has pixels.
+
+    The fields themselves, their contour bounds and the streamlines are
+    computed on the full grid; only the data handed to the contour traces
+    is decimated.
+
+    Parameters:
+        x_points, y_points : np.ndarray
+            x- and y-values of the grid.
+        max_samples        : (int, int)
+            Maximum number of samples along x and y.
+        window             : ((float, float), (float, float)), optional
+            x- and y-range to show, e.g. after zooming in. Only samples
+            inside it are kept, which refines the zoomed view up to the
+            full grid resolution. API only: the app does not pass it, as
+            st.plotly_chart does not report zoom (relayout) events; a
+            front end that does can re-render with the zoomed axis ranges.
+    Returns:
+        ix, iy             : np.ndarray
+            Indices into x_points and y_points.
+    """
+    axes = []
+    for points, n_max, bounds in zip((x_points, y_points), max_samples, window or (None, None)):
+        inside = np.arange(len(points))
+        if bounds is not None:
+            lower, upper = min(bounds), max(bounds)
+            ## Keep one sample beyond each bound, such that the contours fill the window
+            start  = max(int(np.searchsorted(points, lower, side="right")) - 1, 0)
+            stop   = min(int(np.searchsorted(points, upper, side="left")) + 1, len(points) - 1)
+            inside = inside[start:stop + 1]
+        axes.append(inside[decimate_indices(len(inside), n_max)])
+
+    return tuple(axes)
+
+def payload_array(values, compact=False):
+    """
+    Array as handed to plotly.
+
+    In compact mode, the values are cast to contiguous float32, which
+    plotly serializes as a base64 typed array ({"dtype": "f4", "bdata": ...})
+    instead of a list of decimal numbers, at half the size of float64.
+    """
+    if not compact:
+        return values
+    return np.ascontiguousarray(values, dtype=np.float32)
+
+def element_traces(markers):
+    """
+    Batched traces marking the flow elements.
+
+    Elements described by a point are collected into one marker trace, with
+    per-point colors, sizes and hover data. Elements described by a line are
+    joined into NaN-separated line traces, one per line color and (rounded)
+    width, as plotly cannot vary these within a trace. The number of traces
+    is therefore bounded, regardless of the number of elements.
+
+    Parameters:
+        markers : list of SimpleNamespace
+            Flow elements, see element_markers().
+    Returns:
+        traces  : list of go.Scatter
+            Traces to add to every subplot.
+    """
+    points = [object for object in markers if hasattr(object, "x") and hasattr(object, "y")]
+    lines  = [object for object in markers if hasattr(object, "x1")]
+    traces = []
+
+    ## All flow elements that are described by a point
+    if points:
+        traces.append(go.Scatter(name="elements",
+                                 x=[object.x for object in points], y=[object.y for object in points],
+                                 mode="markers",
+                                 marker=dict(color=[line_color(object) for object in points],
+                                             size=[dot_size(object) for object in points]
+                                            ),
+                                 customdata=[[object.name,
+                                              f"{object.strength:.4e}",
+                                              f"alpha = {object.alpha:.4e}" if object.type == "Doublet" else ""]
+                                             for object in points],
+                                 hovertemplate='<b>%{customdata[0]}</b>'+
+                                               '<br>x = %{x:.4f}'+
+                                               '<br>y = %{y:.4f}'+
+                                               '<br>strength = %{customdata[1]}'+
+                                               '<br>%{customdata[2]}'
+                                               '<extra></extra>',
+                                )
+                     )
+
+    ## All flow elements that are described by a line, grouped by their style
+    styles = {}
+    for object in lines:
+        style = (line_color(object), round(float(line_width(object))))
+        styles.setdefault(style, []).append(object)
+    for (color, width), group in styles.items():
+        traces.append(go.Scatter(name="line_elements",
+                                 x=[value for object in group for value in (object.x1, object.x2, None)],
+                                 y=[value for object in group for value in (object.y1, object.y2, None)],
+                                 mode="lines",
+                                 line=dict(color=color,
+                                           width=width
+                                          ),
+                                 customdata=[[object.name, f"{object.strength:.4e}"]
+                                             for object in group for _ in range(3)],
+                                 hovertemplate='<b>%{customdata[0]}</b>'+
+                                               '<br>x = %{x:.4f}'+
+                                               '<br>y = %{y:.4f}'+
+                                               '<br>strength = %{customdata[1]}'+
+                                               '<extra></extra>',
+                                )
+                     )
+
+    return traces
+
+def render_figure(result, colorscheme="rainbow", n_contour_lines=15, compact=False, lod=False, window=None):
+    """
+    Builds the plotly figure of a computed flow field.
+
+    Parameters:
+        result          : FieldResult
+            Output of Flowfield.compute().
+        colorscheme     : string
+            Plotly colorscale of the contour plots.
+        n_contour_lines : int
+            Number of filled contours per plot.
+        compact         : bool
+            Hand the fields and streamlines to plotly as float32 arrays, see
+            payload_array().
+        lod             : bool
+            Decimate the contour data to the pixel size of the subplots,
+            see level_of_detail().
+        window          : ((float, float), (float, float)), optional
+            x- and y-range to show instead of the full grid, see
+            level_of_detail(). Not set by the app.
+    Returns:
+        fig             : go.Figure
+            2x2 subplots of the x-velocity, pressure coefficient, velocity
+            potential and stream function.
+    """
+    ## Create plots
+    fig = make_subplots(rows=2, cols=2,
+                        subplot_titles=(LONG_NAME_DICT["xvel"], LONG_NAME_DICT["pressure"],
+                                        LONG_NAME_DICT["potential"], LONG_NAME_DICT["streamfunction"]),
+                        shared_xaxes=True,
+                        shared_yaxes=True,
+                        x_title='x',
+                        y_title='y',
+                        horizontal_spacing=SUBPLOT_SPACING,
+                        vertical_spacing=SUBPLOT_SPACING
+                       )
+    if result.is_empty:  # Edge scenario
+        return fig
+
+    ## Contour samples, decimated to the screen resolution with level of detail
+    if lod:
+        ix, iy = level_of_detail(result.x_points, result.y_points, subplot_pixels(), window)
+    else:
+        ix, iy = np.arange(len(result.x_points)), np.arange(len(result.y_points))
+    contour  = lambda values: payload_array(values[np.ix_(iy, ix)], compact)
+    x_points = payload_array(result.x_points[ix], compact)
+    y_points = payload_array(result.y_points[iy], compact)
+
+    #### ================ ####
+    #### Plotting Routine ####
+    #### ================ ####
+    with instr.timer("render.contours"):
+        ## Velocity Magnitude
+        min, max = result.ranges["xvel"]
+        fig.add_trace(go.Contour(name=LONG_NAME_DICT["xvel"],
+                                 x=x_points, y=y_points, z=contour(result.xvel),
+                                 colorscale=colorscheme,
+                                 contours=dict(start=min,
+                                               end=max,
+                                               size=(max - min) / n_contour_lines,
+                                              ),
+                                 contours_showlines=False,
+                                 showscale=True,
+                                 hovertemplate='x = %{x:.4f}'+
+                                               '<br>y = %{y:.4f}'+
+                                               '<br>u = %{z:.4e}'+
+                                               '<extra></extra>', ## '<extra></extra>' removes the trace name from hover text
+                                 colorbar=dict(title_text= LONG_NAME_DICT["xvel"] + '   [m s<sup>-1</sup>]',
+                                               title_side= 'right',
+                                               ticks     = "inside",
+                                               len       = 0.45,                          ## vertical height of colorbar, expressed in a fraction of graph height, final height reduced by ypad
+                                               tickwidth = 2,
+                                               ticklen   = 10,
+                                               x         = 1.02,
+                                               y         = 0.77,
+                                               ypad      = 0
+                                              ),
+                                ),
+                      row=1, col=1
+                     )
+
+        #### Impose contour lines from the streamfunction field onto the x-velocity field
+        #### It is an alternative option to strline.create_streamline()!
+        # min = np.nanpercentile(streamfunction, 5)
+        # max = np.nanpercentile(streamfunction, 95)
+        # fig.add_trace(go.Contour(x=result.x_points, y=result.y_points, z=result.streamfunction,
+        #                          colorscale=[[0,'#000000'],[1,'#000000']],
+        #                          contours=dict(start=min,
+        #                                        end=max,
+        #                                        size=(max - min) / n_contour_lines,
+        #                                       ),
+        #                          showscale=False,
+        #                          contours_coloring='lines',
+        #                          hoverinfo='skip'
+        #                         ),
+        #               row=1, col=1
+        #              )
+
+        ## Pressure Coefficient
+        min, max = result.ranges["pressure"]
+        fig.add_trace(go.Contour(name=LONG_NAME_DICT["pressure"],
+                                 x=x_points, y=y_points, z=contour(result.pressure),
+                                 colorscale=colorscheme,
+                                 contours=dict(start=min,
+                                               end=max,
+                                               size=(max - min) / n_contour_lines,
+                                              ),
+                                 contours_showlines=False,
+                                 showscale=True,
+                                 hovertemplate='x = %{x:.4f}'+
+                                               '<br>y = %{y:.4f}'+
+                                               '<br>Cp = %{z:.4e}'+
+                                               '<extra></extra>',
+                                 colorbar=dict(title_text= LONG_NAME_DICT["pressure"] + '   [-]',
+                                               title_side= 'right',
+                                               ticks     = "inside",
+                                               len       = 0.45,                          ## vertical height of colorbar, expressed in a fraction of graph height, final height reduced by ypad
+                                               tickwidth = 2,
+                                               ticklen   = 10,
+                                               x         = 1.17,
+                                               y         = 0.77,
+                                               ypad      = 0
+                                              ),
+                                ),
+                      row=1, col=2
+                     )
+
+        ## Potential Function
+        min, max = result.ranges["potential"]
+        fig.add_trace(go.Contour(name=LONG_NAME_DICT['potential'],
+                                 x=x_points, y=y_points, z=contour(result.potential),
+                                 colorscale=colorscheme,
+                                 contours=dict(start=min,
+                                               end=max,
+                                               size=(max - min) / n_contour_lines,
+                                              ),
+                                 contours_showlines=False,
+                                 showscale=True,
+                                 hovertemplate='x = %{x:.4f}'+
+                                               '<br>y = %{y:.4f}'+
+                                               '<br>phi = %{z:.4e}'+
+                                               '<extra></extra>',
+                                 colorbar=dict(title_text= LONG_NAME_DICT["potential"] + '   [m<sup>2</sup> s<sup>-1</sup>]',
+                                               title_side= 'right',
+                                               ticks     = "inside",
+                                               len       = 0.45,                          ## vertical height of colorbar, expressed in a fraction of graph height, final height reduced by ypad
+                                               tickwidth = 2,
+                                               ticklen   = 10,
+                                               x         = 1.02,
+                                               y         = 0.23,
+                                               ypad      = 0
+                                              ),
+                                ),
+                      row=2, col=1
+                     )
+
+        ## Streamfunction
+        min, max = result.ranges["streamfunction"]
+        fig.add_trace(go.Contour(name=LONG_NAME_DICT['streamfunction'],
+                                 x=x_points, y=y_points, z=contour(result.streamfunction),
+                                 colorscale=colorscheme,
+                                 contours=dict(start=min,
+                                               end=max,
+                                               size=(max - min) / n_contour_lines,
+                                              ),
+                                 contours_showlines=False,
+                                 showscale=True,
+                                 hovertemplate='x = %{x:.4f}'+
+                                               '<br>y = %{y:.4f}'+
+                                               '<br>psi = %{z:.4e}'+
+                                               '<extra></extra>',
+                                 colorbar=dict(title_text= LONG_NAME_DICT["streamfunction"] + '   [m<sup>2</sup> s<sup>-1</sup>]',
+                                               title_side= 'right',
+                                               ticks     = "inside",
+                                               len       = 0.45,                          ## vertical height of colorbar, expressed in a fraction of graph height, final height reduced by ypad
+                                               tickwidth = 2,
+                                               ticklen   = 10,
+                                               x         = 1.17,
+                                               y         = 0.23,
+                                               ypad      = 0
+                                              ),
+                                 ),
+                      row=2, col=2
+                     )
+
+
+    with instr.timer("render.streamlines"):
+        ## The streamlines are integrated once and the same trace is added to several subplots
+        dtype            = np.float32 if compact else None
+        streamline_trace = result.streamlines.to_scatter(dtype=dtype,
+                                                       hoverinfo='skip',
+                                                       name='stream_lines',
+                                                       line=dict(color='rgba(0,0,0,1)',
+                                                                 width=1)
+                                                      )
+        # https://stackoverflow.com/questions/68187485/subplot-for-go-figure-objects-with-multiple-plots-within-them
+        fig.add_trace(streamline_trace, row=1, col=1)
+        fig.add_trace(streamline_trace, row=1, col=2)
+        fig.add_trace(streamline_trace, row=2, col=2)
+        if result.potentiallines is not None:
+            fig.add_trace(result.potentiallines.to_scatter(dtype=dtype,
+                                                         hoverinfo='skip',
+                                                         name='potential_lines',
+                                                         line=dict(color='rgba(0,0,0,1)',
+                                                                   width=1)
+                                                        ),
+                          row=2, col=1
+                         )
+
+    with instr.timer("render.markers"):
+        ## Plot flow element origins, the same few traces are added to every subplot
+        marker_traces = element_traces(result.markers)
+        rows, cols = fig._get_subplot_rows_columns()    ## rows, cols are range, not int
+        for row in rows:
+            for col in cols:
+                for trace in marker_traces:
+                    fig.add_trace(trace, row=row, col=col)
+
+    ## Update x-axis properties
+    fig.update_xaxes(#title_text='x',
+                     title_font_color='#000000',
+                     title_standoff=0,
+                     gridcolor='rgba(153, 153, 153, 0.75)', #999999 in RGB
+                     gridwidth=1,
+                     zerolinecolor='#000000',
+                     zerolinewidth=2,
+                     linecolor='#000000',
+                     linewidth=1,
+                     ticks='outside',
+                     ticklen=10,
+                     tickwidth=2,
+                     tickcolor='#000000',
+                     tickfont_color='#000000',
+                     minor_showgrid=True,
+                     minor_gridcolor='rgba(221, 221, 221, 0.50)', #DDDDDD in RGB, 0.50 opacity
+                     minor_ticks='outside',
+                     minor_ticklen=5,
+                     minor_tickwidth=2,
+                     minor_griddash='dot',
+                     hoverformat='.4f',
+                     range=list(window[0]) if window else [result.x_points.min(),result.x_points.max()],
+                    )
+
+
+    ## Update y-axis properties
+    fig.update_yaxes(#title_text='y',
+                     title_font_color='#000000',
+                     title_standoff=0,
+                     gridcolor='rgba(153, 153, 153, 0.75)', #999999 in RGB, 0.75 opacity
+                     gridwidth=1,
+                     zerolinecolor='#000000',
+                     zerolinewidth=2,
+                     linecolor='#000000',
+                     linewidth=1,
+                     ticks='outside',
+                     ticklen=10,
+                     tickwidth=2,
+                     tickcolor='#000000',
+                     tickfont_color='#000000',
+                     minor_showgrid=True,
+                     minor_gridcolor='rgba(221, 221, 221, 0.50)', #DDDDDD in RGB, 0.50 opacity
+                     minor_ticks='outside',
+                     minor_ticklen=5,
+                     minor_tickwidth=2,
+                     minor_griddash='dot',
+                     range=list(window[1]) if window else [result.y_points.min(),result.y_points.max()],
+                    )
+
+    ## Update figure layout
+    fig.update_layout(font_color='#000000',
+                      plot_bgcolor='rgba(255,255,255,1)',
+                      paper_bgcolor='rgba(255,255,255,1)',
+                      width=FIGURE_WIDTH,
+                      height=FIGURE_HEIGHT,
+                      showlegend=False,
+                     )
+
+    return fig
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Barnes-Hut tree code for the fields of many point elements.
+
+The potential and stream function of sources, vortices and doublets are the
+real and imaginary parts of analytic functions of z = x + iy:
+
+    phi = Re(F_phi),    psi = Im(F_psi),    u - iv = F_phi'(z)
+
+    Source   (k = m / 2pi) : F_phi = F_psi = k Log(z - w)
+    Vortex   (k = G / 2pi) : F_phi = -ik Log(z - w),  F_psi = ik Log(z - w)
+    Doublet  (k = m / 2pi) : F_phi = -k e^(i alpha) / (z - w),
+                             F_psi = -k e^(-i alpha) / (z - w)
+
+which reproduces the conventions of the numpy kernels in fieldengine. The
+elements are clustered into a quadtree, and every cluster stores the
+multipole expansion of both functions about its center,
+
+    F(z) ~ a_0 Log(z - c) + sum_{n=1..p} a_n / (z - c)^n.
+
+A cluster far enough from a point, |z - c| > R / THETA with R the cluster
+radius, is evaluated through its expansion, with a relative truncation
+error below (p + 2) THETA^(p + 1); closer clusters are opened, down to direct
+summation in the leaves. As Log and atan2 are cut along the negative real
+axis, an expansion only reproduces the principal branches of its elements
+if the horizontal ray from the point towards +x misses the cluster; other
+points open the cluster as well.
+
+Freestreams, line sources and other objects are summed directly, as are all
+objects if fewer than MIN_ELEMENTS of them are clustered.
+"""
+
+# Library imports
+import numpy as np
+import potentialflowvisualizer as pfv
+import src.cancellation as cancel
+import src.fieldengine as fe
+from src.elementstore import ElementStore
+
+"""
+Opening angle: ratio of cluster radius to distance below which a cluster is
+evaluated through its expansion.
+"""
+THETA     = 0.5
+
+"""
+Maximum number of elements in a leaf of the tree.
+"""
+LEAF_SIZE = 32
+
+"""
+Object types that are clustered in the tree.
+"""
+TREE_TYPES = (pfv.Source, pfv.Vortex, pfv.Doublet)
+
+"""
+Number of clustered elements below which direct summation is used instead,
+as building the tree does not pay off.
+"""
+MIN_ELEMENTS = 256
+
+## Functions
+def expansion_order(tolerance, theta=THETA):
+    """
+    Number of multipole terms p such that (p + 2) theta^(p + 1) <= tolerance,
+    which bounds the truncation error of the velocity, the derivative of the
+    expansion, and thereby the one of the potentials.
+    """
+    p = 1
+    while (p + 2) * theta ** (p + 1) > tolerance:
+        p += 1
+    return p
+
+def element_coefficients(elements):
+    """
+    Positions and complex coefficients of the point elements.
+
+    Parameters:
+        elements : ElementStore
+            Elements of the TREE_TYPES only.
+    Returns:
+        w        : np.ndarray
+            (n,) complex positions, in insertion order.
+        log_phi, log_psi : np.ndarray
+            (n,) coefficients of Log(z - w) in F_phi and F_psi.
+        dip_phi, dip_psi : np.ndarray
+            (n,) coefficients of 1 / (z - w) in F_phi and F_psi.
+    """
+    n       = len(elements)
+    w       = np.empty(n, dtype=complex)
+    log_phi = np.zeros(n, dtype=complex)
+    log_psi = np.zeros(n, dtype=complex)
+    dip_phi = np.zeros(n, dtype=complex)
+    dip_psi = np.zeros(n, dtype=complex)
+    for cls, rows, params in elements.blocks():
+        k       = params["strength"][:, 0] / (2 * np.pi)
+        w[rows] = params["x"][:, 0] + 1j * params["y"][:, 0]
+        if cls is pfv.Source:
+            log_phi[rows] = k
+            log_psi[rows] = k
+        elif cls is pfv.Vortex:
+            log_phi[rows] = -1j * k
+            log_psi[rows] = 1j * k
+        else:
+            dip_phi[rows] = -k * np.exp(1j * params["alpha"][:, 0])
+            dip_psi[rows] = -k * np.exp(-1j * params["alpha"][:, 0])
+
+    return w, log_phi, log_psi, dip_phi, dip_psi
+
+## Node Class
+class Node:
+    """
+    Cluster of point elements with the multipole expansions of their
+    complex potentials.
+
+    Attributes:
+        members  : np.ndarray
+            Indices of the elements in the cluster.
+        center   : complex
+            Expansion center, the center of the bounding box.
+        radius   : float
+            Largest distance of an element to the center.
+        bounds   : tuple of float
+            (xmin, xmax, ymin, ymax) of the elements.
+        phi, psi : np.ndarray
+            (p + 1,) expansion coefficients a_0..a_p of F_phi and F_psi.
+        children : list of Node
+            Sub-clusters, empty for a leaf.
+    """
+    def __init__(self, members, elements, order, leaf_size=LEAF_SIZE):
+        w, log_phi, log_psi, dip_phi, dip_psi = elements
+        self.members  = members
+        z             = w[members]
+        self.bounds   = (z.real.min(), z.real.max(), z.imag.min(), z.imag.max())
+        self.center   = complex((self.bounds[0] + self.bounds[1]) / 2, (self.bounds[2] + self.bounds[3]) / 2)
+        d             = z - self.center
+        self.radius   = float(np.abs(d).max())
+
+        ## a_0 = sum c,  a_n = -sum c d^n / n + sum e d^(n-1)
+        n             = np.arange(1, order + 1)
+        powers        = d[:, None] ** np.arange(order + 1)[None, :]
+        self.phi      = np.empty(order + 1, dtype=complex)
+        self.psi      = np.empty(order + 1, dtype=complex)
+        for a, c, e in ((self.phi, log_phi[members], dip_phi[members]),
+                        (self.psi, log_psi[members], dip_psi[members])):
+            a[0]  = c.sum()
+            a[1:] = -(c @ powers[:, 1:]) / n + e @ powers[:, :-1]
+
+        self.children = []
+        if len(members) > leaf_size and self.radius > 0:
+            right = z.real > self.center.real
+            upper = z.imag > self.center.imag
+            for quadrant in (~right & ~upper, right & ~upper, ~right & upper, right & upper):
+                if quadrant.any():
+                    self.children.append(Node(members[quadrant], elements, order, leaf_size))
+
+    def evaluate(self, z, potentials=True):
+        """
+        Expansion of the cluster at the points z, see the module docstring.
+
+        Returns:
+            u, v, phi, psi : np.ndarray
+                Real arrays, the last two only if potentials is True.
+        """
+        zeta  = z - self.center
+        inv   = 1 / zeta
+        ## Horner evaluation of sum a_n inv^n and of its derivative -sum n a_n inv^(n + 1)
+        s_phi = np.zeros_like(zeta)
+        ds    = np.zeros_like(zeta)
+        s_psi = np.zeros_like(zeta)
+        for n in range(len(self.phi) - 1, 0, -1):
+            s_phi = (s_phi + self.phi[n]) * inv
+            ds    = (ds - n * self.phi[n]) * inv
+            if potentials:
+                s_psi = (s_psi + self.psi[n]) * inv
+        dF = self.phi[0] * inv + ds * inv
+        if not potentials:
+            return dF.real, -dF.imag
+
+        log   = np.log(zeta)
+        phi   = (self.phi[0] * log + s_phi).real
+        psi   = (self.psi[0] * log + s_psi).imag
+        return dF.real, -dF.imag, phi, psi
+
+def evaluate_field(objects, points, tolerance=1e-6, potentials=True, out=None, backend="numpy",
+                   theta=THETA, leaf_size=LEAF_SIZE):
+    """
+    Approximates the superposed fields of the flow objects at the points,
+    see fe.evaluate_field() for the other parameters and the returns.
+
+    Parameters:
+        tolerance : float
+            Relative truncation error of a cluster expansion, which sets
+            the number of terms, see expansion_order().
+        theta     : float, optional
+            Opening angle, see THETA.
+        leaf_size : int, optional
+            Maximum number of elements in a leaf, see LEAF_SIZE.
+    """
+    if isinstance(objects, ElementStore):
+        clustered = objects.subset(TREE_TYPES)
+        others    = objects.subset(set(fe.KERNEL_DICT) - set(TREE_TYPES))
+    else:
+        objects   = list(objects)
+        clustered = ElementStore(object for object in objects if object.__class__ in TREE_TYPES)
+        others    = [object for object in objects if object.__class__ not in TREE_TYPES]
+    if len(clustered) < MIN_ELEMENTS:
+        return fe.evaluate_field(objects, points, potentials=potentials, out=out, backend=backend)
+
+    ## Directly summed objects first
+    fields    = fe.evaluate_field(others, points, potentials=potentials, backend=backend)
+
+    ids       = np.array(list(clustered), dtype=np.int64)
+    elements  = element_coefficients(clustered)
+    root      = Node(np.arange(len(clustered)), elements, expansion_order(tolerance, theta), leaf_size)
+    z         = points[:, 0] + 1j * points[:, 1]
+
+    stack     = [(root, np.arange(points.shape[0]))]
+    with np.errstate(all="ignore"):
+        while stack:
+            cancel.checkpoint()
+            node, targets = stack.pop()
+            zt    = z[targets]
+            xmin, xmax, ymin, ymax = node.bounds
+            far   = np.abs(zt - node.center) * theta > node.radius
+            ## The branch cuts of the elements pass the points left of the cluster, at its height
+            far  &= ~((zt.imag >= ymin) & (zt.imag <= ymax) & (zt.real < xmax))
+            if far.any():
+                for field, value in zip(fields, node.evaluate(zt[far], potentials)):
+                    field[targets[far]] += value
+            near  = targets[~far]
+            if len(near) == 0:
+                continue
+            if node.children:
+                stack.extend((child, near) for child in node.children)
+            else:
+                values = fe.evaluate_field(clustered.take(ids[node.members].tolist()), points[near],
+                                           potentials=potentials, backend=backend)
+                for field, value in zip(fields, values):
+                    field[near] += value
+
+    if out is None:
+        return fields
+    for buffer, field in zip(out, fields):
+        buffer[...] = field
+    return tuple(out[:len(fields)])
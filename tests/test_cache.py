@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import threading
+import time
+import numpy as np
+import pytest
+import src.cache as cache
+import src.cancellation as cancel
+
+## Functions
+def test_evicts_least_recently_used():
+    lru = cache.LRUCache(max_entries=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1        ## "b" is now the least recently used
+    lru.put("c", 3)
+    assert "b" not in lru
+    assert lru.get("a") == 1 and lru.get("c") == 3
+
+def test_byte_bound():
+    lru = cache.LRUCache(max_entries=10, max_bytes=3 * 800)
+    for key in "abc":
+        lru.put(key, np.zeros(100))
+    assert lru.nbytes == 3 * 800
+    lru.put("d", (np.zeros(100), {"nested": np.zeros(50)}))
+    assert "a" not in lru and "b" not in lru
+    assert lru.nbytes == 800 + 1200
+
+    ## Too large for the cache on its own: not stored
+    lru.put("e", np.zeros(1000))
+    assert "e" not in lru
+    lru.pop("c")
+    assert lru.nbytes == 1200
+
+def test_get_or_compute_hit():
+    lru = cache.LRUCache()
+    assert lru.get_or_compute("a", lambda: 1) == (1, False)
+    assert lru.get_or_compute("a", lambda: 2) == (1, True)
+
+def run_concurrently(lru, key, compute, n_threads):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(lru.get_or_compute(key, compute)))
+               for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+def test_pending_key_computed_once():
+    lru   = cache.LRUCache()
+    calls = []
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return np.arange(3)
+
+    results = run_concurrently(lru, "a", compute, 4)
+    assert len(calls) == 1
+    assert sorted(hit for _, hit in results) == [False, True, True, True]
+
+def test_late_caller_waits_for_recomputation():
+    ## A value too large to keep wakes the waiter without a result, such that it computes again; a
+    ## caller arriving meanwhile must wait for that computation instead of running its own at once
+    lru      = cache.LRUCache(max_bytes=0)
+    running  = []
+    overlap  = []
+    started  = threading.Event()
+    release  = [threading.Event(), threading.Event()]
+    def compute(event):
+        running.append(1)
+        overlap.append(len(running))
+        started.set()
+        event.wait(10)
+        running.pop()
+        return np.arange(3)
+
+    first    = threading.Thread(target=lambda: lru.get_or_compute("a", lambda: compute(release[0])))
+    first.start()
+    started.wait(10)
+    started.clear()
+    waiter   = threading.Thread(target=lambda: lru.get_or_compute("a", lambda: compute(release[1])))
+    waiter.start()
+    time.sleep(0.1)
+    release[0].set()
+    assert started.wait(10)             ## The waiter computes again
+
+    late     = threading.Thread(target=lambda: lru.get_or_compute("a", lambda: compute(release[1])))
+    late.start()
+    time.sleep(0.1)
+    release[1].set()
+    for thread in (first, waiter, late):
+        thread.join(10)
+    assert len(overlap) == 3
+    assert max(overlap) == 1
+    assert not lru._pending
+
+def test_cancelled_waiter_stops_waiting():
+    lru      = cache.LRUCache()
+    release  = threading.Event()
+    computer = threading.Thread(target=lambda: lru.get_or_compute("a", lambda: release.wait(10)))
+    computer.start()
+    time.sleep(0.05)
+
+    token    = cancel.CancelToken()
+    token.cancel()
+    start    = time.perf_counter()
+    with cancel.cancellable(token), pytest.raises(cancel.Cancelled):
+        lru.get_or_compute("a", lambda: 2)
+    assert time.perf_counter() - start < 1
+
+    release.set()
+    computer.join(10)
+    assert lru.get_or_compute("a", lambda: 2) == (True, True)
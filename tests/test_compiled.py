@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import os
+import subprocess
+import sys
+import textwrap
+import pytest
+import src.compiled as compiled
+
+pytestmark = pytest.mark.skipif(not compiled.AVAILABLE, reason="numba is not installed")
+
+## Runs in a fresh process, as the workqueue threading layer aborts it on concurrent kernel calls
+CONCURRENT_SCRIPT = textwrap.dedent("""
+    import threading
+    import numpy as np
+    import potentialflowvisualizer as pfv
+    import src.compiled as compiled
+
+    objects = [pfv.Source(1, 0.1 * i, 0) for i in range(50)]
+    points  = np.random.default_rng(0).random((100000, 2))
+    expected = compiled.evaluate_field(objects, points)
+    results  = []
+    def evaluate():
+        results.append(compiled.evaluate_field(objects, points))
+    threads = [threading.Thread(target=evaluate) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 3
+    assert all(np.array_equal(a, b) for result in results for a, b in zip(result, expected))
+""")
+
+def test_concurrent_calls_with_workqueue_layer():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env  = dict(os.environ, NUMBA_THREADING_LAYER="workqueue", PYTHONPATH=root)
+    run  = subprocess.run([sys.executable, "-c", CONCURRENT_SCRIPT], env=env, cwd=root,
+                          capture_output=True, text=True, timeout=600)
+    assert run.returncode == 0, run.stderr
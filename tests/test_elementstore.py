@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import potentialflowvisualizer as pfv
+import pytest
+from src.elementstore import ElementStore, INITIAL_CAPACITY
+
+## Functions
+def parameters_of(object):
+    return {name: float(value) for name, value in object.__dict__.items()}
+
+def test_add_get_and_ids():
+    objects = [pfv.Freestream(1, 0), pfv.Source(2, 0.5, 0), pfv.Vortex(-1, 0, 1)]
+    store   = ElementStore(objects)
+    ids     = list(store)
+    assert ids == [1, 2, 3]
+    assert len(store) == 3
+    for id, object in zip(ids, objects):
+        assert store.element_class(id) is object.__class__
+        assert parameters_of(store.get(id)) == parameters_of(object)
+
+def test_add_copies_parameters():
+    source = pfv.Source(1, 0, 0)
+    store  = ElementStore([source])
+    source.strength = 5
+    assert store.parameters(1)["strength"] == 1
+
+def test_unsupported_class():
+    with pytest.raises(ValueError):
+        ElementStore().add(object())
+
+def test_remove_keeps_ids_and_order():
+    ## More sources than the initial capacity, such that the arrays grow and rows move on removal
+    store = ElementStore(pfv.Source(i, i, 0) for i in range(INITIAL_CAPACITY + 3))
+    store.add(pfv.Vortex(1, 0, 0))
+    store.remove(2)
+    store.remove(5)
+    assert list(store) == [id for id in range(1, INITIAL_CAPACITY + 5) if id not in (2, 5)]
+    assert 2 not in store
+    for id in store:
+        if store.element_class(id) is pfv.Source:
+            assert store.parameters(id)["strength"] == id - 1
+    with pytest.raises(KeyError):
+        store.get(2)
+
+    ## IDs are not reused
+    assert store.add(pfv.Source(1, 0, 0)) == INITIAL_CAPACITY + 5
+
+def test_update():
+    store = ElementStore([pfv.Source(1, 0, 0), pfv.Doublet(1, 0, 0, 0)])
+    store.update(2, x=1.5, alpha=0.3)
+    assert store.parameters(2) == {"strength": 1.0, "x": 1.5, "y": 0.0, "alpha": 0.3}
+    assert store.parameters(1) == {"strength": 1.0, "x": 0.0, "y": 0.0}
+    with pytest.raises(ValueError):
+        store.update(1, alpha=1)
+
+def test_records_track_edits():
+    store  = ElementStore([pfv.Source(1, 0, 0), pfv.Vortex(2, 1, 0)])
+    before = store.records()
+    store.update(2, strength=3)
+    after  = store.records()
+    assert before[1] == after[1]
+    assert before[2] != after[2] == (pfv.Vortex, (3.0, 1.0, 0.0))
+
+def test_copy_is_independent():
+    store = ElementStore([pfv.Source(1, 0, 0)])
+    copy  = store.copy()
+    copy.update(1, strength=2)
+    copy.add(pfv.Vortex(1, 0, 0))
+    assert store.parameters(1)["strength"] == 1
+    assert len(store) == 1
+    assert list(copy) == [1, 2]
+
+def test_objects_in_insertion_order():
+    objects = [pfv.Vortex(1, 0, 0), pfv.Source(1, 0, 0), pfv.Vortex(2, 0, 0), pfv.Freestream(1, 1)]
+    store   = ElementStore(objects)
+    assert [object.__class__ for object in store.objects()] == [object.__class__ for object in objects]
+    classes, params = store.table()
+    assert classes == [object.__class__ for object in objects]
+    assert params[2, 0] == 2
+
+def test_content_hash_ignores_order_and_ids():
+    objects  = [pfv.Source(1, 0, 0), pfv.Vortex(2, 1, 0), pfv.Doublet(1, 0, 1, 0.5)]
+    store    = ElementStore(objects)
+    shuffled = ElementStore([pfv.Freestream(1, 0)] + objects[::-1])
+    shuffled.remove(1)
+    assert store.content_hash() == shuffled.content_hash()
+
+    shuffled.update(list(shuffled)[0], alpha=0.6)
+    assert store.content_hash() != shuffled.content_hash()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import numpy as np
+import potentialflowvisualizer as pfv
+import pytest
+import src.fieldengine as fe
+from src.elementstore import ElementStore
+
+## Functions
+def flow_objects():
+    """
+    Two flow objects of every type, interleaved such that the summation
+    order differs from the grouping by type.
+    """
+    return [pfv.Freestream(1.5, 0.3),
+            pfv.Source(2.0, -0.4, 0.1),
+            pfv.Vortex(-1.2, 0.5, -0.7),
+            pfv.Doublet(0.8, 0.2, 0.9, 0.4),
+            pfv.LineSource(1.1, -1.0, -0.5, 0.7, -0.2),
+            pfv.Source(-0.6, 1.3, 0.4),
+            pfv.Freestream(-0.2, 0.7),
+            pfv.LineSource(0.4, 0.3, 1.2, -0.9, 1.5),
+            pfv.Doublet(-1.4, -1.1, -0.3, -2.0),
+            pfv.Vortex(0.9, -0.8, 1.1),
+           ]
+
+def summed_fields(objects, points):
+    """
+    Fields summed object by object with the potentialflowvisualizer module.
+    """
+    fields = [np.zeros(len(points)) for _ in range(4)]
+    for object in objects:
+        fields[0] += object.get_x_velocity_at(points)
+        fields[1] += object.get_y_velocity_at(points)
+        fields[2] += object.get_potential_at(points)
+        fields[3] += object.get_streamfunction_at(points)
+    return fields
+
+@pytest.mark.parametrize("container", [list, ElementStore])
+@pytest.mark.parametrize("chunk_size", [None, 37])
+def test_matches_object_summation_exactly(container, chunk_size):
+    objects  = flow_objects()
+    points   = np.random.default_rng(1).uniform(-3, 3, (500, 2))
+    expected = summed_fields(objects, points)
+
+    fields   = fe.evaluate_field(container(objects), points, chunk_size=chunk_size)
+    for field, reference in zip(fields, expected):
+        assert np.array_equal(field, reference)
+
+def test_velocity_only():
+    objects  = flow_objects()
+    points   = np.random.default_rng(2).uniform(-3, 3, (200, 2))
+    expected = summed_fields(objects, points)
+
+    fields   = fe.evaluate_field(objects, points, potentials=False)
+    assert len(fields) == 2
+    for field, reference in zip(fields, expected):
+        assert np.array_equal(field, reference)
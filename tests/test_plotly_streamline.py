@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import potentialflowvisualizer as pfv
+import pytest
+import src.plotly_streamline as strline
+from src.flowfield import Flowfield
+
+## Functions
+@pytest.fixture(scope="module")
+def grid_fields():
+    field  = Flowfield([pfv.Freestream(1, 0.2), pfv.Source(1, -1, 0.3), pfv.Vortex(-2, 1, -0.5),
+                        pfv.Doublet(1, 0.5, 1.2, 0.4)])
+    points = np.linspace(-3, 3, 120)
+    _, fields = field.compute_fields(points, points)
+    return points, fields["xvel"], fields["yvel"]
+
+def lines_of(grid_fields, **kwargs):
+    points, u, v = grid_fields
+    with np.errstate(all="ignore"):
+        streamlines = strline.Streamlines(points, points, u, v, density=1.5, method="rk4_vectorized", **kwargs)
+    return streamlines.lines_x, streamlines.lines_y, streamlines.n_lines
+
+@pytest.mark.parametrize("tiles", [2, 3])
+def test_tiles_independent_of_workers(grid_fields, tiles):
+    serial = lines_of(grid_fields, tiles=tiles)
+    assert serial[2] > 0
+    for workers in (1, 3):
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            parallel = lines_of(grid_fields, tiles=tiles, executor=executor)
+        assert parallel[2] == serial[2]
+        for a, b in zip(parallel[:2], serial[:2]):
+            np.testing.assert_array_equal(a, b)
+
+def test_vectorized_matches_sequential(grid_fields):
+    points, u, v = grid_fields
+    with np.errstate(all="ignore"):
+        sequential = strline.Streamlines(points, points, u, v, density=1.5, method="rk4")
+        vectorized = strline.Streamlines(points, points, u, v, density=1.5, method="rk4_vectorized")
+    assert vectorized.n_steps == sequential.n_steps
+    np.testing.assert_array_equal(vectorized.lines_x, sequential.lines_x)
+    np.testing.assert_array_equal(vectorized.lines_y, sequential.lines_y)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import potentialflowvisualizer as pfv
+import src.fieldengine as fe
+from src.flowfield import Flowfield
+from src.progressive import ProgressiveDraw, coarse_pass
+
+## Functions
+def draw(field, executor, compute_kwargs):
+    """
+    Draws the field like the app: a coarse preview in this thread, then the
+    full pass on the executor.
+    """
+    job = ProgressiveDraw(field, [coarse_pass(compute_kwargs), compute_kwargs], {}, debounce=0)
+    job.preview()
+    job.start(executor)
+    assert job.wait(60)
+    assert job.level == 1
+
+def test_background_passes_superpose_incrementally(monkeypatch):
+    calls    = []
+    evaluate = fe.evaluate_field
+    def counting_evaluate_field(objects, points, *args, **kwargs):
+        calls.append((len(objects), len(points)))
+        return evaluate(objects, points, *args, **kwargs)
+    monkeypatch.setattr(fe, "evaluate_field", counting_evaluate_field)
+
+    field          = Flowfield([pfv.Freestream(1, 0)] + [pfv.Source(1, x, y) for x in range(-3, 4) for y in range(-3, 4)])
+    compute_kwargs = dict(x_points=np.linspace(-5, 5, 80), y_points=np.linspace(-5, 5, 80), n_streamline_density=0.2)
+    n_full         = len(compute_kwargs["x_points"]) * len(compute_kwargs["y_points"])
+    with ThreadPoolExecutor(1) as executor:
+        draw(field, executor, compute_kwargs)
+        assert (len(field.objects), n_full) in calls
+
+        ids = list(field.objects.records())
+        for strength in (2, 3):
+            calls.clear()
+            field.objects.update(ids[5], strength=strength)
+            draw(field, executor, compute_kwargs)
+
+            ## The edited element is subtracted and added again, on both grids
+            assert max(n_objects for n_objects, _ in calls) == 1
+            assert sum(n_points == n_full for _, n_points in calls) == 2
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Library imports
+import numpy as np
+import potentialflowvisualizer as pfv
+import pytest
+import src.fieldengine as fe
+import src.treecode as tc
+from src.elementstore import ElementStore
+
+"""
+Centers of the clusters of point elements.
+"""
+CENTERS = ((-3.0, 0.0), (2.0, 1.5), (1.0, -2.5))
+
+## Functions
+def clustered_objects(n=3 * 120, seed=0):
+    """
+    A freestream and n mixed sources, vortices and doublets around CENTERS,
+    more than tc.MIN_ELEMENTS such that the tree is used.
+    """
+    rng     = np.random.default_rng(seed)
+    objects = [pfv.Freestream(1.0, 0.2)]
+    for i in range(n):
+        cx, cy   = CENTERS[i % 3]
+        x, y     = cx + rng.normal(0, 0.3), cy + rng.normal(0, 0.3)
+        strength = rng.uniform(-1, 1)
+        kind     = (i // 3) % 3
+        if kind == 0:
+            objects.append(pfv.Source(strength, x, y))
+        elif kind == 1:
+            objects.append(pfv.Vortex(strength, x, y))
+        else:
+            objects.append(pfv.Doublet(strength, x, y, rng.uniform(0, 2 * np.pi)))
+    return objects
+
+def evaluation_points(seed=1):
+    """
+    Random points, and points left of every cluster at its height, where
+    the branch cuts of its elements pass.
+    """
+    rng    = np.random.default_rng(seed)
+    left   = [(cx - distance, cy + offset) for cx, cy in CENTERS
+              for distance in (1.5, 3.0, 6.0) for offset in np.linspace(-0.5, 0.5, 11)]
+    return np.vstack((rng.uniform(-8, 8, (2000, 2)), left))
+
+@pytest.mark.parametrize("tolerance", [1e-3, 1e-6])
+@pytest.mark.parametrize("container", [list, ElementStore])
+def test_error_within_tolerance(tolerance, container):
+    objects = clustered_objects()
+    assert len(objects) - 1 > tc.MIN_ELEMENTS
+    points  = evaluation_points()
+
+    exact   = fe.evaluate_field(objects, points)
+    approx  = tc.evaluate_field(container(objects), points, tolerance)
+    for field, reference in zip(approx, exact):
+        assert np.abs(field - reference).max() <= tolerance * np.abs(reference).max()
+
+def test_few_elements_summed_directly():
+    objects = clustered_objects(n=30)
+    points  = evaluation_points()
+    for field, reference in zip(tc.evaluate_field(objects, points, 1e-3), fe.evaluate_field(objects, points)):
+        assert np.array_equal(field, reference)